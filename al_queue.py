@@ -0,0 +1,136 @@
+"""
+Uncertainty priority queue for active-learning sampling.
+
+Unlabelled folders sit in a min-heap keyed by model certainty, so the most
+uncertain one is picked in O(log n). A pick hands out a time-limited lease:
+concurrent sessions never get the same folder, and folders whose lease
+expires (labeller left mid-way) go back into the queue.
+Stale heap entries (re-prioritised, leased or labelled folders) are skipped
+lazily when they reach the top.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+# Seconds a session may hold a folder before it goes back to the queue
+LEASE_TTL = 1800
+
+
+class UncertaintyQueue:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []  # (certainty, version, folder_id)
+        self._version = {}  # folder_id -> version of its live heap entry
+        self._certainty = {}  # folder_id -> certainty
+        self._leases = {}  # folder_id -> (expiry, session_id, token)
+        self._expiries = []  # (expiry, token, folder_id)
+        self._done = set()
+        self._counter = itertools.count()
+
+    def _push(self, folder_id, certainty):
+        version = next(self._counter)
+        self._version[folder_id] = version
+        self._certainty[folder_id] = certainty
+        heapq.heappush(self._heap, (certainty, version, folder_id))
+
+    def _requeue(self, folder_id):
+        certainty = self._certainty.get(folder_id)
+        if certainty is None:
+            # Left the active learning table since it was leased (removed by a sync)
+            print(f"Not re-queueing {folder_id}: no longer in the active learning table")
+            return
+        self._push(folder_id, certainty)
+
+    def _reclaim_expired(self, now):
+        while self._expiries and self._expiries[0][0] <= now:
+            _, token, folder_id = heapq.heappop(self._expiries)
+            lease = self._leases.get(folder_id)
+            if lease is not None and lease[2] == token:
+                del self._leases[folder_id]
+                self._requeue(folder_id)
+
+    def sync(self, frame, label_column='label', unlabelled=5):
+        """
+        Rebuild the queue from the active learning table, keeping live leases.
+        O(n) (heapify), meant to run periodically, not per pick.
+        """
+        unlabelled_mask = frame[label_column] == unlabelled
+        pending = frame.loc[unlabelled_mask, ['folder_id', 'certainty']]
+        labelled = set(frame.loc[~unlabelled_mask, 'folder_id'])
+        with self._lock:
+            self._done |= labelled
+            for folder_id in labelled:
+                self._leases.pop(folder_id, None)
+            self._heap = []
+            self._version = {}
+            self._certainty = {}
+            for folder_id, certainty in zip(pending['folder_id'], pending['certainty']):
+                if folder_id in self._done:
+                    continue
+                version = next(self._counter)
+                self._certainty[folder_id] = certainty
+                if folder_id not in self._leases:
+                    self._version[folder_id] = version
+                    self._heap.append((certainty, version, folder_id))
+            heapq.heapify(self._heap)
+
+    def lease(self, session_id, k=1, ttl=LEASE_TTL):
+        """
+        Lease the k most uncertain available folders to a session
+
+        Output: list of folder ids (shorter than k if the queue runs out)
+        """
+        now = time.time()
+        picked = []
+        with self._lock:
+            self._reclaim_expired(now)
+            while self._heap and len(picked) < k:
+                certainty, version, folder_id = heapq.heappop(self._heap)
+                if self._version.get(folder_id) != version:
+                    continue
+                del self._version[folder_id]
+                token = next(self._counter)
+                self._leases[folder_id] = (now + ttl, session_id, token)
+                heapq.heappush(self._expiries, (now + ttl, token, folder_id))
+                picked.append(folder_id)
+        return picked
+
+    def release(self, folder_id):
+        """
+        Give a leased folder back without labelling it
+        """
+        with self._lock:
+            if self._leases.pop(folder_id, None) is not None and folder_id not in self._done:
+                self._requeue(folder_id)
+
+    def complete(self, folder_id):
+        """
+        Mark a folder as labelled: it never comes back
+        """
+        with self._lock:
+            self._leases.pop(folder_id, None)
+            self._version.pop(folder_id, None)
+            self._done.add(folder_id)
+
+    def update_certainty(self, folder_id, certainty):
+        """
+        Re-prioritise a folder (O(log n), the old heap entry becomes stale)
+        """
+        with self._lock:
+            if folder_id in self._done:
+                return
+            if folder_id in self._leases:
+                self._certainty[folder_id] = certainty
+            else:
+                self._push(folder_id, certainty)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._version)
+
+    def leased(self):
+        with self._lock:
+            return len(self._leases)
@@ -0,0 +1,148 @@
+"""
+Active-learning state store.
+
+The base table (close_nhoods_prediction.csv) is only rewritten by the
+materialiser. Label/certainty updates are appended as events (see
+event_log.py) and kept in a hash index keyed on folder_id. Updates are
+merged field by field with last-writer-wins on the event time, so the
+result does not depend on the order in which events are read and two
+labellers saving at the same time never overwrite each other's folders.
+
+The materialiser folds the events into a new base table and then deletes
+them, so every refresh revalidates the base table (conditional GET on its
+ETag) and reloads everything when it was rewritten.
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+import event_log
+from storage import NotModified
+
+UPDATE_FIELDS = ('label', 'certainty')
+
+# Event keys are timestamped by each writer's clock; re-list this far back to tolerate skew
+CLOCK_SKEW = timedelta(seconds=60)
+
+
+class ActiveLearningStore:
+
+    def __init__(self, store, prefix, base_key, parse_base):
+        """
+        Input: base_key -- key of the materialised base table
+               parse_base -- callable turning its bytes into a DataFrame
+        """
+        self._store = store
+        self.prefix = prefix
+        self.base_key = base_key
+        self._parse_base = parse_base
+        self._lock = threading.RLock()
+        self.base = None
+        self.base_etag = None
+        self.updates = {}  # folder_id -> {field: ((time, event_key), value)}
+        self._applied_keys = set()
+        self._last_key = None
+
+        self.reload()
+
+    def _apply(self, event):
+        folder_id = event['folder_id']
+        entry = self.updates.setdefault(folder_id, {})
+        # Ties on time are broken by event key so every reader converges to the same value
+        version = (event['time'], event['event_key'])
+        for field in UPDATE_FIELDS:
+            if event.get(field) is None:
+                continue
+            current = entry.get(field)
+            if current is None or version > current[0]:
+                entry[field] = (version, event[field])
+
+    def _ingest(self, keys):
+        keys = [key for key in keys if key not in self._applied_keys]
+        events = event_log.read_events(self._store, keys)
+        with self._lock:
+            for event in events:
+                self._apply(event)
+            self._applied_keys.update(keys)
+            if keys:
+                self._last_key = max(keys + [self._last_key or ''])
+
+    def reload(self):
+        """
+        Reload the base table and every pending event
+        """
+        body, etag = self._store.get_with_etag(self.base_key)
+        self._reset(self._parse_base(body), etag)
+
+    def _reset(self, base, etag):
+        with self._lock:
+            self.base = base
+            self.base_etag = etag
+            self.updates = {}
+            self._applied_keys = set()
+            self._last_key = None
+        self._ingest(event_log.list_event_keys(self._store, self.prefix))
+
+    def refresh(self):
+        """
+        Ingest only the events written since the last refresh,
+        or reload everything if the base table was rewritten by the materialiser
+        """
+        start_after = None
+        if self._last_key:
+            # Keys look like '{prefix}events/%Y%m%dT%H%M%S%f_...'
+            timestamp = self._last_key[len(f"{self.prefix}events/"):].split('_')[0]
+            since = datetime.strptime(timestamp, '%Y%m%dT%H%M%S%f') - CLOCK_SKEW
+            start_after = f"{self.prefix}events/{since:%Y%m%dT%H%M%S%f}"
+        # Listed before the base check: if the base is unchanged, none of these events was folded yet
+        keys = event_log.list_event_keys(self._store, self.prefix, start_after=start_after)
+        try:
+            body, etag = self._store.get_with_etag(self.base_key, if_none_match=self.base_etag)
+        except NotModified:
+            self._ingest(keys)
+            return
+        self._reset(self._parse_base(body), etag)
+
+    def update(self, folder_id, label=None, certainty=None, shard='anon'):
+        """
+        Record a label and/or certainty for one folder (one small PUT, O(1) locally)
+        """
+        self.update_many([{'folder_id': folder_id, 'label': label, 'certainty': certainty}], shard=shard)
+
+    def update_many(self, updates, shard='anon'):
+        """
+        Record several folder updates as a single event object
+        """
+        now = datetime.utcnow().isoformat()
+        events = [dict(update, time=now) for update in updates]
+        key = event_log.append_events(self._store, self.prefix, events, shard=shard)
+        with self._lock:
+            for event in events:
+                event['event_key'] = key
+                self._apply(event)
+            self._applied_keys.add(key)
+
+    def get(self, folder_id, field):
+        with self._lock:
+            entry = self.updates.get(folder_id, {})
+            if field in entry:
+                return entry[field][1]
+        return None
+
+    def frame(self):
+        """
+        Output: base table with all known updates applied (a new DataFrame)
+        """
+        with self._lock:
+            df = self.base.copy()
+            updates = {folder_id: dict(entry) for folder_id, entry in self.updates.items()}
+        for field in UPDATE_FIELDS:
+            values = {folder_id: entry[field][1] for folder_id, entry in updates.items() if field in entry}
+            if values and field in df.columns:
+                mask = df['folder_id'].isin(values.keys())
+                df.loc[mask, field] = df.loc[mask, 'folder_id'].map(values)
+        return df
+
+    def pending_keys(self):
+        with self._lock:
+            return sorted(self._applied_keys)
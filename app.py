@@ -2,7 +2,15 @@ import streamlit as st
 
 # Import from other modules of the app
 from labelling_interface import label_page 
-from auth import check_credentials
+from auth import check_credentials, start_session, user_from_query_params
+import metrics
+
+@st.cache_resource
+def start_metrics_exporters():
+    """
+    Prometheus endpoint (METRICS_PORT) and JSONL dump (METRICS_DUMP_PATH), once per process
+    """
+    return metrics.start_exporters()
 
 def login():
     st.title("Login Page")
@@ -16,6 +24,8 @@ def login():
             # Authentication successful
             st.session_state['authenticated'] = True
             st.session_state['user'] = username
+            # Signed token in the URL: reconnects skip this page
+            start_session(username)
             st.success(f"Welcome {username}!")
 
             # Force a rerun to go to the label page
@@ -23,7 +33,16 @@ def login():
         else:
             st.error("Incorrect username or password")
 
+start_metrics_exporters()
+
 # Check if the user is already authenticated
+if 'authenticated' not in st.session_state or not st.session_state['authenticated']:
+    # A valid session token (reconnect, worker restart) restores the session without a login
+    username = user_from_query_params()
+    if username is not None:
+        st.session_state['authenticated'] = True
+        st.session_state['user'] = username
+
 if 'authenticated' not in st.session_state or not st.session_state['authenticated']:
     login()
 else:
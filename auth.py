@@ -1,8 +1,140 @@
+"""
+Authentication: hashed credentials and signed session tokens.
+
+st.secrets["users"] maps each username to a PBKDF2 hash, as produced by
+
+    python auth.py hash <password>      ->  pbkdf2_sha256$<iterations>$<salt>$<hash>
+
+(plaintext entries are still accepted, so existing secrets keep working until replaced).
+
+After a login, the app puts a session token in the URL (?session=...):
+'username.expiry.signature', signed with HMAC-SHA256 using st.secrets["session_secret"].
+A reconnect or a worker restart validates the token instead of showing the login page.
+The verification map, the signing key and recent token checks are cached per process,
+so the check on each rerun does no secrets lookup and no hashing.
+"""
+
+import base64
+import functools
+import hashlib
+import hmac
+import secrets
+import sys
+import time
+
 import streamlit as st
 
+HASH_ALGORITHM = 'pbkdf2_sha256'
+HASH_ITERATIONS = 260_000
+SESSION_TTL = 7 * 24 * 3600
+SESSION_PARAM = 'session'
+
+
+def hash_password(password, iterations=HASH_ITERATIONS, salt=None):
+    salt = salt or secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return "$".join([HASH_ALGORITHM, str(iterations),
+                     base64.b64encode(salt).decode('ascii'), base64.b64encode(digest).decode('ascii')])
+
+
+def _parse_entry(entry):
+    """
+    Output: (iterations, salt, digest), or (None, None, plaintext bytes) for a legacy plaintext entry
+    """
+    parts = str(entry).split("$")
+    if len(parts) == 4 and parts[0] == HASH_ALGORITHM:
+        return int(parts[1]), base64.b64decode(parts[2]), base64.b64decode(parts[3])
+    return None, None, str(entry).encode('utf-8')
+
+
+@st.cache_resource
+def get_credentials():
+    """
+    Verification map username -> (iterations, salt, digest), parsed once per process
+    """
+    return {username: _parse_entry(entry) for username, entry in st.secrets["users"].items()}
+
+
+@functools.lru_cache(maxsize=1)
+def _dummy_entry():
+    # Compared against for unknown usernames, so they take as long as a wrong password
+    return _parse_entry(hash_password(secrets.token_hex(8)))
+
+
 def check_credentials(username, password):
-    # Get user credentials from Streamlit secrets
-    user_credentials = st.secrets["users"]
-    
-    # Check if the username exists and the password matches
-    return user_credentials.get(username) == password
\ No newline at end of file
+    entry = get_credentials().get(username)
+    iterations, salt, expected = entry if entry is not None else _dummy_entry()
+    if iterations is None:
+        candidate = password.encode('utf-8')
+    else:
+        candidate = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return hmac.compare_digest(candidate, expected) and entry is not None
+
+
+@st.cache_resource
+def _signing_key():
+    key = st.secrets.get("session_secret")
+    if not key:
+        # Tokens then only survive reconnects, not restarts
+        print("No session_secret in secrets: using a per-process session key")
+        return secrets.token_bytes(32)
+    return str(key).encode('utf-8')
+
+
+def _sign(payload):
+    digest = hmac.new(_signing_key(), payload.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode('ascii').rstrip("=")
+
+
+def issue_token(username, ttl=SESSION_TTL):
+    username = base64.urlsafe_b64encode(username.encode('utf-8')).decode('ascii').rstrip("=")
+    payload = f"{username}.{int(time.time() + ttl)}"
+    return f"{payload}.{_sign(payload)}"
+
+
+@functools.lru_cache(maxsize=1024)
+def _verify_token(token):
+    """
+    Output: (username, expiry) if the signature is valid, else None (cached: tokens are immutable)
+    """
+    try:
+        encoded_username, expiry, signature = token.split(".")
+        if not hmac.compare_digest(signature, _sign(f"{encoded_username}.{expiry}")):
+            return None
+        padding = "=" * (-len(encoded_username) % 4)
+        return base64.urlsafe_b64decode(encoded_username + padding).decode('utf-8'), int(expiry)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def validate_token(token):
+    """
+    Output: username if the token is valid and not expired, else None
+    """
+    verified = _verify_token(token) if token else None
+    if verified is None or verified[1] < time.time():
+        return None
+    username = verified[0]
+    # Users removed from the secrets lose access even with a live token
+    if username not in get_credentials():
+        return None
+    return username
+
+
+def user_from_query_params():
+    """
+    Username of the session token in the URL, or None
+    """
+    token = st.experimental_get_query_params().get(SESSION_PARAM, [None])[0]
+    return validate_token(token)
+
+
+def start_session(username):
+    st.experimental_set_query_params(**{SESSION_PARAM: issue_token(username)})
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "hash":
+        print("Usage: python auth.py hash <password>")
+        sys.exit(1)
+    print(hash_password(sys.argv[2]))
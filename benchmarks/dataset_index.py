@@ -0,0 +1,80 @@
+"""
+Per-click latency of the "already in dataset" checks against the number of folders.
+
+Before: get_indexes_in_dataset() and already_in_dataset() each listed the whole
+DetroitImageDataset_v2/ prefix (paginated, 1000 keys per page) and re-parsed
+every folder name. After: both are lookups in the DatasetIndex, which lists once.
+
+The S3 listing is simulated: --page-latency seconds per page of 1000 folders.
+
+    python -m benchmarks.dataset_index --folders 1000,10000,50000
+"""
+
+import argparse
+import random
+import time
+
+from dataset_index import DatasetIndex
+
+PAGE_SIZE = 1000
+
+
+def make_folders(n, seed=0):
+    rng = random.Random(seed)
+    return [f"{p}_{rng.choice([0, 90, 180, 270])}_{42.3 + rng.random() * 0.1}_{-83.1 + rng.random() * 0.1}"
+            for p in range(n)]
+
+
+def paginated_lister(folders, page_latency):
+    def list_folders():
+        names = []
+        for start in range(0, len(folders), PAGE_SIZE):
+            time.sleep(page_latency)
+            names.extend(folders[start:start + PAGE_SIZE])
+        return names
+    return list_folders
+
+
+def click_before(list_folders, coordinates):
+    """
+    The baseline get_indexes_in_dataset() + already_in_dataset(): two full listings
+    """
+    indexes = [item.split("_")[0] for item in list_folders()]
+    coords_stored = [(item.split("_")[2], item.split("_")[3]) for item in list_folders()]
+    return indexes, coordinates in coords_stored
+
+
+def click_after(index, coordinates):
+    return index.get_point_ids(), index.has_datapoint_near(coordinates)
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main(args):
+    print(f"{'folders':>8} {'before/click':>14} {'after/click':>14} {'speed-up':>10} {'index build':>12}")
+    for n in [int(n) for n in args.folders.split(',')]:
+        folders = make_folders(n)
+        list_folders = paginated_lister(folders, args.page_latency)
+        coordinates = (42.35, -83.05)
+
+        before = timed(lambda: click_before(list_folders, coordinates), args.repeat)
+        start = time.perf_counter()
+        index = DatasetIndex(list_folders, ttl=300)
+        build = time.perf_counter() - start
+        after = timed(lambda: click_after(index, coordinates), args.repeat * 10)
+        print(f"{n:>8} {before * 1000:>12.1f}ms {after * 1000:>12.3f}ms {before / after:>9.0f}x {build * 1000:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-click dataset membership checks: listings vs DatasetIndex")
+    parser.add_argument("--folders", default="1000,10000,50000", help="Comma separated folder counts")
+    parser.add_argument("--page-latency", type=float, default=0.03, help="Simulated seconds per LIST page")
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
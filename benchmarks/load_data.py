@@ -0,0 +1,100 @@
+"""
+load_data before/after against a local S3 stand-in (LatencyStorage: a local
+directory with a per-request latency).
+
+Before: the baseline loop, one folder after another, 6 GETs each
+(metadata.txt + 5 PNGs), every image opened as a PIL Image and held in one
+DataFrame. After: dataset.iter_data, a bounded thread pool streaming batches
+with LazyImage, consumed batch by batch (and load_data(lazy=True) for the
+all-in-memory case).
+
+Time is measured without tracing; peak Python memory in a second, traced run.
+Packed datapoints are read as memoryviews of the mapped files, which are not
+Python allocations: their peak is the rows and headers only.
+
+    python -m benchmarks.load_data --folders 200 --latency 0.02
+"""
+
+import argparse
+import io
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+from PIL import Image
+
+import dataset
+import storage
+from benchmarks.stand_ins import LatencyStorage, folder_ids, seed_legacy, seed_packed, street_photo
+
+PREFIX = 'DetroitImageDataset_v2/'
+
+
+def load_before(store, prefix):
+    rows = []
+    for datapoint in store.list_prefixes(prefix):
+        path = f"{prefix}{datapoint}"
+        point_id, angle, lat, lon = datapoint.split("_")
+        metadata = {}
+        for content in store.get(f"{path}/metadata.txt").decode('latin-1').splitlines():
+            if ":" in content:
+                metadata[content.split(":")[0]] = content.split(":")[1]
+        for i in range(5):
+            image = Image.open(io.BytesIO(store.get(f"{path}/image_{i}.png")))
+            rows.append((point_id, angle, lat, lon, metadata['Label'], i, image, metadata['Address'],
+                         metadata.get('Labeller username', "Unknown")))
+    return pd.DataFrame(rows, columns=["id", "angle", "latitude", "longitude", "label",
+                                       "image_number", "image", "address", "labeller"])
+
+
+def stream_after(prefix, batch_size):
+    """
+    Consume the stream the way an export/training loop would: one batch at a time
+    """
+    rows = 0
+    for batch in dataset.iter_data(None, prefix, batch_size=batch_size):
+        rows += len(batch)
+        # Touch the bytes, decode nothing
+        sum(len(image.data) for image in batch['image'])
+    return rows
+
+
+def measure(function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(args):
+    image = street_photo()
+    layouts = {'legacy': seed_legacy, 'packed': seed_packed}
+    print(f"{args.folders} datapoints, {len(image) // 1024} KB per image, {args.latency * 1000:.0f} ms per request")
+    for layout, seed in layouts.items():
+        store = LatencyStorage(tempfile.mkdtemp(prefix='detroit-bench-'), latency=args.latency)
+        seed(store, PREFIX, folder_ids(args.folders), image)
+        storage.set_storage(store)
+
+        cases = {'after: iter_data (streamed)': lambda: stream_after(PREFIX, args.batch_size),
+                 'after: load_data(lazy=True)': lambda: dataset.load_data(None, PREFIX, lazy=True)}
+        if layout == 'legacy':
+            cases = dict({'before: sequential loop': lambda: load_before(store, PREFIX)}, **cases)
+        print(f"{layout} folders:")
+        for name, function in cases.items():
+            store.requests = 0
+            elapsed, peak = measure(function)
+            print(f"  {name:<30} {elapsed:>7.2f}s  peak {peak / 1024 ** 2:>7.1f} MB  "
+                  f"{store.requests // 2} requests")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="load_data before/after against a local S3 stand-in")
+    parser.add_argument("--folders", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per storage request")
+    parser.add_argument("--batch-size", type=int, default=32)
+    main(parser.parse_args())
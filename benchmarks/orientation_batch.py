@@ -0,0 +1,80 @@
+"""
+Scalar vs vectorised orientation planning on a million points.
+
+Scalar: calculate_orientation plus the 10 subtract_angles/add_angles calls of
+generate_images, one point at a time. Vectorised: one plan_orientations call.
+The outputs (cardinal direction, baseline angle, both heading fans) are
+checked to be identical for every point.
+
+    python -m benchmarks.orientation_batch --points 1000000
+
+Exits with status 1 if the speed-up is below --min-speedup.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from images_handling import add_angles, calculate_orientation, subtract_angles
+from street_headings import plan_orientations
+
+
+def random_pairs(n, seed=0):
+    """
+    Points over Detroit, each with a second point ~100 m away in a random direction
+    """
+    rng = np.random.default_rng(seed)
+    coords1 = np.column_stack([42.25 + rng.random(n) * 0.2, -83.25 + rng.random(n) * 0.3])
+    coords2 = coords1 + rng.normal(0, 1e-3, (n, 2))
+    return coords1, coords2
+
+
+def fan(straight):
+    return [subtract_angles(straight, 60), subtract_angles(straight, 30), straight,
+            add_angles(straight, 30), add_angles(straight, 60)]
+
+
+def plan_scalar(points1, points2):
+    planned = []
+    for coord1, coord2 in zip(points1, points2):
+        direction, baseline = calculate_orientation(coord1, coord2)
+        planned.append((direction, baseline, fan(baseline + 90), fan(baseline - 90)))
+    return planned
+
+
+def main(args):
+    coords1, coords2 = random_pairs(args.points)
+    points1 = list(map(tuple, coords1.tolist()))
+    points2 = list(map(tuple, coords2.tolist()))
+
+    start = time.perf_counter()
+    planned = plan_scalar(points1, points2)
+    scalar = time.perf_counter() - start
+
+    vectorised = float('inf')
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        batch = plan_orientations(coords1, coords2)
+        vectorised = min(vectorised, time.perf_counter() - start)
+
+    headings = batch['headings'].tolist()
+    mismatches = sum(1 for i, (direction, baseline, side_one, side_two) in enumerate(planned)
+                     if batch['direction'][i] != direction or batch['baseline'][i] != baseline
+                     or headings[i] != [side_one, side_two])
+
+    speedup = scalar / vectorised
+    print(f"{args.points} points: scalar {scalar:.2f}s, vectorised {vectorised * 1000:.1f}ms "
+          f"(best of {args.repeat}), {speedup:.0f}x, {mismatches} mismatches")
+    if mismatches or speedup < args.min_speedup:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scalar vs vectorised orientation planning")
+    parser.add_argument("--points", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-speedup", type=float, default=50)
+    sys.exit(main(parser.parse_args()))
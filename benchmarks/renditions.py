@@ -0,0 +1,90 @@
+"""
+Labelling page payload and encode time: PNG path vs stored JPEG + renditions.
+
+Before: save_label re-encoded each fetched JPEG as a lossless PNG, and the page
+sent the full-size 640x480 image of each of the 5 headings. After: the raw API
+JPEG is stored as-is, the page gets the WebP display rendition (the batch grid
+the thumbnail), made by make_renditions off the request path.
+
+Reports, per side (5 images): stored bytes, bytes sent to the page, and the
+time spent encoding on the save path / on the render path.
+
+    python -m benchmarks.renditions [--image street_view.jpg]
+
+Without --image a synthetic 640x480 street-like JPEG is used (smooth regions
+plus texture); a real Street View response gives more representative sizes.
+"""
+
+import argparse
+import io
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from renditions import make_renditions
+
+IMAGES_PER_SIDE = 5
+
+
+def synthetic_street(size=(640, 480), quality=85):
+    width, height = size
+    image = Image.new('RGB', size)
+    draw = ImageDraw.Draw(image)
+    for y in range(height):
+        # Sky, facades, road
+        shade = 200 - y // 4 if y < height // 3 else (120 if y < 2 * height // 3 else 80)
+        draw.line([(0, y), (width, y)], fill=(shade, shade, min(255, shade + 30)))
+    for x in range(0, width, 80):
+        draw.rectangle([x + 10, height // 3, x + 60, 2 * height // 3 - 10], fill=(140, 90, 70))
+    texture = Image.effect_noise(size, 40).convert('RGB').filter(ImageFilter.GaussianBlur(1))
+    image = Image.blend(image, texture, 0.25)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def png_of(raw):
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(raw)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def timed(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main(args):
+    if args.image:
+        with open(args.image, 'rb') as f:
+            raw = f.read()
+    else:
+        raw = synthetic_street()
+
+    png, png_time = timed(lambda: png_of(raw), args.repeat)
+    renditions, rendition_time = timed(lambda: make_renditions(raw), args.repeat)
+
+    n = IMAGES_PER_SIDE
+    rows = [
+        ("stored per side", len(png) * n, (len(raw) + len(renditions['display']) + len(renditions['thumb'])) * n),
+        ("sent to the page per side", len(png) * n, len(renditions['display']) * n),
+        ("sent per datapoint in the batch grid", len(png) * n, len(renditions['thumb']) * n),
+    ]
+    print(f"Raw API JPEG {len(raw) / 1024:.0f} KB; PNG {len(png) / 1024:.0f} KB; "
+          f"display WebP {len(renditions['display']) / 1024:.0f} KB; thumb {len(renditions['thumb']) / 1024:.1f} KB")
+    print(f"{'':<38} {'PNG path':>10} {'renditions':>11} {'ratio':>7}")
+    for name, before, after in rows:
+        print(f"{name:<38} {before / 1024:>8.0f}KB {after / 1024:>9.0f}KB {before / after:>6.1f}x")
+    print(f"{'encode on the save path per side':<38} {png_time * n * 1000:>8.0f}ms {0:>9.0f}ms "
+          f"(renditions: {rendition_time * n * 1000:.0f}ms in the process pool, off the click)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PNG path vs JPEG + renditions: bytes and encode time")
+    parser.add_argument("--image", help="A Street View JPEG to use instead of the synthetic one")
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+"""
+Per-call S3 overhead: a new boto3 client per call vs the shared client.
+
+Before: every dataset function built its own boto3.client('s3', ...) (credential
+and endpoint resolution, model loading, a fresh connection pool) and then made
+its request. After: storage.get_s3_client(), built once per process and shared
+by S3Storage across threads.
+
+By default the bucket is an in-process moto mock, which measures the client
+side of the overhead only (no connections, no TLS). Pass --endpoint to run
+against a real S3-compatible server (e.g. a local MinIO), where the shared
+client additionally reuses its pooled connections.
+
+    python -m benchmarks.s3_client --calls 200 --threads 8
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+import storage
+
+BUCKET = 'detroit-benchmark-bucket'
+KEY = 'DetroitImageDataset_v2/benchmark/metadata.txt'
+PAYLOAD = b"latitude: 42.33\nlongitude: -83.04\nlabel: 1\n" * 4
+
+
+def get_before(endpoint):
+    # The baseline pattern of dataset.py
+    s3_client = boto3.client('s3', endpoint_url=endpoint)
+    return s3_client.get_object(Bucket=BUCKET, Key=KEY)['Body'].read()
+
+
+def run(function, calls, threads):
+    start = time.perf_counter()
+    if threads == 1:
+        for _ in range(calls):
+            function()
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(lambda _: function(), range(calls)))
+    return time.perf_counter() - start
+
+
+def main(args):
+    client = storage.create_s3_client(endpoint_url=args.endpoint)
+    storage.set_s3_client(client)
+    if args.endpoint is None:
+        # The in-process mock needs the bucket; a real endpoint must already have it
+        client.create_bucket(Bucket=BUCKET)
+    store = storage.S3Storage(BUCKET)
+    store.put(KEY, PAYLOAD)
+    assert get_before(args.endpoint) == store.get(KEY) == PAYLOAD
+
+    print(f"{args.calls} GETs of a {len(PAYLOAD)} byte object")
+    for threads in (1, args.threads):
+        before = run(lambda: get_before(args.endpoint), args.calls, threads)
+        after = run(lambda: store.get(KEY), args.calls, threads)
+        print(f"{threads} thread(s): new client per call {before / args.calls * 1000:.2f} ms/call, "
+              f"shared client {after / args.calls * 1000:.2f} ms/call ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="New boto3 client per call vs the shared S3 client")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--endpoint", help="S3-compatible endpoint URL (default: in-process moto mock)")
+    args = parser.parse_args()
+    if args.endpoint is None:
+        from moto import mock_aws
+
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+        with mock_aws():
+            main(args)
+    else:
+        main(args)
@@ -0,0 +1,119 @@
+"""
+Local stand-ins shared by the benchmarks: a storage backend with a per-request
+latency (like S3, without the network) and seeded datasets in the legacy and
+packed layouts.
+"""
+
+import io
+import random
+import threading
+import time
+
+from PIL import Image
+
+import packed_format
+from metadata_schema import build_metadata
+from storage import LocalStorage
+
+IMAGES_PER_DATAPOINT = 5
+
+
+class LatencyStorage(LocalStorage):
+    """
+    LocalStorage that sleeps `latency` seconds per request and counts requests
+    """
+
+    def __init__(self, root, latency=0.02):
+        super().__init__(root)
+        self.latency = latency
+        self.requests = 0
+        self._count_lock = threading.Lock()
+
+    def _request(self):
+        with self._count_lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_with_etag(self, key, if_none_match=None):
+        self._request()
+        return super().get_with_etag(key, if_none_match)
+
+    def get(self, key):
+        self._request()
+        return super().get(key)
+
+    def get_view(self, key):
+        self._request()
+        return super().get_view(key)
+
+    def get_range(self, key, start, end):
+        self._request()
+        return super().get_range(key, start, end)
+
+    def put(self, key, data):
+        self._request()
+        super().put(key, data)
+
+    def list_keys(self, prefix, start_after=None):
+        self._request()
+        return super().list_keys(prefix, start_after)
+
+    def list_prefixes(self, prefix):
+        self._request()
+        return super().list_prefixes(prefix)
+
+
+def street_photo(size=(640, 480), seed=0, format='PNG', quality=90):
+    """
+    Noise image, encoded: compresses like a street photo rather than a flat colour
+    """
+    random.seed(seed)
+    image = Image.effect_noise(size, 48).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **({'quality': quality} if format == 'JPEG' else {}))
+    return buffer.getvalue()
+
+
+def folder_ids(n, seed=0):
+    rng = random.Random(seed)
+    return [f"{p}_{rng.choice([0, 90, 180, 270])}_{42.3 + rng.random() * 0.1}_{-83.1 + rng.random() * 0.1}"
+            for p in range(n)]
+
+
+def legacy_metadata(folder_id, label=1, username='bench'):
+    _, angle, lat, lon = folder_id.split("_")
+    angle = float(angle)
+    headings = [angle - 60, angle - 30, angle, angle + 30, angle + 60]
+    return f"""Latitude: {lat}
+Longitude: {lon}
+Headings: {headings}
+Address: N/A
+Label: {label}
+Labeller username: {username}"""
+
+
+def seed_legacy(store, prefix, folders, image):
+    """
+    Folders as the baseline save_label wrote them: image_0..4.png + metadata.txt
+    """
+    for folder_id in folders:
+        for i in range(IMAGES_PER_DATAPOINT):
+            LocalStorage.put(store, f"{prefix}{folder_id}/image_{i}.png", image)
+        LocalStorage.put(store, f"{prefix}{folder_id}/metadata.txt", legacy_metadata(folder_id))
+
+
+def seed_packed(store, prefix, folders, image, content_type='image/png', renditions=None):
+    """
+    One datapoint.pack per folder
+    """
+    for folder_id in folders:
+        _, angle, _, _ = folder_id.split("_")
+        angle = float(angle)
+        metadata = build_metadata(folder_id, [angle - 60, angle - 30, angle, angle + 30, angle + 60], 'N/A',
+                                  label=1, labeller='bench')
+        packed = packed_format.pack_datapoint(metadata, [image] * IMAGES_PER_DATAPOINT,
+                                              content_types=[content_type] * IMAGES_PER_DATAPOINT,
+                                              renditions=None if renditions is None else
+                                              [renditions] * IMAGES_PER_DATAPOINT)
+        LocalStorage.put(store, f"{prefix}{folder_id}/{packed_format.PACK_NAME}", packed)
@@ -0,0 +1,102 @@
+"""
+Heading lookup in generate_images: per-request scan vs precomputed HeadingTable.
+
+Before: for the sampled point, a boolean scan of the whole points table finds
+another point of the same street, and calculate_orientation gives the
+baseline angle. After: one O(1) HeadingTable.lookup by point_id (the table is
+built once, offline or at startup).
+
+Run over downtown_to_be_extracted.csv and over a synthetic city made of
+--scale shifted copies of it. Also reports how often the scan's "towards
+another point of the street" baseline disagrees with the local bearing of the
+nearest segment (curved streets).
+
+    python -m benchmarks.street_headings --scale 100
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from images_handling import calculate_orientation
+from street_headings import build_heading_table
+
+POINTS_CSV = 'downtown_to_be_extracted.csv'
+
+
+def synthetic_city(points_df, scale):
+    """
+    `scale` copies of the table, shifted ~5 km apart, with new point and street ids
+    """
+    copies = []
+    for i in range(scale):
+        copy = points_df.copy()
+        copy['point_id'] = copy['point_id'] + i * (points_df['point_id'].max() + 1)
+        copy['street_id'] = copy['street_id'] + i * (points_df['street_id'].max() + 1)
+        copy['latitude'] = copy['latitude'] + 0.05 * (i % 10)
+        copy['longitude'] = copy['longitude'] + 0.05 * (i // 10)
+        # Same LINESTRING shifted like its points
+        copy['street'] = [_shift_linestring(wkt, 0.05 * (i % 10), 0.05 * (i // 10)) for wkt in copy['street']]
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def _shift_linestring(wkt, dlat, dlon):
+    body = wkt[wkt.index('(') + 1:wkt.rindex(')')]
+    pairs = [pair.split() for pair in body.split(',')]
+    return "LINESTRING (" + ", ".join(f"{float(lon) + dlon} {float(lat) + dlat}" for lon, lat in pairs) + ")"
+
+
+def lookup_before(points_df, p):
+    coordinates = (points_df.iloc[p]['latitude'], points_df.iloc[p]['longitude'])
+    second_point = points_df[(points_df["street_id"] == points_df.iloc[p]["street_id"])
+                             & (points_df["point_id"] != points_df.iloc[p]['point_id'])].iloc[0]
+    return calculate_orientation(coordinates, (second_point["latitude"], second_point["longitude"]))[1]
+
+
+def per_call(function, samples):
+    start = time.perf_counter()
+    for p in samples:
+        function(p)
+    return (time.perf_counter() - start) / len(samples)
+
+
+def run(name, points_df, lookups):
+    # Points alone on their street have no "second point": the scan fails on them
+    street_sizes = points_df.groupby('street_id')['point_id'].transform('size')
+    candidates = np.flatnonzero(street_sizes.to_numpy() > 1)
+    samples = [int(p) for p in np.random.default_rng(0).choice(candidates, size=lookups)]
+
+    start = time.perf_counter()
+    table = build_heading_table(points_df)
+    build = time.perf_counter() - start
+
+    point_ids = points_df['point_id'].to_numpy()
+    before = per_call(lambda p: lookup_before(points_df, p), samples)
+    after = per_call(lambda p: table.lookup(point_ids[p]), samples)
+
+    # Modulo 180: a second point "behind" the point only swaps the two sides
+    disagree = sum((lookup_before(points_df, p) - table.lookup(point_ids[p])[0]) % 180 != 0 for p in samples)
+    print(f"{name}: {len(points_df)} points, table built in {build:.2f}s "
+          f"({table.headings.nbytes + table.baseline.nbytes + table.bearing.nbytes} bytes of arrays)")
+    print(f"  scan + calculate_orientation  {before * 1e6:>10.1f} us/lookup")
+    print(f"  HeadingTable.lookup           {after * 1e6:>10.1f} us/lookup  ({before / after:.0f}x faster)")
+    print(f"  street axis differs from the nearest segment's on {disagree}/{len(samples)} sampled points")
+
+
+def main(args):
+    random.seed(0)
+    points_df = pd.read_csv(args.points)
+    run("downtown", points_df, args.lookups)
+    run(f"synthetic x{args.scale}", synthetic_city(points_df, args.scale), args.lookups)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Heading lookup: per-request scan vs HeadingTable")
+    parser.add_argument("--points", default=POINTS_CSV)
+    parser.add_argument("--scale", type=int, default=100, help="Copies of the table in the synthetic city")
+    parser.add_argument("--lookups", type=int, default=200)
+    main(parser.parse_args())
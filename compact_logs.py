@@ -0,0 +1,22 @@
+"""
+Compaction job for the append-only logs on S3.
+Run periodically (e.g. from cron), one instance at a time:
+
+    python compact_logs.py
+"""
+from dataset import compact_label_log, compact_manifest, materialise_al_tracking
+from scoring import FeatureCache
+from storage import get_storage
+
+if __name__ == "__main__":
+    folded = compact_label_log()
+    print(f"Label log: folded {folded} event(s) into the snapshot")
+
+    folded = materialise_al_tracking()
+    print(f"Active learning: folded {folded} update object(s) into the CSV/Parquet view")
+
+    folded = compact_manifest()
+    print(f"Manifest: folded {folded} datapoint record(s) into the snapshot")
+
+    folded = FeatureCache(get_storage()).compact()
+    print(f"Features: folded {folded} shard(s) into the snapshot")
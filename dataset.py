@@ -1,20 +1,75 @@
 import pandas as pd
-import boto3 
 from io import StringIO, BytesIO
 import io
-import streamlit as st
+import json
 from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image 
 
-def download_datapoint(folder):
+from storage import BUCKET_NAME, NotFound, S3Storage, get_storage
+from dataset_index import DatasetIndex
+from spatial_index import DUPLICATE_RADIUS, StreetCoverage
+import event_log
+from al_store import ActiveLearningStore
+from al_queue import UncertaintyQueue
+from shared_state import get_coordinator
+import scoring
+from frame_cache import FrameCache
+import packed_format
+from renditions import render_all
+import metrics
+from metadata_schema import FIELDS as METADATA_FIELDS, build_metadata, normalise_metadata, parse_legacy_metadata
+
+# Seconds between background re-syncs of the dataset index against S3
+DATASET_INDEX_TTL = 300
+
+# Shared cache of parsed CSV/Parquet frames (seconds before ETag revalidation, memory cap)
+FRAME_CACHE_TTL = 60
+FRAME_CACHE_MAX_BYTES = 512 * 1024 ** 2
+
+# Append-only label log (replaces read-modify-write of tracking_df.csv)
+LABEL_LOG_PREFIX = 'LabelLog/'
+LABEL_LOG_SNAPSHOT = 'LabelLog/snapshot.parquet'
+LABEL_LOG_COLUMNS = ['username', 'time', 'datapoint_id', 'label']
+LEGACY_TRACKING_KEY = 'tracking_df.csv'
+
+# Columnar manifest of all datapoints (one row per datapoint, maintained on each save)
+DATASET_PREFIX = 'DetroitImageDataset_v2/'
+MANIFEST_PREFIX = 'Manifest/'
+MANIFEST_SNAPSHOT = 'Manifest/manifest.parquet'
+
+# Active learning table and its append-only update events
+AL_TRACKING_PATH = 'LocationSamplingDataset/close_nhoods_prediction.csv'
+AL_TRACKING_PARQUET_PATH = 'LocationSamplingDataset/close_nhoods_prediction.parquet'
+AL_EVENTS_PREFIX = 'ActiveLearning/'
+# Seconds between re-syncs of the uncertainty queue with the active learning store
+AL_QUEUE_SYNC_SECONDS = 60
+# Concurrent downloads/uploads for a batch of datapoints
+BATCH_WORKERS = 8
+
+# Process-wide singletons (module globals rather than st.cache_resource, which does not cache
+# outside a Streamlit runtime: batch jobs, the load test and the coordinator share them too)
+_singletons_lock = threading.RLock()
+_dataset_index = None
+_street_coverage = {}
+_frame_cache = None
+_al_store = None
+_synced_queue = None
+_scorer = None
+# Full scan of the dataset standing in for the manifest snapshot until compact_manifest first runs
+_manifest_seed = None
+_manifest_seed_lock = threading.Lock()
+
+@metrics.timed('download_datapoint')
+def download_datapoint(folder, role='display'):
     """
     Given a ID/folder name, returns images and metadat
-
+    (`role`: rendition to read from packed datapoints, 'display' or 'thumb')
     """
 
-    s3_client = boto3.client('s3',
-                        aws_access_key_id=st.secrets["aws_access_key_id"],
-                        aws_secret_access_key=st.secrets["aws_secret_access_key"])
+    store = get_storage()
 
     path = f"GoogleDetroitDatabase/{folder}"
 
@@ -27,313 +82,581 @@ def download_datapoint(folder):
         'longitude': lon
     }
 
-    # Read images and store them
+    # Read images and store them: one GET for packed datapoints, 5 for legacy folders
     images = []
-    for i in range(5):
-        image_key = f"{path}/image_{i}.png"
-        image_obj = s3_client.get_object(Bucket='detroit-project-data-bucket', Key=image_key)
-        image = Image.open(io.BytesIO(image_obj['Body'].read()))
-        images.append(image)
+    try:
+        # Only the display (or thumbnail) renditions are needed to label; fall back to the raw images
+        pack_key = f"{path}/{packed_format.PACK_NAME}"
+        _, rendition_images = packed_format.read_role(store, pack_key, role)
+        if rendition_images:
+            metadata['renditions'] = [{role: data} for data in rendition_images]
+            images = rendition_images
+        else:
+            _, packed_images = packed_format.read_datapoint(store, pack_key)
+            images = [Image.open(io.BytesIO(data)) for data in packed_images]
+    except NotFound:
+        for i in range(5):
+            image_key = f"{path}/image_{i}.png"
+            image = Image.open(io.BytesIO(store.get(image_key)))
+            images.append(image)
 
     return images, metadata
 
-def extract_images():
+@metrics.timed('extract_images')
+def extract_images(session_id='anon', k=1, role='display'):
     """
-    - Reads active learning tracking dataset
-    - Reads the next image to label
-    - Downloads the image to label
+    - Leases the k most uncertain unlabelled datapoints to this session (uncertainty based active learning)
+    - Downloads the images to label (concurrently for a batch)
     - Returns Images and metadata
     """
 
-    al_tracking_path = 'LocationSamplingDataset/close_nhoods_prediction.csv'
-    tracking = read_location_sampling(file_key=al_tracking_path)
+    folder_ids = get_al_queue().lease(session_id, k=k)
+    if not folder_ids:
+        raise LookupError("No unlabelled datapoints left in the active learning queue")
 
-    tracking = tracking[tracking['label']==5] ## Flag for unlabelled data
-    # take the most uncertain datapoint as per model prediction (uncertainty based active learning)
-    to_label = tracking.sort_values('certainty', ascending=True).iloc[0]
-
-    folder_id = to_label['folder_id']
+    if len(folder_ids) == 1:
+        downloaded = [download_datapoint(folder_ids[0], role=role)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(folder_ids))) as executor:
+            downloaded = list(executor.map(lambda folder_id: download_datapoint(folder_id, role=role), folder_ids))
 
-    images, metadata = download_datapoint(folder_id)
+    all_images = [images for images, _ in downloaded]
+    all_metadata = [metadata for _, metadata in downloaded]
 
-    return [images], [metadata]
+    return all_images, all_metadata
 
-def get_folder_names():
+@metrics.timed('get_folder_names')
+def get_folder_names(directory_name='DetroitImageDataset_v2/'):
     """
-    Connect to S3 and read all folder (datapoints) names in the images dataset
+    Read all folder (datapoints) names in the images dataset
+    (or in another dataset directory, e.g. 'GoogleDetroitDatabase/')
     """
-    s3_client = boto3.client('s3',
-                         aws_access_key_id=st.secrets["aws_access_key_id"],
-                         aws_secret_access_key=st.secrets["aws_secret_access_key"])
-
+    return get_storage().list_prefixes(directory_name)
 
-    bucket_name = 'detroit-project-data-bucket'
-    directory_name = 'DetroitImageDataset_v2/'
 
-    paginator = s3_client.get_paginator('list_objects_v2')
-    response_iterator = paginator.paginate(
-        Bucket=bucket_name,
-        Prefix=directory_name,
-        Delimiter='/'
-    )
-
-    folder_names = []
-    for response in response_iterator:
-        if response.get('CommonPrefixes') is not None:
-            for prefix in response.get('CommonPrefixes'):
-                # Extract the folder name from the prefix key
-                folder_name = prefix.get('Prefix')
-                # Removing the base directory and the trailing slash to get the folder name
-                folder_name = folder_name[len(directory_name):].strip('/')
-                folder_names.append(folder_name)
-
-    return folder_names
+def _get_local_dataset_index():
+    global _dataset_index
+    with _singletons_lock:
+        if _dataset_index is None:
+            index = DatasetIndex(get_folder_names, ttl=DATASET_INDEX_TTL)
+            index.start_background_sync()
+            _dataset_index = index
+    return _dataset_index
 
+def get_dataset_index():
+    """
+    Process-wide index of the datapoints in the images dataset, shared by all sessions.
+    Built with a single listing, then kept fresh by save_label and a background re-sync.
+    With a shared state coordinator (see shared_state.py), the coordinator's index is used by all workers.
+    """
+    coordinator = get_coordinator()
+    if coordinator is not None:
+        return coordinator
+    return _get_local_dataset_index()
 
-def already_in_dataset(coordinates):
+def already_in_dataset(coordinates, radius=DUPLICATE_RADIUS):
     """
-    Check if coordinate point is already in dataset
+    Check if coordinate point is already in dataset (a datapoint within `radius` metres)
 
     Input: Coordinates (lat, lon) --Tuple
     Output: Boolean TRUE/FALSE
     
     """
-    coords_stored = []
-    items = get_folder_names() 
-    if len(items)>0:
-        for item in items:
-            lat = item.split("_")[2]
-            lon = item.split("_")[3]
-            coords_stored.append((lat, lon))
-    else:
-        return 0
-
-    if coordinates in coords_stored:
+    if get_dataset_index().has_datapoint_near(coordinates, radius):
         return 1
     else:
         return 0
+
+def get_street_coverage(points_df, points_key):
+    """
+    Process-wide street coverage of the location sampling table, kept current by the dataset index.
+    `points_key` identifies the (cached, shared) points frame; the frame itself is not hashed.
+    """
+    with _singletons_lock:
+        if points_key not in _street_coverage:
+            coverage = StreetCoverage(points_df)
+            get_dataset_index().subscribe(coverage.add_datapoint)
+            _street_coverage[points_key] = coverage
+        return _street_coverage[points_key]
     
 def get_indexes_in_dataset():
     """ 
     Input: None
-    Output: List of indexes already in dataset
+    Output: Set of indexes already in dataset
     """
-    items = get_folder_names()
-    indexes = []
-    for item in items:
-        idx = item.split("_")[0]
-        indexes.append(idx)
+    return get_dataset_index().get_point_ids()
 
-    return indexes
+def get_frame_cache():
+    """
+    Process-wide cache of parsed frames, shared read-only by all sessions
+    """
+    global _frame_cache
+    with _singletons_lock:
+        if _frame_cache is None:
+            _frame_cache = FrameCache(ttl=FRAME_CACHE_TTL, max_bytes=FRAME_CACHE_MAX_BYTES)
+    return _frame_cache
+
+def _parse_csv(body):
+    return pd.read_csv(BytesIO(body))
 
 def read_location_sampling(file_key = 'LocationSamplingDataset/DowntownDetroitPointsDataset_v2.csv'):
     """
     Input: None
-    Output: Dataframe with location sampling dataset
+    Output: Dataframe with location sampling dataset (shared and cached: do not mutate, copy first)
     """
 
-    s3_client = boto3.client('s3',
-                         aws_access_key_id=st.secrets["aws_access_key_id"],
-                         aws_secret_access_key=st.secrets["aws_secret_access_key"])
-
-
-    bucket_name = 'detroit-project-data-bucket'
     #file_key = 'LocationSamplingDataset/DowntownDetroitPointsDataset_v2.csv'
 
-    obj = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+    df = get_frame_cache().get(get_storage(), file_key, _parse_csv)
+
+    return df
 
-    data = obj['Body'].read().decode('utf-8')
+def read_legacy_tracking_data():
+    """
+    Input: None
+    Output: Dataframe with the legacy tracking_df.csv (shared and cached: do not mutate)
+    """
 
-    df = pd.read_csv(StringIO(data))
+    df = get_frame_cache().get(get_storage(), LEGACY_TRACKING_KEY, _parse_csv)
 
     return df
 
+@metrics.timed('read_tracking_data')
 def read_tracking_data():
     """
     Input: None
-    Output: Dataframe with tracking data from S3
+    Output: Dataframe with tracking data (label log snapshot merged with the recent label events)
     """
 
-    s3_client = boto3.client('s3',
-                         aws_access_key_id=st.secrets["aws_access_key_id"],
-                         aws_secret_access_key=st.secrets["aws_secret_access_key"])
+    # Until the first compaction, the legacy CSV holds the history
+    df = event_log.read_log(get_storage(), LABEL_LOG_PREFIX, LABEL_LOG_SNAPSHOT, LABEL_LOG_COLUMNS,
+                            cache=get_frame_cache(), seed=read_legacy_tracking_data)
 
+    return df.drop(columns=['event_key'])
 
-    bucket_name = 'detroit-project-data-bucket'
-    file_key = 'tracking_df.csv'
+def compact_label_log():
+    """
+    Fold label events into the Parquet snapshot (first run imports tracking_df.csv)
+    """
+    return event_log.compact(get_storage(), LABEL_LOG_PREFIX, LABEL_LOG_SNAPSHOT, LABEL_LOG_COLUMNS,
+                             seed=read_legacy_tracking_data)
 
-    obj = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+class LazyImage:
+    """
+    Encoded image bytes, decoded into a PIL Image only on first access of `.image`
+    """
+    __slots__ = ('data', '_image')
 
-    data = obj['Body'].read().decode('utf-8')
+    def __init__(self, data):
+        self.data = data
+        self._image = None
 
-    df = pd.read_csv(StringIO(data))
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = Image.open(io.BytesIO(self.data))
+            self._image.load()
+        return self._image
 
-    return df
+    def __repr__(self):
+        return f"LazyImage({len(self.data)} bytes)"
 
-def load_data(bucket_name, dataset_prefix):
+def _read_metadata(store, dataset_prefix, datapoint):
+    """
+    Structured metadata record of one datapoint (packed header via a ranged GET, or legacy metadata.txt)
     """
-    Load data from S3 bucket
+    path = f"{dataset_prefix}{datapoint}"
+    try:
+        header, _, _ = packed_format.read_header(store, f"{path}/{packed_format.PACK_NAME}")
+        return normalise_metadata(header['metadata'], datapoint)
+    except NotFound:
+        return parse_legacy_metadata(store.get(f"{path}/metadata.txt").decode('latin-1'), datapoint)
+
+def _read_datapoint(store, dataset_prefix, datapoint):
     """
-    # Initialize boto3 client
-    s3 = boto3.client('s3', aws_access_key_id=st.secrets["aws_access_key_id"], aws_secret_access_key=st.secrets["aws_secret_access_key"])
+    Read metadata + 5 images of one datapoint
 
-    # Initialize lists to store data
-    ids = []
-    angles = []
-    latitudes = []
-    longitudes = []
-    labels = []
-    image_numbers = []
-    images = []
-    addresses = []
-    labellers = []
+    Output: list of 5 row dicts (one per image), images as LazyImage
+    """
+    path = f"{dataset_prefix}{datapoint}"
+
+    point_id, angle, lat, lon = datapoint.split("_")
+
+    try:
+        # Packed datapoint: metadata + 5 images in a single GET
+        metadata, images = packed_format.read_datapoint(store, f"{path}/{packed_format.PACK_NAME}")
+        metadata = normalise_metadata(metadata, datapoint)
+    except NotFound:
+        # Legacy folder: metadata.txt + 5 images
+        metadata = parse_legacy_metadata(store.get(f"{path}/metadata.txt").decode('latin-1'), datapoint)
+        images = [store.get(f"{path}/image_{i}.png") for i in range(5)]
+
+    return [{
+        "id": point_id,
+        "angle": angle,
+        "latitude": lat,
+        "longitude": lon,
+        "label": metadata['label'],
+        "image_number": i,
+        "image": LazyImage(data),
+        "address": metadata['address'],
+        "labeller": metadata['labeller'] or "Unknown"
+    } for i, data in enumerate(images)]
+
+def _store_for(bucket_name):
+    """
+    The configured storage backend, or an S3 store for another bucket
+    """
+    if bucket_name is None or bucket_name == BUCKET_NAME:
+        return get_storage()
+    return S3Storage(bucket_name)
+
+def iter_data(bucket_name, dataset_prefix, batch_size=64, max_workers=16, folders=None):
+    """
+    Stream the dataset in batches
+
+    Datapoints are fetched concurrently by a bounded thread pool sharing one store;
+    the next batch is downloaded while the current one is being consumed, so peak
+    memory is about two batches regardless of the dataset size.
+
+    folders: optional subset of datapoint ids to load, e.g. from filter_datapoints
+    Output: generator of DataFrames (one row per image, 'image' column holds LazyImage)
+    """
+    store = _store_for(bucket_name)
 
     # List objects within a given prefix
-    folders = get_folder_names()
-
-    for datapoint in folders:
-        path = f"{dataset_prefix}{datapoint}"
-
-        point_id, angle, lat, lon = datapoint.split("_")
-
-        # Read metadata
-        metadata_file = f"{path}/metadata.txt"
-        metadata_obj = s3.get_object(Bucket=bucket_name, Key=metadata_file)
-        metadata_content = metadata_obj['Body'].read().decode('latin-1')
-        metadata = {}
-        for content in metadata_content.splitlines():
-            if ":" in content:
-                data_name = content.split(":")[0]
-                data_value = content.split(":")[1]
-                metadata[data_name] = data_value
-        
-
-        # Read images and store them
-        for i in range(5):
-            image_key = f"{path}/image_{i}.png"
-            image_obj = s3.get_object(Bucket='detroit-project-data-bucket', Key=image_key)
-            image = Image.open(io.BytesIO(image_obj['Body'].read()))
-
-            # Append data to lists
-            ids.append(point_id)
-            angles.append(angle)
-            latitudes.append(lat)
-            longitudes.append(lon)
-            labels.append(metadata['Label'])
-            image_numbers.append(i)
-            images.append(image)
-            addresses.append(metadata['Address'])
-            if 'Labeller username' in metadata.keys():
-                labellers.append(metadata['Labeller username'])
-            else:
-                labellers.append("Unknown")
-                
-            
-    # Create a DataFrame
-    data = {
-        "id": ids,
-        "angle": angles,
-        "latitude": latitudes,
-        "longitude": longitudes,
-        "label": labels,
-        "image_number": image_numbers,
-        "image": images,
-        "address": addresses,
-        "labeller": labellers
-    }
+    if folders is None:
+        folders = store.list_prefixes(dataset_prefix)
+    folders = list(folders)
+    columns = ["id", "angle", "latitude", "longitude", "label", "image_number", "image", "address", "labeller"]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit(start):
+            return [executor.submit(_read_datapoint, store, dataset_prefix, datapoint)
+                    for datapoint in folders[start:start + batch_size]]
+
+        pending = submit(0)
+        for start in range(0, len(folders), batch_size):
+            current = pending
+            pending = submit(start + batch_size)
+            rows = [row for future in current for row in future.result()]
+            yield pd.DataFrame(rows, columns=columns)
+
+def load_data(bucket_name, dataset_prefix, max_workers=16, lazy=False, folders=None):
+    """
+    Load data from the bucket (bucket_name=None: the configured storage backend)
+
+    lazy: keep images as LazyImage (decoded on first access) instead of PIL Images
+    folders: optional subset of datapoint ids to load, e.g. from filter_datapoints
+    """
+    batches = list(iter_data(bucket_name, dataset_prefix, max_workers=max_workers, folders=folders))
+    if not batches:
+        return pd.DataFrame(columns=["id", "angle", "latitude", "longitude", "label",
+                                     "image_number", "image", "address", "labeller"])
+
+    df = pd.concat(batches, ignore_index=True)
+    if not lazy:
+        df['image'] = [image.image for image in df['image']]
 
-    df = pd.DataFrame(data)
-    
     return df
 
-def update_active_learning_csv(folder, label):
+def _manifest_row(record):
+    row = dict(record)
+    # Stored as JSON text so the Parquet schema stays flat
+    row['api_params'] = json.dumps(row['api_params'])
+    return row
+
+def scan_dataset_metadata(max_workers=16):
+    """
+    Build the manifest from scratch by reading every datapoint's metadata (N requests, used once as seed)
+    """
+    store = get_storage()
+    folders = get_folder_names(DATASET_PREFIX)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        records = list(executor.map(lambda folder: _read_metadata(store, DATASET_PREFIX, folder), folders))
+    return pd.DataFrame([_manifest_row(record) for record in records], columns=METADATA_FIELDS)
+
+def _scan_manifest_once():
+    """
+    scan_dataset_metadata, run once per process (it reads every datapoint)
     """
-    Update active learning tracking csv with the new label
+    global _manifest_seed
+    with _manifest_seed_lock:
+        if _manifest_seed is None:
+            _manifest_seed = scan_dataset_metadata()
+    return _manifest_seed
+
+@metrics.timed('read_manifest')
+def read_manifest():
+    """
+    Input: None
+    Output: Dataframe with one row per datapoint (latest metadata record), in a single snapshot read
+            plus the saves not compacted yet
     """
-    s3_client = boto3.client('s3',
-                         aws_access_key_id=st.secrets["aws_access_key_id"],
-                         aws_secret_access_key=st.secrets["aws_secret_access_key"])
+    # Until the first compaction, the appends only hold the saves made since the manifest
+    # was deployed: the rest of the dataset comes from a full scan
+    df = event_log.read_log(get_storage(), MANIFEST_PREFIX, MANIFEST_SNAPSHOT, METADATA_FIELDS,
+                            cache=get_frame_cache(), seed=_scan_manifest_once)
+    df = df.sort_values('timestamp', kind='stable', na_position='first')
+    df = df.drop_duplicates('datapoint_id', keep='last').drop(columns=['event_key'])
 
-    al_tracking_path = 'LocationSamplingDataset/close_nhoods_prediction.csv'
-    al_tracking = read_location_sampling(file_key=al_tracking_path)
+    return df.reset_index(drop=True)
 
-    al_tracking.loc[al_tracking['folder_id']==folder, 'label'] = label
+def compact_manifest():
+    """
+    Fold manifest appends into the Parquet snapshot (first run scans the whole dataset)
+    """
+    return event_log.compact(get_storage(), MANIFEST_PREFIX, MANIFEST_SNAPSHOT, METADATA_FIELDS,
+                             seed=scan_dataset_metadata)
 
-    csv_buffer = StringIO()
-    al_tracking.to_csv(csv_buffer, index=False)
-    s3_client.put_object(Bucket='detroit-project-data-bucket', Key=al_tracking_path, Body=csv_buffer.getvalue())
+def label_statistics():
+    """
+    Output: Dataframe of datapoint counts per label and labeller (one manifest read)
+    """
+    manifest = read_manifest()
+    return manifest.groupby(['label', 'labeller'], dropna=False).size().rename('count').reset_index()
 
-def save_label_activelearning(label, metadata):
+def filter_datapoints(label=None, labeller=None):
     """
-    
+    Output: list of datapoint ids matching the filters, without touching the datapoints themselves
+    """
+    manifest = read_manifest()
+    mask = pd.Series(True, index=manifest.index)
+    if label is not None:
+        mask &= manifest['label'] == label
+    if labeller is not None:
+        mask &= manifest['labeller'] == labeller
+    return manifest.loc[mask, 'datapoint_id'].tolist()
+
+def _new_al_store():
+    return ActiveLearningStore(get_storage(), AL_EVENTS_PREFIX, AL_TRACKING_PATH, parse_base=_parse_csv)
+
+def get_al_store():
+    """
+    Process-wide active learning state store (base table + per-folder updates)
+    """
+    global _al_store
+    with _singletons_lock:
+        if _al_store is None:
+            _al_store = _new_al_store()
+    return _al_store
+
+@metrics.timed('get_al_tracking')
+def get_al_tracking():
+    """
+    Input: None
+    Output: Dataframe with the active learning table, including labels not yet materialised
+    """
+    store = get_al_store()
+    store.refresh()
+    return store.frame()
+
+class _SyncedQueue:
+    """
+    UncertaintyQueue re-synced with the active learning store at most every AL_QUEUE_SYNC_SECONDS
+    """
+    def __init__(self):
+        self.queue = UncertaintyQueue()
+        self.lock = threading.Lock()
+        self.last_sync = 0
+
+def _get_synced_queue():
+    global _synced_queue
+    with _singletons_lock:
+        if _synced_queue is None:
+            _synced_queue = _SyncedQueue()
+    return _synced_queue
+
+def get_al_queue():
+    """
+    Process-wide uncertainty queue handing out leases on unlabelled folders
+    (the coordinator's, shared by all workers, when there is one)
+    """
+    coordinator = get_coordinator()
+    if coordinator is not None:
+        return coordinator
+    synced = _get_synced_queue()
+    with synced.lock:
+        if time.time() - synced.last_sync > AL_QUEUE_SYNC_SECONDS:
+            synced.queue.sync(get_al_tracking())
+            synced.last_sync = time.time()
+    return synced.queue
+
+def _thumbnails(folder_id):
+    return download_datapoint(folder_id, role='thumb')[0]
+
+def new_scorer(al_store, al_queue):
+    """
+    Scoring stage over the given active learning store and queue (see scoring.py)
+    """
+    return scoring.Scorer(al_store, al_queue, load_images=_thumbnails, features=scoring.FeatureCache(get_storage()))
+
+def get_scorer():
+    """
+    Process-wide scoring stage refreshing certainties after each batch of labels
+    (None when disabled; with a coordinator, the coordinator runs it)
+    """
+    global _scorer
+    if not scoring.enabled():
+        return None
+    with _singletons_lock:
+        if _scorer is None:
+            _scorer = new_scorer(get_al_store(), _get_synced_queue().queue).start()
+    return _scorer
+
+def _rescore(updates):
+    scorer = get_scorer()
+    if scorer is not None:
+        scorer.submit(updates)
+
+def update_active_learning_csv(folder, label, username='anon'):
     """
-    angle = metadata['angle']
-    p = metadata['p']
-    latitude = metadata['latitude']
-    longitude = metadata['longitude']
+    Record the new label for a folder in the active learning store.
+    Only this folder's update is written; the CSV view is rebuilt by materialise_al_tracking.
+    """
+    coordinator = get_coordinator()
+    if coordinator is not None:
+        coordinator.record_label(folder, label=label, shard=username)
+        return
+    get_al_store().update(folder, label=label, shard=username)
+    _rescore([(folder, label)])
+
+def materialise_al_tracking():
+    """
+    Rebuild the CSV/Parquet view of the active learning table and fold the applied events
+    """
+    storage = get_storage()
 
-    folder_name = f"{p}_{angle}_{latitude}_{longitude}"
+    store = _new_al_store()
+    keys = store.pending_keys()
+    al_tracking = store.frame()
 
-    update_active_learning_csv(folder_name, label)
+    csv_buffer = StringIO()
+    al_tracking.to_csv(csv_buffer, index=False)
+    storage.put(AL_TRACKING_PATH, csv_buffer.getvalue())
 
-def save_label(images, label, metadata, username):
+    parquet_buffer = BytesIO()
+    al_tracking.to_parquet(parquet_buffer, index=False)
+    storage.put(AL_TRACKING_PARQUET_PATH, parquet_buffer.getvalue())
+
+    event_log.delete_events(storage, keys)
+    return len(keys)
+
+@metrics.timed('save_label_activelearning')
+def save_label_activelearning(label, metadata, username='anon'):
     """
-    Function to store the images
+    Save the label of one active learning datapoint and complete its lease
+
+    Input: label (int), metadata of the datapoint (as returned by extract_images), username
+           (the labeller's shard of the active learning store)
     """
-    s3_client = boto3.client('s3',
-                         aws_access_key_id=st.secrets["aws_access_key_id"],
-                         aws_secret_access_key=st.secrets["aws_secret_access_key"])
+    folder_name = _folder_name(metadata)
 
-    bucket_name = 'detroit-project-data-bucket'
+    update_active_learning_csv(folder_name, label, username)
+    get_al_queue().complete(folder_name)
 
-    angle = metadata['angle']
-    p = metadata['p']
-    latitude = metadata['latitude']
-    longitude = metadata['longitude']
-    address = metadata['address']
-    headings = metadata['headings']
+@metrics.timed('save_labels_activelearning')
+def save_labels_activelearning(labelled, username='anon'):
+    """
+    Bulk save of a batch page: all labels go to the active learning store as one event object
+
+    Input: list of (label, metadata)
+    """
+    updates = [{'folder_id': _folder_name(metadata), 'label': label, 'certainty': None}
+               for label, metadata in labelled]
+    if not updates:
+        return
+    coordinator = get_coordinator()
+    if coordinator is not None:
+        coordinator.record_many(updates, shard=username)
+    else:
+        get_al_store().update_many(updates, shard=username)
+        _rescore([(update['folder_id'], update['label']) for update in updates])
+    queue = get_al_queue()
+    for update in updates:
+        queue.complete(update['folder_id'])
 
-    # Save the observation of first side (images + metadata)
-    datapoint_id = f"{p}_{angle}_{latitude}_{longitude}"
-    base_s3_path = f"DetroitImageDataset_v2/{datapoint_id}"
+def _folder_name(metadata):
+    return f"{metadata['p']}_{metadata['angle']}_{metadata['latitude']}_{metadata['longitude']}"
 
-    for idx, img in enumerate(images):
+def _pack_label(images, label, metadata, username, current_time):
+    """
+    Output: (datapoint_id, metadata record, packed datapoint bytes)
+    """
+    datapoint_id = _folder_name(metadata)
+
+    encoded_images = []
+    content_types = []
+    for img in images:
+        if isinstance(img, bytes):
+            # Raw API bytes are stored as-is, no decode/re-encode
+            encoded_images.append(img)
+            content_types.append('image/jpeg')
+            continue
         # Convert the image to bytes
         img_byte_arr = BytesIO()
         img.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
+        encoded_images.append(img_byte_arr.getvalue())
+        content_types.append('image/png')
 
-        # Create a full path for the image
-        img_path = f"{base_s3_path}/image_{idx}.png"
+    image_renditions = metadata.get('renditions')
+    if not image_renditions or len(image_renditions) != len(encoded_images) or 'thumb' not in image_renditions[0]:
+        image_renditions = render_all(encoded_images)
 
-        # Upload the image to S3
-        s3_client.put_object(Bucket=bucket_name, Key=img_path, Body=img_byte_arr)
+    record = build_metadata(datapoint_id, metadata['headings'], metadata['address'], label=label, labeller=username,
+                            api_params=metadata.get('api_params'), timestamp=current_time.isoformat())
 
-    # Prepare metadata text
-    metadata_content = f"""Latitude: {latitude}
-Longitude: {longitude}
-Headings: {headings}
-Address: {address}
-Label: {label}
-Labeller username: {username}"""
+    # Images + metadata in a single object (one PUT instead of six)
+    packed = packed_format.pack_datapoint(record, encoded_images, content_types=content_types,
+                                          renditions=image_renditions)
+    return datapoint_id, record, packed
 
-    # Save Metadata to a .txt file
-    metadata_path = f"{base_s3_path}/metadata.txt"
-    s3_client.put_object(Bucket=bucket_name, Key=metadata_path, Body=metadata_content)
-
-    # Update tracking file
-    tracking_df = read_tracking_data()
-    current_time = datetime.now()
-    current_label_df = pd.DataFrame({'username': [username], 'time': [current_time], 'datapoint_id': [datapoint_id], 'label': [label]})
+def _pack_key(datapoint_id):
+    return f"DetroitImageDataset_v2/{datapoint_id}/{packed_format.PACK_NAME}"
 
-    tracking_df = pd.concat([tracking_df, current_label_df], ignore_index=True)
+@metrics.timed('save_label')
+def save_label(images, label, metadata, username):
+    """
+    Function to store the images
+    """
+    save_labels([(images, label, metadata)], username)
 
-    tracking_file_key = 'tracking_df.csv'
+@metrics.timed('save_labels')
+def save_labels(labelled, username):
+    """
+    Store a batch of labelled datapoints (Street View mode).
+    The packs are uploaded concurrently; the manifest rows and the label events of the
+    whole batch are then written as one event object each.
 
-    csv_buffer = StringIO()
-    tracking_df.to_csv(csv_buffer, index=False)
-    s3_client.put_object(Bucket=bucket_name, Key=tracking_file_key, Body=csv_buffer.getvalue())
+    Input: list of (images, label, metadata)
+    """
+    if not labelled:
+        return
+    store = get_storage()
+    current_time = datetime.now()
 
+    packs = [_pack_label(images, label, metadata, username, current_time) for images, label, metadata in labelled]
 
+    def upload(pack):
+        datapoint_id, _, packed = pack
+        store.put(_pack_key(datapoint_id), packed)
 
-            
\ No newline at end of file
+    if len(packs) == 1:
+        upload(packs[0])
+    else:
+        with ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(packs))) as executor:
+            # list() re-raises the first failed upload before anything is logged
+            list(executor.map(upload, packs))
+
+    # Register the new folders so the next sampling round sees them without a listing
+    index = get_dataset_index()
+    for datapoint_id, _, _ in packs:
+        index.add(datapoint_id)
+
+    # Keep the manifest current (one small append, folded into Parquet by compaction)
+    event_log.append_events(store, MANIFEST_PREFIX, [_manifest_row(record) for _, record, _ in packs], shard=username)
+
+    # Append the label events (one small object, no read-modify-write of the history)
+    events = [{'username': username, 'time': str(current_time), 'datapoint_id': datapoint_id, 'label': label}
+              for (datapoint_id, _, _), (_, label, _) in zip(packs, labelled)]
+    event_log.append_events(store, LABEL_LOG_PREFIX, events, shard=username)
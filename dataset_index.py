@@ -0,0 +1,180 @@
+import threading
+import time
+
+from spatial_index import DUPLICATE_RADIUS, SpatialIndex
+
+
+def parse_folder_name(folder_name):
+    """
+    Parse a datapoint folder name '{p}_{angle}_{lat}_{lon}'
+
+    Input: folder name (str)
+    Output: Tuple (point_id, angle, lat, lon), or None if the name is malformed
+    """
+    parts = folder_name.split("_")
+    if len(parts) != 4:
+        return None
+    try:
+        point_id = int(parts[0])
+        angle = float(parts[1])
+        lat = float(parts[2])
+        lon = float(parts[3])
+    except ValueError:
+        return None
+    return point_id, angle, lat, lon
+
+
+class DatasetIndex:
+    """
+    In-memory index of the datapoints stored in the images dataset.
+
+    Folder names are parsed once into sets/dicts so that membership checks
+    (point already sampled, coordinates already stored) are O(1) instead of a
+    full S3 listing per check. The index is updated in place by `add` whenever
+    a datapoint is saved, and re-synced against S3 by a background thread
+    every `ttl` seconds to pick up datapoints saved by other processes.
+
+    Coordinates are also kept in a grid spatial index, so near-duplicates
+    (a datapoint within a few metres) are found without an exact float match.
+    Subscribers (e.g. StreetCoverage) are notified of every new datapoint.
+    """
+
+    def __init__(self, list_folders, ttl=300):
+        self._list_folders = list_folders
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self.folder_ids = set()
+        self.point_ids = set()
+        self.coordinates = set()
+        self.by_point = {}
+        self.spatial = SpatialIndex()
+        self._subscribers = []
+        # folder -> time.monotonic() of add(), kept until a listing started after it
+        self._recently_added = {}
+        self._listings_started = []
+        self.last_sync = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.refresh()
+
+    def _add_unlocked(self, folder_name):
+        """
+        Output: (lat, lon) of the folder if it was new, else None
+        """
+        parsed = parse_folder_name(folder_name)
+        if parsed is None or folder_name in self.folder_ids:
+            return None
+        point_id, angle, lat, lon = parsed
+        self.folder_ids.add(folder_name)
+        self.point_ids.add(point_id)
+        if (lat, lon) not in self.coordinates:
+            self.coordinates.add((lat, lon))
+            self.spatial.add(lat, lon, folder_name)
+        self.by_point.setdefault(point_id, []).append(folder_name)
+        return lat, lon
+
+    def _notify(self, added):
+        for callback in list(self._subscribers):
+            for lat, lon in added:
+                callback(lat, lon)
+
+    def add(self, folder_name):
+        """
+        Register a newly written datapoint folder
+        """
+        with self._lock:
+            self._recently_added[folder_name] = time.monotonic()
+            added = self._add_unlocked(folder_name)
+            if added is not None:
+                self._notify([added])
+
+    def refresh(self):
+        """
+        Rebuild the index from a full listing of the dataset.
+        Folders added while the listing runs may be missing from it: they are kept.
+        """
+        with self._lock:
+            started = time.monotonic()
+            self._listings_started.append(started)
+        try:
+            folders = self._list_folders()
+        finally:
+            with self._lock:
+                self._listings_started.remove(started)
+        with self._lock:
+            # Added before the oldest listing still running started: every listing has them
+            oldest = min(self._listings_started + [started])
+            self._recently_added = {folder_name: added for folder_name, added in self._recently_added.items()
+                                    if added >= oldest}
+            folders = list(folders) + list(self._recently_added)
+            previous = self.folder_ids
+            self.folder_ids = set()
+            self.point_ids = set()
+            self.coordinates = set()
+            self.by_point = {}
+            self.spatial = SpatialIndex(cell_size=self.spatial.cell_size)
+            for folder_name in folders:
+                self._add_unlocked(folder_name)
+            self.last_sync = time.time()
+            # Subscribers only hear about datapoints they have not seen yet
+            self._notify([parse_folder_name(folder_name)[2:] for folder_name in self.folder_ids - previous])
+
+    def subscribe(self, callback):
+        """
+        Call `callback(lat, lon)` for every datapoint in the index now, then for each new one
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+            for folder_name in self.folder_ids:
+                callback(*parse_folder_name(folder_name)[2:])
+
+    def _sync_loop(self):
+        while not self._stop.wait(self.ttl):
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the stale index, next tick will retry
+                print(f"Error refreshing dataset index: {e}")
+
+    def start_background_sync(self):
+        """
+        Start the TTL re-sync thread (no-op if already running)
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sync_loop, name="dataset-index-sync", daemon=True)
+        self._thread.start()
+
+    def stop_background_sync(self):
+        self._stop.set()
+
+    def contains_point(self, point_id):
+        with self._lock:
+            return int(point_id) in self.point_ids
+
+    def contains_coordinates(self, coordinates):
+        lat, lon = coordinates
+        with self._lock:
+            return (float(lat), float(lon)) in self.coordinates
+
+    def has_datapoint_near(self, coordinates, radius=DUPLICATE_RADIUS):
+        """
+        True if a stored datapoint lies within `radius` metres of (lat, lon)
+        """
+        lat, lon = coordinates
+        with self._lock:
+            spatial = self.spatial
+        return spatial.any_within(lat, lon, radius)
+
+    def get_point_ids(self):
+        """
+        Snapshot of the point ids already in the dataset (set of int)
+        """
+        with self._lock:
+            return set(self.point_ids)
+
+    def __len__(self):
+        with self._lock:
+            return len(self.folder_ids)
@@ -0,0 +1,179 @@
+"""
+Append-only event log on S3 (or any storage backend, see storage.py).
+
+Each write is a new, uniquely named object under `{prefix}events/`, so
+concurrent writers never overwrite each other and the cost of a write does
+not depend on the history size. Event keys start with a UTC timestamp, so a
+listing returns them in (approximately) write order.
+
+A compaction job folds the event objects into a Parquet snapshot and then
+deletes them. Readers merge the snapshot with the events that are still
+pending; the `event_key` column of the snapshot records which events it
+already contains, so an event is never counted twice nor lost if the job
+dies between writing the snapshot and deleting the events.
+Only one compaction job should run at a time.
+
+`read_log` lists the events before revalidating the snapshot, and reads
+again if a listed event was deleted meanwhile: a snapshot older than the
+listing is never merged with a listing that misses the events it lacks.
+"""
+
+import json
+import re
+import uuid
+from datetime import datetime
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from storage import NotFound
+
+READ_WORKERS = 16
+# Re-reads of the log when a compaction ran during the read
+READ_ATTEMPTS = 3
+
+
+def _shard_name(shard):
+    return re.sub(r'[^A-Za-z0-9\-]', '-', str(shard))[:64] or 'anon'
+
+
+def append_events(store, prefix, events, shard='anon'):
+    """
+    Write a batch of events (list of dicts) as one new object
+
+    Output: key of the written object
+    """
+    now = datetime.utcnow()
+    key = f"{prefix}events/{now:%Y%m%dT%H%M%S%f}_{_shard_name(shard)}_{uuid.uuid4().hex}.json"
+    body = json.dumps({'events': events}, default=str)
+    store.put(key, body)
+    return key
+
+
+def list_event_keys(store, prefix, start_after=None):
+    """
+    Keys of the pending event objects, sorted
+    """
+    return store.list_keys(f"{prefix}events/", start_after=start_after)
+
+
+def read_events(store, keys, missing=None):
+    """
+    Read event objects concurrently
+
+    Input: missing -- optional list, receives the keys deleted since they were listed
+    Output: list of event dicts, each tagged with the 'event_key' it came from
+    """
+    def read_one(key):
+        try:
+            body = store.get(key)
+        except NotFound:
+            # Deleted by a compaction that ran after our listing
+            if missing is not None:
+                missing.append(key)
+            return []
+        events = json.loads(body.decode('utf-8'))['events']
+        for event in events:
+            event['event_key'] = key
+        return events
+
+    if not keys:
+        return []
+    with ThreadPoolExecutor(max_workers=min(READ_WORKERS, len(keys))) as executor:
+        batches = list(executor.map(read_one, keys))
+    return [event for batch in batches for event in batch]
+
+
+def delete_events(store, keys):
+    """
+    Delete event objects that were folded into a snapshot
+    """
+    store.delete(keys)
+
+
+def _parse_parquet(body):
+    return pd.read_parquet(BytesIO(body))
+
+
+def read_snapshot(store, snapshot_key, cache=None, revalidate=False):
+    """
+    Input: cache -- optional FrameCache to serve/revalidate the snapshot from
+           revalidate -- check the cached snapshot's ETag even within the cache TTL
+    Output: snapshot DataFrame, or None if no snapshot was written yet
+    """
+    try:
+        if cache is not None:
+            return cache.get(store, snapshot_key, _parse_parquet, revalidate=revalidate)
+        body = store.get(snapshot_key)
+    except NotFound:
+        return None
+    return _parse_parquet(body)
+
+
+def merge_snapshot_and_events(snapshot, events, columns):
+    """
+    Snapshot rows followed by the pending events it does not already contain
+    """
+    frames = []
+    folded = set()
+    if snapshot is not None:
+        frames.append(snapshot)
+        folded = set(snapshot['event_key'])
+    pending = [event for event in events if event['event_key'] not in folded]
+    if pending:
+        frames.append(pd.DataFrame(pending))
+    if not frames:
+        return pd.DataFrame(columns=columns + ['event_key'])
+    return pd.concat(frames, ignore_index=True).reindex(columns=columns + ['event_key'])
+
+
+def _seed_snapshot(seed, snapshot_key, columns):
+    snapshot = seed().reindex(columns=columns)
+    snapshot['event_key'] = f"seed:{snapshot_key}"
+    return snapshot
+
+
+def read_log(store, prefix, snapshot_key, columns, cache=None, seed=None):
+    """
+    Full view of the log: snapshot + pending events
+
+    Input: seed -- as in compact, used as the snapshot while none exists
+    """
+    for attempt in range(READ_ATTEMPTS):
+        # Listed first: if the snapshot is unchanged after the listing, no listed event was folded yet
+        keys = list_event_keys(store, prefix)
+        snapshot = read_snapshot(store, snapshot_key, cache=cache, revalidate=True)
+        missing = []
+        events = read_events(store, keys, missing=missing)
+        if not missing:
+            break
+        # A compaction folded and deleted some of the listed events: read the new snapshot
+    if snapshot is None and seed is not None:
+        snapshot = _seed_snapshot(seed, snapshot_key, columns)
+    return merge_snapshot_and_events(snapshot, events, columns)
+
+
+def compact(store, prefix, snapshot_key, columns, seed=None):
+    """
+    Fold pending events into the Parquet snapshot, then delete them.
+
+    Input: seed -- optional callable returning the initial DataFrame, used only
+           when no snapshot exists yet (e.g. to import a legacy CSV)
+    Output: number of events folded
+    """
+    snapshot = read_snapshot(store, snapshot_key)
+    if snapshot is None and seed is not None:
+        snapshot = _seed_snapshot(seed, snapshot_key, columns)
+
+    keys = list_event_keys(store, prefix)
+    events = read_events(store, keys)
+    merged = merge_snapshot_and_events(snapshot, events, columns)
+
+    buffer = BytesIO()
+    merged.astype({'event_key': str}).to_parquet(buffer, index=False)
+    store.put(snapshot_key, buffer.getvalue())
+
+    # Only delete once the snapshot holding them is durable
+    delete_events(store, keys)
+    return len(events)
@@ -0,0 +1,234 @@
+"""
+Headless bulk extraction of Street View datapoints.
+
+Streams the rows of a location sampling CSV, skips points already in the
+dataset, fetches both sides of the street for each point with a worker pool
+throttled by a token bucket (the API quota), and uploads the images and
+metadata to storage (S3 by default) under GoogleDetroitDatabase/, where the active learning flow
+reads them from. Completed rows are appended to a local checkpoint file, so
+a crashed or interrupted run resumes where it stopped.
+
+Street View calls go through the pipeline's own thread pool and connection
+pool (sized by --concurrency) and its own response cache (--cache-dir), so a
+run neither competes with the app's pool nor evicts the app's cache.
+
+    python extract_pipeline.py downtown_to_be_extracted.csv --rate 8 --workers 8 --concurrency 20
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+
+from storage import get_storage
+from dataset import get_folder_names
+from dataset_index import DatasetIndex
+import packed_format
+from metadata_schema import DEFAULT_API_PARAMS, build_metadata
+from renditions import render_all
+from image_cache import ImageCache
+from images_handling import create_http_session, fetch_street_view_images
+from street_headings import build_heading_table
+
+OUTPUT_PREFIX = 'GoogleDetroitDatabase/'
+IMAGE_SIZE = "640x480"
+
+# Responses of the current run, so a retried row (e.g. after a crash) is not paid twice
+EXTRACT_CACHE_DIR = os.environ.get("EXTRACT_CACHE_DIR", ".streetview_extract_cache")
+EXTRACT_CACHE_MAX_BYTES = int(os.environ.get("EXTRACT_CACHE_MAX_BYTES", 512 * 1024 ** 2))
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: `rate` tokens per second, bursts up to `capacity`
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """
+    Append-only JSONL file of completed rows; reloaded on start to resume
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)['row'])
+                    except (ValueError, KeyError):
+                        # Torn last line after a crash
+                        continue
+        self._file = open(path, 'a')
+
+    def mark_done(self, row, folders):
+        with self._lock:
+            self._file.write(json.dumps({'row': row, 'folders': folders}) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.done.add(row)
+
+    def close(self):
+        self._file.close()
+
+
+def iter_points(csv_path, chunksize):
+    """
+    Stream (row position, point row) pairs without loading the whole CSV.
+    The row position is the `p` used in folder names, as in generate_images.
+    """
+    row = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        heading_table = build_heading_table(chunk)
+        for _, point in chunk.iterrows():
+            yield row, point, heading_table
+            row += 1
+
+
+def upload_datapoint(store, folder, images, metadata):
+    """
+    Upload the raw API bytes as-is, plus their display renditions, as one packed object
+    (large objects go through concurrent multipart uploads, see S3Storage.put)
+    """
+    packed = packed_format.pack_datapoint(metadata, images, content_types=['image/jpeg'] * len(images),
+                                          renditions=render_all(images))
+    store.put(f"{OUTPUT_PREFIX}{folder}/{packed_format.PACK_NAME}", packed)
+
+
+def extract_point(store, rate_limiter, api_key, row, point, heading_table, street_view=None):
+    """
+    Fetch and upload both sides of one point
+
+    street_view: optional dict of the executor, session and cache to fetch with
+                 (see fetch_street_view_images; default: the interactive app's)
+
+    Output: list of uploaded folder names, or None if a heading failed (row is retried on resume)
+    """
+    coordinates = (point['latitude'], point['longitude'])
+    angle_baseline, headings_one, headings_two = heading_table.lookup(point['point_id'])
+
+    rate_limiter.acquire(len(headings_one) + len(headings_two))
+    results = fetch_street_view_images(api_key, coordinates, IMAGE_SIZE, headings_one + headings_two,
+                                       **(street_view or {}))
+    failed = [r for r in results if r['image'] is None]
+    if failed:
+        print(f"Row {row}: {len(failed)} heading(s) failed: "
+              + ", ".join(f"{r['heading']} ({r['error']})" for r in failed), file=sys.stderr)
+        return None
+
+    folders = []
+    for straight, headings, side_results in [(angle_baseline + 90, headings_one, results[:5]),
+                                             (angle_baseline - 90, headings_two, results[5:])]:
+        folder = f"{row}_{straight}_{coordinates[0]}_{coordinates[1]}"
+        metadata = build_metadata(folder, headings, 'N/A', api_params=dict(DEFAULT_API_PARAMS, size=IMAGE_SIZE))
+        upload_datapoint(store, folder, [r['content'] for r in side_results], metadata)
+        folders.append(folder)
+    return folders
+
+
+def run(csv_path, api_key, checkpoint_path, rate, workers, chunksize=1000, limit=None, concurrency=20,
+        cache_dir=EXTRACT_CACHE_DIR):
+    store = get_storage()
+
+    checkpoint = Checkpoint(checkpoint_path)
+    rate_limiter = TokenBucket(rate, capacity=max(rate, 10))
+    fetch_executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="extract-streetview")
+    street_view = {'executor': fetch_executor,
+                   'session': create_http_session(pool_size=concurrency),
+                   'cache': ImageCache(cache_dir, max_bytes=EXTRACT_CACHE_MAX_BYTES)}
+
+    # Points already labelled or already extracted are skipped
+    labelled = DatasetIndex(get_folder_names)
+    extracted = DatasetIndex(lambda: get_folder_names('GoogleDetroitDatabase/'))
+
+    # Bound the number of in-flight points so streaming stays memory-bounded
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    stats = {'done': 0, 'skipped': 0, 'failed': 0}
+    stats_lock = threading.Lock()
+    started = time.time()
+
+    def task(row, point, heading_table):
+        try:
+            folders = extract_point(store, rate_limiter, api_key, row, point, heading_table, street_view)
+        except Exception as e:
+            print(f"Row {row}: {type(e).__name__}: {e}", file=sys.stderr)
+            folders = None
+        finally:
+            in_flight.release()
+        with stats_lock:
+            if folders is None:
+                stats['failed'] += 1
+            else:
+                checkpoint.mark_done(row, folders)
+                stats['done'] += 1
+                if stats['done'] % 50 == 0:
+                    elapsed = time.time() - started
+                    print(f"{stats['done']} points extracted ({stats['done'] / elapsed:.2f}/s)")
+
+    submitted = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for row, point, heading_table in iter_points(csv_path, chunksize):
+            coordinates = (point['latitude'], point['longitude'])
+            # Folder ids use row positions of other CSVs, so match on (nearby) coordinates
+            if (row in checkpoint.done or labelled.has_datapoint_near(coordinates)
+                    or extracted.has_datapoint_near(coordinates)):
+                with stats_lock:
+                    stats['skipped'] += 1
+                continue
+            if limit is not None and submitted >= limit:
+                break
+            in_flight.acquire()
+            executor.submit(task, row, point, heading_table)
+            submitted += 1
+
+    fetch_executor.shutdown()
+    checkpoint.close()
+    print(f"Done: {stats['done']} extracted, {stats['skipped']} skipped, {stats['failed']} failed "
+          f"in {time.time() - started:.0f}s")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk Street View extraction to S3 (or DETROIT_STORAGE)")
+    parser.add_argument("csv_path", help="Location sampling CSV, e.g. downtown_to_be_extracted.csv")
+    parser.add_argument("--checkpoint", default="extraction_checkpoint.jsonl")
+    parser.add_argument("--rate", type=float, default=8, help="Street View requests per second (API quota)")
+    parser.add_argument("--workers", type=int, default=8, help="Points processed concurrently")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent Street View requests")
+    parser.add_argument("--cache-dir", default=EXTRACT_CACHE_DIR, help="Response cache of the pipeline")
+    parser.add_argument("--chunksize", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=None, help="Extract at most this many points")
+    parser.add_argument("--api-key", default=os.environ.get("GOOGLE_API_KEY"))
+    args = parser.parse_args()
+
+    api_key = args.api_key or st.secrets["google_api_key"]
+    run(args.csv_path, api_key, args.checkpoint, args.rate, args.workers, args.chunksize, args.limit,
+        concurrency=args.concurrency, cache_dir=args.cache_dir)
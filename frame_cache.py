@@ -0,0 +1,111 @@
+"""
+Process-wide cache of parsed DataFrames read from storage (S3 or local, see storage.py).
+
+Within `ttl` seconds a cached frame is served with no request at all. After
+that, it is revalidated with a conditional GET (If-None-Match on the ETag):
+an unchanged object costs a 304 and no re-parse. Entries are evicted least
+recently used first once the deep memory usage of the cached frames exceeds
+`max_bytes`. Callers that combine a frame with other, freshly listed objects
+(e.g. a log snapshot with its pending events) pass `revalidate=True` to skip
+the TTL and always revalidate.
+
+Hits, misses, revalidations, evictions and downloaded bytes are counted in
+the metrics registry (frame_cache_* counters, see metrics.py).
+
+Cached frames are shared by every session: treat them as read-only and
+`.copy()` before mutating.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from storage import NotModified
+
+
+class FrameCache:
+
+    def __init__(self, ttl=60, max_bytes=512 * 1024 ** 2):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = OrderedDict()  # (store name, key) -> dict(frame, etag, checked, size)
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.bytes_downloaded = 0
+
+    def _key_lock(self, cache_key):
+        with self._lock:
+            return self._key_locks.setdefault(cache_key, threading.Lock())
+
+    def get(self, store, key, parse, revalidate=False):
+        """
+        Input: parse -- callable turning the object bytes into a DataFrame
+               revalidate -- check the ETag even within the TTL (one conditional GET)
+        Output: cached (read-only) DataFrame
+        """
+        cache_key = (store.name, key)
+        # One loader per key: concurrent sessions wait for the same download
+        with self._key_lock(cache_key):
+            with self._lock:
+                entry = self._entries.get(cache_key)
+                if entry is not None and not revalidate and time.time() - entry['checked'] < self.ttl:
+                    self.hits += 1
+                    self._entries.move_to_end(cache_key)
+                    metrics.incr('frame_cache_requests', result='hit')
+                    return entry['frame']
+
+            try:
+                body, etag = store.get_with_etag(key, if_none_match=entry['etag'] if entry is not None else None)
+            except NotModified:
+                with self._lock:
+                    self.revalidations += 1
+                    entry['checked'] = time.time()
+                    self._entries.move_to_end(cache_key)
+                metrics.incr('frame_cache_requests', result='revalidated')
+                return entry['frame']
+
+            frame = parse(body)
+            size = int(frame.memory_usage(deep=True).sum())
+            evictions = 0
+            with self._lock:
+                self.misses += 1
+                self.bytes_downloaded += len(body)
+                if cache_key in self._entries:
+                    self._total_bytes -= self._entries.pop(cache_key)['size']
+                self._entries[cache_key] = {'frame': frame, 'etag': etag,
+                                            'checked': time.time(), 'size': size}
+                self._total_bytes += size
+                while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._total_bytes -= evicted['size']
+                    self.evictions += 1
+                    evictions += 1
+            metrics.incr('frame_cache_requests', result='miss')
+            metrics.incr('frame_cache_bytes_downloaded', len(body))
+            if evictions:
+                metrics.incr('frame_cache_evictions', evictions)
+            return frame
+
+    def invalidate(self, store, key):
+        with self._lock:
+            entry = self._entries.pop((store.name, key), None)
+            if entry is not None:
+                self._total_bytes -= entry['size']
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+                'bytes_downloaded': self.bytes_downloaded,
+                'entries': len(self._entries),
+                'size_bytes': self._total_bytes
+            }
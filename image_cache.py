@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def street_view_cache_key(location, size, heading, pitch, fov, source="outdoor"):
+    """
+    Content address of a Street View request (the API key is deliberately not part of it)
+    """
+    params = {
+        "location": f"{location[0]},{location[1]}",
+        "size": size,
+        "heading": heading,
+        "pitch": pitch,
+        "fov": fov,
+        "source": source
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+JPEG_SOI, JPEG_EOI = b'\xff\xd8', b'\xff\xd9'
+PNG_SIGNATURE, PNG_IEND = b'\x89PNG\r\n\x1a\n', b'IEND\xaeB`\x82'
+
+
+def is_complete_image(data):
+    """
+    Cheap integrity check of encoded JPEG/PNG bytes (start and end markers only, no decode)
+    """
+    if data[:2] == JPEG_SOI:
+        return data[-2:] == JPEG_EOI
+    if data[:8] == PNG_SIGNATURE:
+        return data[-8:] == PNG_IEND
+    return False
+
+
+class ImageCache:
+    """
+    Persistent, size-bounded LRU cache of raw response bytes on local disk.
+
+    Entries are stored as `{directory}/{key[:2]}/{key}` so a hit is served with
+    no decode/re-encode. Recency is tracked in memory and mirrored to the file
+    mtime, so the LRU order survives restarts. Several processes may share the
+    directory: an entry evicted by another process simply becomes a miss.
+
+    Only complete JPEG/PNG bodies are stored (written to a temp file, then
+    renamed), and a hit only checks their start/end markers: an entry that
+    fails the check (e.g. damaged on disk) is dropped and reported as a miss.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.bytes_stored = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load(self):
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, name, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def get(self, key):
+        """
+        Output: raw bytes, or None on a miss
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+        if not is_complete_image(data):
+            print(f"Dropping corrupt Street View cache entry {key}")
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self._forget(key)
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.bytes_served += len(data)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                self._entries[key] = len(data)
+                self._total_bytes += len(data)
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            pass
+        return data
+
+    def _forget(self, key):
+        with self._lock:
+            self.misses += 1
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+
+    def put(self, key, data):
+        """
+        Store `data` under `key`
+        Output: False (nothing stored) if `data` is not a complete JPEG/PNG
+        """
+        if not is_complete_image(data):
+            return False
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self.bytes_stored += len(data)
+            to_evict = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                self.evictions += 1
+                to_evict.append(old_key)
+
+        for old_key in to_evict:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'bytes_served': self.bytes_served,
+                'bytes_stored': self.bytes_stored,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size_bytes': self._total_bytes
+            }
@@ -1,40 +1,182 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image 
 import io
-import random
 import math 
 import os 
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 ### Import from other modules of the app
 from dataset import already_in_dataset, get_indexes_in_dataset
+from image_cache import ImageCache, street_view_cache_key
+from renditions import render_async
+from point_sampler import PointSampler
+from street_headings import COST_PER_1000_REQUESTS
+import metrics
 
-def get_street_view_images(api_key, location, size, headings, pitch=0, fov=90):
+# STREETVIEW_BASE_URL points the app to a stand-in server (see load_test.py)
+STREET_VIEW_URL = os.environ.get("STREETVIEW_BASE_URL", "https://maps.googleapis.com/maps/api/streetview")
+
+# Concurrency / robustness settings for Street View calls
+MAX_FETCH_WORKERS = 10
+REQUEST_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+
+# On-disk cache of raw Street View responses (identical requests are never paid twice)
+IMAGE_CACHE_DIR = os.environ.get("STREETVIEW_CACHE_DIR", ".streetview_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("STREETVIEW_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+_session = None
+_session_lock = threading.Lock()
+_executor = None
+_image_cache = None
+
+
+def create_http_session(pool_size=MAX_FETCH_WORKERS):
+    """
+    Keep-alive session for the Street View API, with retry + backoff on 429/5xx
+    """
+    retry = Retry(total=MAX_RETRIES,
+                  backoff_factor=BACKOFF_FACTOR,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=["GET"],
+                  respect_retry_after_header=True,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_http_session():
+    """
+    Session shared by the interactive app
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_http_session()
+    return _session
+
+
+def _get_executor():
+    global _executor
+    with _session_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS, thread_name_prefix="streetview")
+    return _executor
+
+
+def get_image_cache():
+    global _image_cache
+    with _session_lock:
+        if _image_cache is None:
+            _image_cache = ImageCache(IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES)
+    return _image_cache
+
+
+def _fetch_heading(api_key, location, size, heading, pitch, fov, render=False, session=None, cache=None):
+    """
+    Fetch a single heading, going through the on-disk cache first.
+    Never raises: errors are reported in the returned dict.
+    render: also submit the display renditions as soon as the bytes are in ('rendition' future)
+    session, cache: default to the interactive app's (get_http_session, get_image_cache)
+    """
+    result = _fetch_heading_content(api_key, location, size, heading, pitch, fov,
+                                    session if session is not None else get_http_session(),
+                                    cache if cache is not None else get_image_cache())
+    result['rendition'] = None
+    if render and result['content'] is not None:
+        # Encoding overlaps with the headings still being fetched
+        result['rendition'] = render_async([result['content']])[0]
+    return result
+
+
+def _fetch_heading_content(api_key, location, size, heading, pitch, fov, session, cache):
+    cache_key = street_view_cache_key(location, size, heading, pitch, fov)
+    content = cache.get(cache_key)
+    if content is not None:
+        # The cache checked the entry's markers: only the header is parsed here, no decode
+        try:
+            image = Image.open(io.BytesIO(content))
+            metrics.incr('streetview_requests', result='cached')
+            return {'heading': heading, 'image': image, 'content': content,
+                    'status': 200, 'error': None, 'cached': True}
+        except Exception as e:
+            # Unreadable header: fetch again, the put below replaces the entry
+            print(f"Error opening Street View cache entry {cache_key}: {e}")
+
+    params = {
+        "key": api_key,
+        "location": f"{location[0]},{location[1]}",
+        "size": size,
+        "heading": heading,
+        "pitch": pitch,
+        "fov": fov,
+        "source": "outdoor"
+    }
+    result = {'heading': heading, 'image': None, 'content': None, 'status': None, 'error': None, 'cached': False}
+    try:
+        # Every request that reaches the API is billed
+        metrics.incr('streetview_cost_usd', COST_PER_1000_REQUESTS / 1000)
+        with metrics.span('streetview_http'):
+            response = session.get(STREET_VIEW_URL, params=params, timeout=REQUEST_TIMEOUT)
+        result['status'] = response.status_code
+        if response.status_code == 200:
+            result['content'] = response.content
+            result['image'] = Image.open(io.BytesIO(response.content))
+            try:
+                if not cache.put(cache_key, response.content):
+                    print(f"Not caching incomplete Street View response for heading {heading}")
+            except OSError as e:
+                print(f"Error writing Street View cache entry: {e}")
+        else:
+            result['error'] = f"HTTP {response.status_code}"
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    metrics.incr('streetview_requests', result='ok' if result['error'] is None else 'error')
+    return result
+
+
+@metrics.timed('fetch_street_view_images')
+def fetch_street_view_images(api_key, location, size, headings, pitch=0, fov=90, render=False,
+                             executor=None, session=None, cache=None):
+    """
+    Fetch all headings concurrently over the shared connection pool.
+
+    Input: same as get_street_view_images; render=True also starts the display renditions.
+           executor, session, cache: default to the interactive app's; batch jobs pass their own
+           so they neither compete for its pool nor evict its cache
+    Output: List of dicts {'heading', 'image', 'content', 'status', 'error', 'cached', 'rendition'}, in the
+            order of headings. 'content' holds the raw response bytes, 'image' is None for failed headings,
+            'rendition' a future of the renditions (None unless render=True and the fetch succeeded).
+    """
+    executor = executor or _get_executor()
+    futures = [executor.submit(_fetch_heading, api_key, location, size, heading, pitch, fov, render, session, cache)
+               for heading in headings]
+    return [future.result() for future in futures]
+
+
+@metrics.timed('get_street_view_images')
+def get_street_view_images(api_key, location, size, headings, pitch=0, fov=90, failures=None):
     """
     API Call to get Street View images
     
     Cost per 1000 requests: $7
+
+    Failed headings are skipped in the returned list; pass a list as `failures`
+    to collect them as {'heading', 'status', 'error'} dicts.
     """
     images = []
-
-    base_url = "https://maps.googleapis.com/maps/api/streetview"
-    for heading in headings:
-        params = {
-            "key": api_key,
-            "location": f"{location[0]},{location[1]}",
-            "size": size,
-            "heading": heading,
-            "pitch": pitch,
-            "fov": fov,
-            "source": "outdoor"
-        }
-
-        response = requests.get(base_url, params=params)
-        if response.status_code == 200:
-            image_data = io.BytesIO(response.content)
-            images.append(Image.open(image_data))
- 
-        else:
-            print(f"Error fetching image with heading {heading}: {response.status_code}")
+    for result in fetch_street_view_images(api_key, location, size, headings, pitch, fov):
+        if result['image'] is not None:
+            images.append(result['image'])
+        elif failures is not None:
+            failures.append({k: result[k] for k in ('heading', 'status', 'error')})
 
     return images
 
@@ -93,21 +235,29 @@ def subtract_angles(angle1, angle2):
     return result
 
 def generate_unique_random(exclude_numbers, min_value, max_value):
-    while True:
-        number = random.randint(min_value, max_value)
-        if number not in exclude_numbers:
-            return number
+    """
+    Random integer in [min_value, max_value) not in exclude_numbers, or None if there is none left
+    """
+    return PointSampler(range(min_value, max_value), exclude=exclude_numbers).sample()
 
-def generate_images(points_df, api_key, image_size):
+@metrics.timed('generate_images')
+def generate_images(points_df, api_key, image_size, heading_table=None, sampler=None, coverage=None):
     """ 
-    Return 5 images
+    Return 5 images per side, as the raw API bytes (display renditions are in metadata['renditions'])
+
+    heading_table: optional street_headings.HeadingTable with the precomputed headings of each point
+    sampler: optional shared point_sampler.PointSampler over the rows of points_df
+    coverage: optional spatial_index.StreetCoverage, to prefer streets with no datapoint yet
     """
 
-    # Get list of indexes already in dataset
-    indexes = get_indexes_in_dataset()
+    if sampler is None:
+        # Get list of indexes already in dataset
+        sampler = PointSampler.from_points(points_df, exclude=get_indexes_in_dataset())
 
-    # Pick a point -- make it random and exclude indexes found above
-    p = generate_unique_random(indexes, 0, len(points_df))
+    # Pick a point -- random (one street at a time), excluding points already in the dataset
+    p = sampler.sample(accept_stratum=None if coverage is None else lambda street_id: not coverage.is_covered(street_id))
+    if p is None:
+        raise LookupError("Every point of the location sampling table is in the dataset")
     print(p)
 
     coordinates = (points_df.iloc[p]['latitude'], points_df.iloc[p]['longitude'])
@@ -117,42 +267,59 @@ def generate_images(points_df, api_key, image_size):
         # address = reverse_geocode(coordinates[0], coordinates[1])
 
         ###  Set headings
-        # Get a second point on the same line
-        second_point = points_df[(points_df["street_id"] == points_df.iloc[p]["street_id"])
-                                & (points_df["point_id"] != points_df.iloc[p]["point_id"])].iloc[0]
-        
-        second_point_coordinates = (second_point["latitude"], second_point["longitude"])
-        # Compute the N-E-S-W direction where the street is pointing at
-        direction, angle_baseline = calculate_orientation(coordinates, second_point_coordinates)
-        
-        ### Do it for one side of the street
-        straight_one = angle_baseline + 90
-        headings_one = [subtract_angles(straight_one, 60), subtract_angles(straight_one, 30), 
-                        straight_one, 
-                        add_angles(straight_one, 30), add_angles(straight_one, 60)] 
-
-        street_view_images_first = get_street_view_images(api_key, coordinates, image_size, headings_one)
+        point_id = points_df.iloc[p]['point_id']
+        if heading_table is not None and point_id in heading_table:
+            # Precomputed from the street segment nearest to the point
+            angle_baseline, headings_one, headings_two = heading_table.lookup(point_id)
+            straight_one = angle_baseline + 90
+            straight_two = angle_baseline - 90
+        else:
+            # Get a second point on the same line
+            second_point = points_df[(points_df["street_id"] == points_df.iloc[p]["street_id"])
+                                    & (points_df["point_id"] != point_id)].iloc[0]
+
+            second_point_coordinates = (second_point["latitude"], second_point["longitude"])
+            # Compute the N-E-S-W direction where the street is pointing at
+            direction, angle_baseline = calculate_orientation(coordinates, second_point_coordinates)
+
+            ### Do it for one side of the street
+            straight_one = angle_baseline + 90
+            headings_one = [subtract_angles(straight_one, 60), subtract_angles(straight_one, 30), 
+                            straight_one, 
+                            add_angles(straight_one, 30), add_angles(straight_one, 60)] 
+
+            straight_two = angle_baseline - 90
+            headings_two = [subtract_angles(straight_two, 60), subtract_angles(straight_two, 30), 
+                            straight_two, 
+                            add_angles(straight_two, 30), add_angles(straight_two, 60)] 
 
         metadata_one = {'p':p, 
                         'angle':straight_one,
                         'latitude': coordinates[0],
                         'longitude': coordinates[1],
                         'headings': headings_one,
-                        'address': 'N/A'} # address}
-        
-
-        straight_two = angle_baseline - 90
-        headings_two = [subtract_angles(straight_two, 60), subtract_angles(straight_two, 30), 
-                        straight_two, 
-                        add_angles(straight_two, 30), add_angles(straight_two, 60)] 
-        
-        street_view_images_second = get_street_view_images(api_key, coordinates, image_size, headings_two)
+                        'address': 'N/A', # address
+                        'api_params': {'size': image_size, 'pitch': 0, 'fov': 90, 'source': 'outdoor'}}
 
         metadata_two = {'p':p, 
                 'angle':straight_two,
                 'latitude': coordinates[0],
                 'longitude': coordinates[1],
                 'headings': headings_two,
-                'address': 'N/A'} # address}
+                'address': 'N/A', # address
+                'api_params': {'size': image_size, 'pitch': 0, 'fov': 90, 'source': 'outdoor'}}
+
+        # Fetch both sides (10 headings) in one concurrent batch
+        results = fetch_street_view_images(api_key, coordinates, image_size, headings_one + headings_two, render=True)
+        sides = []
+        for side_results, metadata in zip([results[:5], results[5:]], [metadata_one, metadata_two]):
+            # Keep the raw API bytes: they are stored as-is, the page shows the renditions
+            sides.append([r['content'] for r in side_results if r['content'] is not None])
+            metadata['failed_headings'] = [{k: r[k] for k in ('heading', 'status', 'error')}
+                                           for r in side_results if r['content'] is None]
+
+        with metrics.span('renditions_wait'):
+            for side_results, metadata in zip([results[:5], results[5:]], [metadata_one, metadata_two]):
+                metadata['renditions'] = [r['rendition'].result() for r in side_results if r['content'] is not None]
 
-        return [street_view_images_first, street_view_images_second], [metadata_one, metadata_two]
+        return sides, [metadata_one, metadata_two]
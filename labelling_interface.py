@@ -1,8 +1,29 @@
 import streamlit as st
 import pandas as pd
+import io
+import math
+import uuid
+from PIL import Image
 
 from images_handling import generate_images
-from dataset import read_location_sampling, save_label, save_label_activelearning, extract_images
+from dataset import (read_location_sampling, save_label, save_labels, save_label_activelearning,
+                     save_labels_activelearning, extract_images, get_al_queue, get_indexes_in_dataset,
+                     get_street_coverage, get_frame_cache)
+from prefetch import DatapointPrefetcher, BackgroundSaver
+from street_headings import build_heading_table
+from point_sampler import PointSampler
+from shared_state import RemoteSampler, attach_points, get_coordinator
+import metrics
+
+# Number of datapoints kept ready in the background for each session
+PREFETCH_DEPTH = 3
+# Seconds a click waits for the next prefetched datapoint before showing an error
+PREFETCH_TIMEOUT = 60
+
+# Batch labelling: datapoints per page (default and maximum) and grid columns
+BATCH_SIZE = 8
+MAX_BATCH_SIZE = 24
+BATCH_COLUMNS = 4
 
 labels_to_int = {
     "Infeasible": 0,
@@ -13,6 +34,242 @@ labels_to_int = {
 
 }
 
+@st.cache_resource
+def get_heading_table(_points_df, points_key):
+    """
+    Precomputed headings for the points table, built once per process.
+    `points_key` identifies the (cached, shared) points frame; the frame itself is not hashed.
+    """
+    return build_heading_table(_points_df)
+
+@st.cache_resource
+def get_point_sampler(_points_df, points_key):
+    """
+    Process-wide sampler of the points not in the dataset yet, stratified by street.
+    Shared by all sessions, so two labellers never draw the same point.
+    """
+    return PointSampler.from_points(_points_df, exclude=get_indexes_in_dataset())
+
+@st.cache_resource
+def get_shared_points():
+    """
+    (SharedMemory, points frame, HeadingTable) mapped from the coordinator, once per worker process
+    """
+    return attach_points(get_coordinator())
+
+def get_points_frame():
+    """
+    Points table for Street View sampling: the coordinator's shared copy, or read from storage
+    """
+    if get_coordinator() is not None:
+        return get_shared_points()[1]
+    return read_location_sampling()
+
+def _decoded(item):
+    """
+    Force-decode the images of a (data_points, metadata) item so rendering does no I/O
+    """
+    if item is None:
+        return None
+    data_points, metadata = item
+    for images in data_points:
+        for image in images:
+            # Raw bytes / renditions need no decoding, legacy PIL images are loaded now
+            if hasattr(image, 'load'):
+                image.load()
+    return data_points, metadata
+
+def _thumb_strip(images):
+    """
+    The 5 thumbnails of a datapoint side by side, as one image for the batch grid
+    """
+    thumbs = [Image.open(io.BytesIO(bytes(image))) if not hasattr(image, 'load') else image for image in images]
+    height = min(thumb.height for thumb in thumbs)
+    thumbs = [thumb if thumb.height == height else
+              thumb.resize((round(thumb.width * height / thumb.height), height)) for thumb in thumbs]
+    strip = Image.new('RGB', (sum(thumb.width for thumb in thumbs), height))
+    x = 0
+    for thumb in thumbs:
+        strip.paste(thumb.convert('RGB'), (x, 0))
+        x += thumb.width
+    return strip
+
+def _thumbnails(images, metadata):
+    renditions = metadata.get('renditions')
+    if renditions:
+        return [rendition.get('thumb', rendition.get('display')) for rendition in renditions]
+    return images
+
+def _with_strips(item):
+    """
+    Build the thumbnail strip of each datapoint of an item (in the prefetch thread, not on render)
+    """
+    if item is None:
+        return None
+    data_points, metadata = item
+    for images, m in zip(data_points, metadata):
+        m['strip'] = _thumb_strip(_thumbnails(images, m))
+    return item
+
+def _folder_id(metadata):
+    return f"{metadata['p']}_{metadata['angle']}_{metadata['latitude']}_{metadata['longitude']}"
+
+def _release_leases(item):
+    data_points, metadata = item
+    for m in metadata:
+        get_al_queue().release(_folder_id(m))
+
+def _return_points(sampler):
+    def on_discard(item):
+        data_points, metadata = item
+        # Both sides come from the same point
+        sampler.restore(metadata[0]['p'])
+    return on_discard
+
+def _prefetch_depth(active_learning, batch_size):
+    if not batch_size:
+        return PREFETCH_DEPTH
+    if active_learning:
+        # One page ready in advance: every prefetched datapoint holds a lease
+        return 1
+    # Street View items hold 2 datapoints: at least one page ready in advance
+    return max(PREFETCH_DEPTH, math.ceil(batch_size / 2))
+
+def _make_prefetcher(active_learning, points_df, api_key, image_size, session_id, batch_size=None):
+    """
+    Output: (prefetcher, callback releasing what a discarded prefetched item holds,
+             callback setting a new batch size)
+
+    With `batch_size`, items carry thumbnail strips for the batch grid: in active learning mode
+    each item is a whole page (the top `batch_size` datapoints), in Street View mode pages are
+    made of several items (2 sides each). The batch size can change without a new prefetcher:
+    pages produced after the change have the new size.
+    """
+    page = {'batch_size': batch_size}
+    if active_learning:
+        # Each pick is leased to this session, so concurrent labellers get distinct folders
+        if batch_size:
+            def produce():
+                return _with_strips(extract_images(session_id=session_id, k=page['batch_size'], role='thumb'))
+        else:
+            def produce():
+                return _decoded(extract_images(session_id=session_id))
+        on_discard = _release_leases
+    else:
+        if get_coordinator() is not None:
+            # Sampling and coverage live in the coordinator, shared by all workers
+            _, _, heading_table = get_shared_points()
+            sampler = RemoteSampler(get_coordinator())
+            coverage = None
+        else:
+            points_key = (id(points_df), len(points_df))
+            heading_table = get_heading_table(points_df, points_key)
+            sampler = get_point_sampler(points_df, points_key)
+            coverage = get_street_coverage(points_df, points_key)
+
+        def generate():
+            return _decoded(generate_images(points_df, api_key, image_size, heading_table=heading_table,
+                                            sampler=sampler, coverage=coverage))
+        if batch_size:
+            def produce():
+                return _with_strips(generate())
+        else:
+            produce = generate
+        on_discard = _return_points(sampler)
+
+    # on_discard also runs when the worker shuts itself down after the session went idle
+    prefetcher = DatapointPrefetcher(produce, depth=_prefetch_depth(active_learning, batch_size),
+                                     name="prefetch-al" if active_learning else "prefetch-generate",
+                                     on_discard=on_discard)
+
+    def set_batch_size(new_batch_size):
+        page['batch_size'] = new_batch_size
+        prefetcher.set_depth(_prefetch_depth(active_learning, new_batch_size))
+    return prefetcher, on_discard, set_batch_size
+
+def get_prefetcher(active_learning, points_df, api_key, image_size, batch_size=None):
+    """
+    Per-session prefetcher for the current mode; restarted when the mode changes or it went idle.
+    Moving the batch size slider keeps the prefetcher (and the images it already fetched).
+    """
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    mode = (active_learning, bool(batch_size))
+    prefetcher = st.session_state.get('prefetcher')
+    if prefetcher is None or st.session_state.get('prefetch_mode') != mode or not prefetcher.alive:
+        if prefetcher is not None:
+            prefetcher.close()
+        prefetcher, on_discard, set_batch_size = _make_prefetcher(active_learning, points_df, api_key, image_size,
+                                                                  st.session_state.session_id, batch_size=batch_size)
+        st.session_state.prefetcher = prefetcher
+        st.session_state.prefetch_discard = on_discard
+        st.session_state.prefetch_set_batch_size = set_batch_size
+        st.session_state.prefetch_mode = mode
+        st.session_state.prefetch_batch_size = batch_size
+    elif st.session_state.get('prefetch_batch_size') != batch_size:
+        st.session_state.prefetch_set_batch_size(batch_size)
+        st.session_state.prefetch_batch_size = batch_size
+    return prefetcher
+
+def next_page(prefetcher, active_learning, batch_size=None, on_discard=None):
+    """
+    Output: (data_points, metadata) for the next page: one item, or enough Street View items to fill a batch.
+    Raises the prefetcher's error (or TimeoutError); items of an incomplete batch go to `on_discard`.
+    """
+    if not batch_size or active_learning:
+        return prefetcher.get(timeout=PREFETCH_TIMEOUT)
+    items = []
+    try:
+        for _ in range(math.ceil(batch_size / 2)):
+            items.append(prefetcher.get(timeout=PREFETCH_TIMEOUT))
+    except Exception:
+        if on_discard is not None:
+            for item in items:
+                on_discard(item)
+        raise
+    data_points, metadata = [], []
+    for item_points, item_metadata in items:
+        data_points.extend(item_points)
+        metadata.extend(item_metadata)
+    return data_points, metadata
+
+def batch_grid(label_options):
+    """
+    Grid of the current page's datapoints (thumbnail strips), one label per datapoint
+    """
+    data_points, metadata = st.session_state.data_points, st.session_state.metadata
+    for row_start in range(0, len(data_points), BATCH_COLUMNS):
+        columns = st.columns(BATCH_COLUMNS)
+        for idx, cell in zip(range(row_start, min(row_start + BATCH_COLUMNS, len(data_points))), columns):
+            m = metadata[idx]
+            strip = m.get('strip')
+            if strip is None:
+                strip = m['strip'] = _thumb_strip(_thumbnails(data_points[idx], m))
+            cell.image(strip, use_column_width=True)
+            if m.get('failed_headings'):
+                cell.warning(f"{len(m['failed_headings'])} image(s) could not be fetched")
+            label = cell.selectbox(f"Datapoint {idx + 1}", label_options, key=f"label{idx}")
+            if idx >= len(st.session_state.labels):
+                st.session_state.labels.append(label)
+            else:
+                st.session_state.labels[idx] = label
+
+def metrics_panel():
+    """
+    Admin-only view of the per-stage timings and request/cost counters of this process
+    """
+    snapshot = metrics.snapshot()
+    with st.sidebar.expander("Performance metrics"):
+        if snapshot['spans']:
+            spans = pd.DataFrame.from_dict(snapshot['spans'], orient='index')
+            st.dataframe(spans[['count', 'errors', 'mean', 'p50', 'p95', 'p99', 'max']].sort_values('p95', ascending=False))
+        if snapshot['counters']:
+            st.dataframe(pd.Series(snapshot['counters'], name='value'))
+        # Shared frame cache: hit/miss counts since start and current size
+        st.dataframe(pd.Series(get_frame_cache().stats(), name='frame cache'))
+        if st.button("Reset metrics"):
+            metrics.REGISTRY.reset()
+
 def label_page():
     # Get API key
     api_key = st.secrets["google_api_key"]
@@ -62,48 +319,96 @@ Please make sure the images are correctly saved (two green success messages at t
 
     if st.markdown('<style>div.row-widget.stButton > button { width: 350px; height: 70px; font-size: 50px; }</style>', unsafe_allow_html=True):
         active_learning = st.toggle('Active Learning', value=True)
+        points_df = None
         if not active_learning:
             # Read Location Sampling
-            points_df = read_location_sampling()
+            points_df = get_points_frame()
+
+        batch_size = None
+        if st.toggle('Batch labelling', value=False):
+            # Even sizes: a Street View point gives two datapoints (one per side)
+            batch_size = st.slider('Datapoints per page', min_value=2, max_value=MAX_BATCH_SIZE,
+                                   value=BATCH_SIZE, step=2)
+
+        if 'saver' not in st.session_state:
+            st.session_state.saver = BackgroundSaver()
+        saver = st.session_state.saver
+        for error in saver.pop_errors():
+            st.error(f"Saving failed: {error}")
+
+        prefetcher = get_prefetcher(active_learning, points_df, api_key, image_size, batch_size=batch_size)
+
+        if st.session_state.get('user') in st.secrets.get("admins", []):
+            metrics_panel()
 
         if st.button("Save and Generate New Datapoints"):
             if st.session_state.data_points: # and st.button("Save Labels and Continue"):
                 username = st.session_state.get('user', 'Unknown')
-                for images, label, metadata_image in zip(st.session_state.data_points, st.session_state.labels, st.session_state.metadata):
-                    if label:
-                        # label_digit = ''.join(filter(str.isdigit, label))
-                        label_digit = labels_to_int[label]
+                labelled = [(images, labels_to_int[label], metadata_image) for images, label, metadata_image
+                            in zip(st.session_state.data_points, st.session_state.labels, st.session_state.metadata)
+                            if label]
+                if batch_size:
+                    # Bulk save: one write for all labels, pack uploads run concurrently
+                    if active_learning:
+                        saver.submit(save_labels_activelearning, [(label, m) for _, label, m in labelled], username)
+                    else:
+                        saver.submit(save_labels, labelled, username)
+                else:
+                    for images, label_digit, metadata_image in labelled:
+                        # Saving happens in the background, after the click returns
                         if active_learning:
-                            save_label_activelearning(label_digit, metadata_image)
-                            print(metadata_image)
-                            print(label_digit)
+                            saver.submit(save_label_activelearning, label_digit, metadata_image, username)
                         else:
-                            save_label(images, label_digit, metadata_image, username)
+                            saver.submit(save_label, images, label_digit, metadata_image, username)
                         #st.success(f"Images and label saved successfully!")
 
                 # Reset session state after submission
                 st.session_state.data_points = []
                 st.session_state.labels = []
 
-            if active_learning:
-                st.session_state.data_points, st.session_state.metadata = extract_images()
-            else:
-                st.session_state.data_points, st.session_state.metadata = generate_images(points_df, api_key, image_size)
+            # Next datapoint is already downloaded and decoded by the prefetcher
+            try:
+                with metrics.span('prefetch_wait'):
+                    st.session_state.data_points, st.session_state.metadata = next_page(
+                        prefetcher, active_learning, batch_size, on_discard=st.session_state.get('prefetch_discard'))
+            except TimeoutError as e:
+                st.error(f"The next datapoints are taking too long to load, please try again. ({e})")
+            except Exception as e:
+                # LookupError: queue/sampler exhausted (KeyError is a missing object, i.e. a failure)
+                if isinstance(e, LookupError) and not isinstance(e, KeyError):
+                    st.error(f"No datapoints left to label: {e}")
+                else:
+                    st.error(f"Loading the next datapoints failed: {type(e).__name__}: {e}")
+
+        if saver.pending():
+            st.caption(f"Saving {saver.pending()} label(s) in the background...")
 
 
-        if st.session_state.data_points:
+        if st.session_state.data_points and batch_size:
+            batch_grid(list(labels_to_int))
+        elif st.session_state.data_points:
             for idx, images in enumerate(st.session_state.data_points):
                 if idx > 0:
                     st.markdown("---")
 
                 st.subheader(f"Side {idx + 1}")
 
+                failed_headings = st.session_state.metadata[idx].get('failed_headings', [])
+                if failed_headings:
+                    st.warning(f"{len(failed_headings)} image(s) could not be fetched: " +
+                               ", ".join(f"heading {f['heading']} ({f['error']})" for f in failed_headings))
+
                 label_options = ["Infeasible",
                                 "Feasible",
                                 "Infeasible but unsure",
                                 "Feasible but unsure",
                                 "Bad Data"]
                 
+                # Serve the small display renditions rather than the full-size images
+                renditions = st.session_state.metadata[idx].get('renditions')
+                if renditions:
+                    images = [rendition.get('display', rendition.get('thumb')) for rendition in renditions]
+
                 image_columns = st.columns(5)
                 for col, image in zip(image_columns, images):
                     col.image(image, use_column_width=True)
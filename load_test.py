@@ -0,0 +1,419 @@
+"""
+Load test of the labelling cycle with concurrent simulated labellers.
+
+Drives what label_page does on "Save and Generate New Datapoints", without a
+browser, against local stand-ins:
+- storage: a LocalStorage directory seeded with the location sampling table,
+  the active learning table and packed datapoints (or --storage s3://bucket
+  with S3_ENDPOINT_URL for an S3 stand-in)
+- Street View: a local HTTP server returning a fixed JPEG after a configurable latency
+
+Each simulated user loops fetch -> label -> save, in active learning mode
+(extract_images + save_label_activelearning) or Street View mode
+(generate_images + save_label), and spends about --think seconds on each
+datapoint (left out of the cycle latency). All users share the process-wide
+state of dataset.py, as the sessions of one app worker do. The number of
+users is ramped up level by level; every level reports throughput,
+p50/p95/p99 cycle latency, per-stage timings (metrics.py), storage and
+Street View request counts, lost writes (labels acknowledged by a save but
+missing from the label log, the active learning store, or the materialised
+active learning CSV) and double leases (a folder handed to two sessions at
+once, which fails the run).
+
+    python load_test.py --mode al --users 1,4,16 --duration 30 --save-baseline
+    python load_test.py --mode al --users 1,4,16 --duration 30   # compared to the baseline
+
+The committed load_test_baseline.json holds one report per mode, recorded
+with the default options. Exits with status 1 if a level regresses against
+the baseline. Timings depend on the machine (Street View mode is bound by
+rendition encoding, see renditions.RENDITION_WORKERS): re-record the
+baseline when the CPU count differs from the one it was recorded with.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+from PIL import Image
+
+import metrics
+
+IMAGE_SIZE = "640x480"
+API_KEY = 'load-test'
+LABELS = [0, 1, 2, 3, 4]
+POINTS_CSV = 'downtown_to_be_extracted.csv'
+DEFAULT_BASELINE = 'load_test_baseline.json'
+
+
+def make_jpeg(size=(640, 480), quality=85):
+    """
+    Noise image: compresses like a real street photo, not like a flat colour
+    """
+    image = Image.effect_noise(size, 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+class FakeStreetView:
+    """
+    Stand-in for the Street View Static API: sleeps `latency` (+/- jitter), then returns `image`.
+    A fraction `error_rate` of the requests get a 500.
+    """
+
+    def __init__(self, image, latency=0.2, jitter=0.5, error_rate=0.0):
+        self.image = image
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                time.sleep(max(0, random.uniform(fake.latency * (1 - fake.jitter), fake.latency * (1 + fake.jitter))))
+                if random.random() < fake.error_rate:
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(fake.image)))
+                self.end_headers()
+                self.wfile.write(fake.image)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="fake-streetview").start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}/maps/api/streetview"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def seed_storage(store, points_df, al_folders, image):
+    """
+    Write the objects the labelling cycle reads: location sampling table, empty label
+    history, active learning table and one packed datapoint per active learning folder
+    """
+    import dataset
+    import packed_format
+    from metadata_schema import build_metadata
+    from renditions import make_renditions
+
+    csv_buffer = io.StringIO()
+    points_df.to_csv(csv_buffer, index=False)
+    store.put('LocationSamplingDataset/DowntownDetroitPointsDataset_v2.csv', csv_buffer.getvalue())
+    store.put(dataset.LEGACY_TRACKING_KEY, ",".join(dataset.LABEL_LOG_COLUMNS) + "\n")
+
+    renditions = make_renditions(image)
+    rows = []
+    for i, (_, point) in enumerate(points_df.head(al_folders).iterrows()):
+        angle = random.choice([0, 45, 90, 135, 180, 225, 270, 315]) + 90
+        folder_id = f"{i}_{angle}_{point['latitude']}_{point['longitude']}"
+        metadata = build_metadata(folder_id, [angle - 60, angle - 30, angle, angle + 30, angle + 60], 'N/A')
+        packed = packed_format.pack_datapoint(metadata, [image] * 5, content_types=['image/jpeg'] * 5,
+                                              renditions=[renditions] * 5)
+        store.put(f"GoogleDetroitDatabase/{folder_id}/{packed_format.PACK_NAME}", packed)
+        rows.append({'folder_id': folder_id, 'label': 5, 'certainty': random.random()})
+
+    csv_buffer = io.StringIO()
+    pd.DataFrame(rows).to_csv(csv_buffer, index=False)
+    store.put(dataset.AL_TRACKING_PATH, csv_buffer.getvalue())
+
+
+def _think(context):
+    """
+    Time the labeller spends looking at the datapoint (around --think seconds)
+    Output: seconds slept, left out of the cycle latency
+    """
+    if not context['think']:
+        return 0.0
+    started = time.perf_counter()
+    time.sleep(context['think'] * random.uniform(0.5, 1.5))
+    return time.perf_counter() - started
+
+
+def simulate_user(user, mode, deadline, context, results):
+    """
+    One labeller: fetch a datapoint, look at it, pick a label, save it, repeat until `deadline`
+    """
+    import dataset
+    from images_handling import generate_images
+
+    session_id = f"loadtest-{user}"
+    username = f"loadtest-{user}"
+    while time.time() < deadline:
+        started = time.perf_counter()
+        thought = 0.0
+        writes = []
+        try:
+            if mode == 'al':
+                _, all_metadata = dataset.extract_images(session_id=session_id)
+                folder_ids = [dataset._folder_name(metadata) for metadata in all_metadata]
+                with results['lock']:
+                    for folder_id in folder_ids:
+                        # A lease is exclusive: no other session may hold this folder
+                        holder = results['held'].setdefault(folder_id, session_id)
+                        if holder != session_id:
+                            results['double_leases'].append((folder_id, holder, session_id))
+                thought = _think(context)
+                for folder_id, metadata in zip(folder_ids, all_metadata):
+                    label = random.choice(LABELS)
+                    dataset.save_label_activelearning(label, metadata, username)
+                    writes.append(('al', folder_id, label))
+            else:
+                item = generate_images(context['points_df'], API_KEY, IMAGE_SIZE, heading_table=context['heading_table'],
+                                       sampler=context['sampler'], coverage=context['coverage'])
+                if item is None:
+                    # Point already in the dataset: the app shows nothing, the user clicks again
+                    with results['lock']:
+                        results['skipped'] += 1
+                    continue
+                thought = _think(context)
+                for images, metadata in zip(*item):
+                    label = random.choice(LABELS)
+                    dataset.save_label(images, label, metadata, username)
+                    writes.append(('label', f"{metadata['p']}_{metadata['angle']}_{metadata['latitude']}_{metadata['longitude']}", label))
+        except LookupError as e:
+            if isinstance(e, KeyError):
+                # Missing object (storage.NotFound), not an empty queue
+                with results['lock']:
+                    results['errors'] += 1
+                    results['error_samples'][f"{type(e).__name__}: {e}"[:200]] = True
+                continue
+            # Active learning queue exhausted
+            results['exhausted'] = True
+            return
+        except Exception as e:
+            with results['lock']:
+                results['errors'] += 1
+                results['error_samples'][f"{type(e).__name__}: {e}"[:200]] = True
+            continue
+        elapsed = time.perf_counter() - started - thought
+        with results['lock']:
+            results['latencies'].append(elapsed)
+            results['writes'].extend(writes)
+
+
+def count_lost_writes(writes, final=False):
+    """
+    Output: dict of acknowledged writes missing from each view of the data
+    """
+    import dataset
+
+    lost = {}
+    label_writes = [(datapoint_id, label) for kind, datapoint_id, label in writes if kind == 'label']
+    if label_writes:
+        history = dataset.read_tracking_data()
+        recorded = set(zip(history['datapoint_id'], pd.to_numeric(history['label'])))
+        lost['label_log'] = sum(1 for write in label_writes if write not in recorded)
+
+    al_writes = {folder_id: label for kind, folder_id, label in writes if kind == 'al'}
+    if al_writes:
+        # A fresh store sees exactly what another process would see
+        frame = dataset._new_al_store().frame().set_index('folder_id')['label']
+        lost['al_store'] = sum(1 for folder_id, label in al_writes.items() if frame.get(folder_id) != label)
+        if final:
+            dataset.materialise_al_tracking()
+            store = dataset.get_storage()
+            csv = pd.read_csv(io.BytesIO(store.get(dataset.AL_TRACKING_PATH))).set_index('folder_id')['label']
+            lost['al_csv'] = sum(1 for folder_id, label in al_writes.items() if csv.get(folder_id) != label)
+    return lost
+
+
+def _request_counts(snapshot):
+    storage_requests = sum(value for name, value in snapshot['counters'].items()
+                           if name.startswith('storage_requests'))
+    streetview_requests = sum(value for name, value in snapshot['counters'].items()
+                              if name.startswith('streetview_requests') and 'cached' not in name)
+    return storage_requests, streetview_requests
+
+
+def run_level(users, mode, duration, context):
+    metrics.REGISTRY.reset()
+    results = {'latencies': [], 'writes': [], 'errors': 0, 'skipped': 0, 'exhausted': False,
+               'error_samples': {}, 'held': context['held'], 'double_leases': [], 'lock': threading.Lock()}
+    deadline = time.time() + duration
+    started = time.time()
+    threads = [threading.Thread(target=simulate_user, args=(user, mode, deadline, context, results), daemon=True)
+               for user in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    snapshot = metrics.snapshot()
+    storage_requests, streetview_requests = _request_counts(snapshot)
+    latencies = results['latencies']
+    level = {
+        'users': users,
+        'cycles': len(latencies),
+        'errors': results['errors'],
+        'skipped': results['skipped'],
+        'throughput': len(latencies) / elapsed if elapsed else 0,
+        'p50': metrics.percentile(sorted(latencies), 0.5),
+        'p95': metrics.percentile(sorted(latencies), 0.95),
+        'p99': metrics.percentile(sorted(latencies), 0.99),
+        'storage_requests': storage_requests,
+        'storage_requests_per_cycle': storage_requests / len(latencies) if latencies else None,
+        'streetview_requests': streetview_requests,
+        'stages': {stage: {'p50': stats['p50'], 'p95': stats['p95'], 'count': stats['count']}
+                   for stage, stats in snapshot['spans'].items()},
+        'lost_writes': count_lost_writes(results['writes']),
+        'double_leases': len(results['double_leases']),
+        'queue_exhausted': results['exhausted']
+    }
+    for folder_id, holder, session_id in results['double_leases'][:5]:
+        print(f"  double lease: {folder_id} held by {holder} and {session_id}", file=sys.stderr)
+    for sample in list(results['error_samples'])[:5]:
+        print(f"  error: {sample}", file=sys.stderr)
+    return level, results['writes']
+
+
+def print_level(level):
+    def ms(value):
+        return f"{value * 1000:.0f}ms" if value is not None else "-"
+
+    print(f"{level['users']:>4} users: {level['cycles']} cycles, {level['throughput']:.2f}/s, "
+          f"p50 {ms(level['p50'])} p95 {ms(level['p95'])} p99 {ms(level['p99'])}, "
+          f"{level['errors']} errors, {level['storage_requests']} storage requests, "
+          f"{level['streetview_requests']} Street View requests, lost writes {level['lost_writes']}, "
+          f"{level['double_leases']} double leases")
+    for stage, stats in sorted(level['stages'].items(), key=lambda item: -(item[1]['p95'] or 0))[:6]:
+        print(f"       {stage:<28} p50 {ms(stats['p50'])} p95 {ms(stats['p95'])} ({stats['count']} calls)")
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """
+    Output: list of regression messages (empty if none)
+    """
+    regressions = []
+    previous = {level['users']: level for level in baseline.get('levels', [])}
+    for level in report['levels']:
+        before = previous.get(level['users'])
+        if before is None:
+            continue
+        if before['p95'] and level['p95'] and level['p95'] > before['p95'] * (1 + tolerance):
+            regressions.append(f"{level['users']} users: p95 {level['p95']:.3f}s vs {before['p95']:.3f}s")
+        if before['throughput'] and level['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append(f"{level['users']} users: throughput {level['throughput']:.2f}/s "
+                               f"vs {before['throughput']:.2f}/s")
+        if level['double_leases']:
+            regressions.append(f"{level['users']} users: {level['double_leases']} folder(s) leased to two sessions")
+        if sum(level['lost_writes'].values()) > sum(before['lost_writes'].values()):
+            regressions.append(f"{level['users']} users: lost writes {level['lost_writes']} vs {before['lost_writes']}")
+    return regressions
+
+
+def main(args):
+    image = make_jpeg()
+    fake = FakeStreetView(image, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+
+    # The app modules read these at import time
+    storage_spec = args.storage or f"local:{tempfile.mkdtemp(prefix='detroit-load-test-')}"
+    os.environ['DETROIT_STORAGE'] = storage_spec
+    os.environ['STREETVIEW_BASE_URL'] = fake.start()
+    os.environ['STREETVIEW_CACHE_DIR'] = tempfile.mkdtemp(prefix='detroit-load-test-cache-')
+
+    import dataset
+    import renditions
+    from point_sampler import PointSampler
+    from street_headings import build_heading_table
+
+    points_df = pd.read_csv(args.points)
+    seed_storage(dataset.get_storage(), points_df, args.al_folders, image)
+    shared_points = dataset.read_location_sampling()
+    # Shared by all simulated users, as in the app (labelling_interface.get_point_sampler)
+    context = {'points_df': shared_points, 'heading_table': build_heading_table(points_df),
+               'sampler': PointSampler.from_points(shared_points, exclude=dataset.get_indexes_in_dataset()),
+               'coverage': dataset.get_street_coverage(shared_points, (id(shared_points), len(shared_points))),
+               'think': args.think,
+               # Folder id -> session holding its lease, over the whole run
+               'held': {}}
+    print(f"Storage {storage_spec}, fake Street View latency {args.latency}s, mode {args.mode}")
+
+    # Spawned rendition workers would otherwise be started inside the first level
+    renditions.warm_up()
+
+    report = {'mode': args.mode, 'duration': args.duration, 'latency': args.latency, 'think': args.think,
+              'cpu_count': os.cpu_count(), 'levels': []}
+    all_writes = []
+    for users in [int(users) for users in args.users.split(',')]:
+        level, writes = run_level(users, args.mode, args.duration, context)
+        all_writes.extend(writes)
+        report['levels'].append(level)
+        print_level(level)
+        if level['queue_exhausted']:
+            print("Active learning queue exhausted, increase --al-folders")
+            break
+    report['final_lost_writes'] = count_lost_writes(all_writes, final=True)
+    print(f"Lost writes over the whole run: {report['final_lost_writes']}")
+    fake.stop()
+
+    double_leases = sum(level['double_leases'] for level in report['levels'])
+    if double_leases:
+        print(f"FAILED: {double_leases} folder(s) leased to two sessions at once")
+        return 1
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        # Only this mode's report is replaced
+        baselines[args.mode] = report
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"Baseline for mode {args.mode} saved to {args.baseline}")
+        return 0
+    baseline = baselines.get(args.mode)
+    if baseline is None:
+        print(f"No baseline for mode {args.mode} in {args.baseline}, not compared")
+        return 0
+    if baseline.get('cpu_count') != report['cpu_count']:
+        print(f"Baseline recorded with {baseline.get('cpu_count')} CPUs, this machine has {report['cpu_count']}")
+    regressions = compare_to_baseline(report, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regressions against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the labelling cycle against local stand-ins")
+    parser.add_argument("--mode", choices=['al', 'streetview'], default='al')
+    parser.add_argument("--users", default="1,4,16", help="Comma separated concurrent users per level")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per level")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake Street View latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Latency jitter, fraction of --latency")
+    parser.add_argument("--think", type=float, default=1.0,
+                        help="Seconds a labeller looks at a datapoint before saving (0: back to back)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake Street View 500s")
+    parser.add_argument("--al-folders", type=int, default=1000, help="Active learning folders to seed")
+    parser.add_argument("--points", default=POINTS_CSV)
+    parser.add_argument("--storage", default=None, help="Storage spec (default: a fresh local directory)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    sys.exit(main(parser.parse_args()))
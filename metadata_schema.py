@@ -0,0 +1,110 @@
+"""
+Structured per-datapoint metadata record.
+
+Every datapoint (packed header, manifest row) carries the same typed fields:
+
+    datapoint_id  str              '{p}_{angle}_{lat}_{lon}'
+    point_id      int
+    angle         float
+    latitude      float
+    longitude     float
+    headings      list of float
+    address       str
+    label         int or None      (None: extracted but not labelled yet)
+    labeller      str or None
+    timestamp     str              ISO 8601, time of the save
+    api_params    dict             Street View parameters (size, pitch, fov, source)
+    schema        int              SCHEMA_VERSION
+"""
+
+import ast
+from datetime import datetime
+
+SCHEMA_VERSION = 1
+
+FIELDS = ['datapoint_id', 'point_id', 'angle', 'latitude', 'longitude', 'headings', 'address',
+          'label', 'labeller', 'timestamp', 'api_params', 'schema']
+
+DEFAULT_API_PARAMS = {'size': '640x480', 'pitch': 0, 'fov': 90, 'source': 'outdoor'}
+
+# metadata.txt line names -> record fields
+LEGACY_KEYS = {
+    'Latitude': 'latitude',
+    'Longitude': 'longitude',
+    'Headings': 'headings',
+    'Address': 'address',
+    'Label': 'label',
+    'Labeller username': 'labeller'
+}
+
+
+def _to_float(value):
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+def _to_int(value):
+    if value is None or value == '' or value == 'None':
+        return None
+    return int(float(value))
+
+
+def _to_headings(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = ast.literal_eval(value)
+    return [float(heading) for heading in value]
+
+
+def build_metadata(datapoint_id, headings, address, label=None, labeller=None, api_params=None, timestamp=None):
+    """
+    Typed record for a datapoint; point/angle/coordinates come from the datapoint id
+    """
+    return normalise_metadata({
+        'headings': headings,
+        'address': address,
+        'label': label,
+        'labeller': labeller,
+        'timestamp': timestamp or datetime.now().isoformat(),
+        'api_params': api_params or dict(DEFAULT_API_PARAMS)
+    }, datapoint_id)
+
+
+def normalise_metadata(raw, datapoint_id=None):
+    """
+    Coerce a metadata dict (any earlier version, or parsed metadata.txt) to the current schema
+    """
+    datapoint_id = raw.get('datapoint_id') or datapoint_id
+    record = {field: None for field in FIELDS}
+    record['datapoint_id'] = datapoint_id
+    if datapoint_id:
+        point_id, angle, lat, lon = datapoint_id.split("_")
+        record['point_id'] = _to_int(point_id)
+        record['angle'] = _to_float(angle)
+        record['latitude'] = _to_float(lat)
+        record['longitude'] = _to_float(lon)
+    for field in ('latitude', 'longitude'):
+        if raw.get(field) not in (None, ''):
+            record[field] = _to_float(raw[field])
+    record['headings'] = _to_headings(raw.get('headings'))
+    record['address'] = raw.get('address') or 'N/A'
+    record['label'] = _to_int(raw.get('label'))
+    record['labeller'] = raw.get('labeller') or None
+    record['timestamp'] = raw.get('timestamp')
+    record['api_params'] = dict(raw.get('api_params') or DEFAULT_API_PARAMS)
+    record['schema'] = SCHEMA_VERSION
+    return record
+
+
+def parse_legacy_metadata(content, datapoint_id=None):
+    """
+    metadata.txt -> record. Lines are split on the first ':' only, so values may contain colons.
+    """
+    raw = {}
+    for line in content.splitlines():
+        name, sep, value = line.partition(":")
+        if sep and name.strip() in LEGACY_KEYS:
+            raw[LEGACY_KEYS[name.strip()]] = value.strip()
+    return normalise_metadata(raw, datapoint_id)
@@ -0,0 +1,229 @@
+"""
+Lightweight in-process tracing and metrics.
+
+    with metrics.span('save_label'):
+        ...
+
+    @metrics.timed('download_datapoint')
+    def download_datapoint(folder): ...
+
+    metrics.incr('storage_requests', backend='s3', op='get')
+
+Each stage keeps its count, total time, errors and a bounded window of the
+most recent durations, from which p50/p95/p99 are computed. Counters are
+keyed on a name plus optional labels.
+
+Everything is process-wide (all sessions and background threads) and is
+exposed as:
+- Prometheus text format, served on METRICS_PORT (GET /metrics), on localhost
+  unless METRICS_HOST says otherwise (it shows per-user counters and API spend)
+- a JSONL dump, one snapshot appended every METRICS_DUMP_INTERVAL seconds to METRICS_DUMP_PATH
+- the admin panel of the labelling page
+"""
+
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Durations kept per stage for the percentiles
+RESERVOIR_SIZE = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = 'detroit'
+DUMP_INTERVAL = float(os.environ.get("METRICS_DUMP_INTERVAL", 60))
+DEFAULT_HOST = '127.0.0.1'
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    # Nearest rank
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _label_text(labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels)
+
+
+class Registry:
+
+    def __init__(self, reservoir_size=RESERVOIR_SIZE):
+        self.reservoir_size = reservoir_size
+        self._lock = threading.Lock()
+        self._spans = {}  # stage -> dict(count, total, errors, max, recent)
+        self._counters = {}  # (name, ((label, value), ...)) -> value
+
+    def observe(self, stage, seconds, error=False):
+        with self._lock:
+            entry = self._spans.get(stage)
+            if entry is None:
+                entry = self._spans[stage] = {'count': 0, 'total': 0.0, 'errors': 0, 'max': 0.0,
+                                              'recent': deque(maxlen=self.reservoir_size)}
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['recent'].append(seconds)
+            if error:
+                entry['errors'] += 1
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, error=error)
+
+    def timed(self, stage):
+        """
+        Decorator: record every call of the function as a span
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def incr(self, name, value=1, **labels):
+        key = (name, tuple(sorted((label, str(v)) for label, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self):
+        """
+        Output: {'time', 'spans': {stage: {count, errors, mean, p50, p95, p99, max}},
+                 'counters': {'name{labels}': value}}
+        """
+        with self._lock:
+            spans = {stage: dict(entry, recent=sorted(entry['recent'])) for stage, entry in self._spans.items()}
+            counters = dict(self._counters)
+
+        span_stats = {}
+        for stage, entry in spans.items():
+            stats = {'count': entry['count'], 'errors': entry['errors'],
+                     'mean': entry['total'] / entry['count'], 'max': entry['max'], 'total': entry['total']}
+            for q in QUANTILES:
+                stats[f"p{int(q * 100)}"] = percentile(entry['recent'], q)
+            span_stats[stage] = stats
+
+        counter_values = {}
+        for (name, labels), value in sorted(counters.items()):
+            counter_values[f"{name}{{{_label_text(labels)}}}" if labels else name] = value
+        return {'time': time.time(), 'spans': span_stats, 'counters': counter_values}
+
+    def prometheus_text(self):
+        with self._lock:
+            spans = {stage: dict(entry, recent=sorted(entry['recent'])) for stage, entry in self._spans.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        if spans:
+            name = f"{METRIC_PREFIX}_stage_seconds"
+            lines.append(f"# TYPE {name} summary")
+            for stage, entry in sorted(spans.items()):
+                for q in QUANTILES:
+                    lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {percentile(entry["recent"], q)}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {entry["total"]}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {entry["count"]}')
+            lines.append(f"# TYPE {METRIC_PREFIX}_stage_errors_total counter")
+            for stage, entry in sorted(spans.items()):
+                lines.append(f'{METRIC_PREFIX}_stage_errors_total{{stage="{stage}"}} {entry["errors"]}')
+
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{{{_label_text(labels)}}} {value}" if labels else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._spans = {}
+            self._counters = {}
+
+
+REGISTRY = Registry()
+
+span = REGISTRY.span
+timed = REGISTRY.timed
+incr = REGISTRY.incr
+snapshot = REGISTRY.snapshot
+prometheus_text = REGISTRY.prometheus_text
+
+
+def dump_jsonl(path, registry=REGISTRY):
+    with open(path, 'a') as f:
+        f.write(json.dumps(registry.snapshot()) + "\n")
+
+
+def _dump_loop(path, interval, registry):
+    while True:
+        time.sleep(interval)
+        try:
+            dump_jsonl(path, registry)
+        except OSError as e:
+            print(f"Error writing metrics dump: {e}")
+
+
+def serve_prometheus(port, registry=REGISTRY, host=DEFAULT_HOST):
+    """
+    Serve GET /metrics in a daemon thread
+
+    Output: the HTTP server (call .shutdown() to stop it)
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server
+
+
+def start_exporters(registry=REGISTRY):
+    """
+    Start the exporters configured by METRICS_PORT / METRICS_DUMP_PATH (call once per process)
+
+    Output: dict of what was started
+    """
+    started = {}
+    port = os.environ.get("METRICS_PORT")
+    if port:
+        try:
+            started['server'] = serve_prometheus(int(port), registry,
+                                                 host=os.environ.get("METRICS_HOST", DEFAULT_HOST))
+        except OSError as e:
+            # Another process (e.g. a second app worker) already serves this port
+            print(f"Error starting metrics endpoint on port {port}: {e}")
+    path = os.environ.get("METRICS_DUMP_PATH")
+    if path:
+        thread = threading.Thread(target=_dump_loop, args=(path, DUMP_INTERVAL, registry),
+                                  daemon=True, name="metrics-dump")
+        thread.start()
+        started['dump'] = thread
+    return started
@@ -0,0 +1,110 @@
+"""
+Migrate legacy datapoint folders (image_0..4.png + metadata.txt) to the packed format.
+
+    python migrate_packed.py DetroitImageDataset_v2/ GoogleDetroitDatabase/ [--delete-legacy]
+
+Folders that already have a datapoint.pack with renditions are skipped, so the
+tool can be re-run safely; packs written without renditions (e.g. by an earlier
+version of this tool) get them added. Folders without a metadata.txt (the
+GoogleDetroitDatabase/ extractions) get their metadata from the folder name,
+as download_datapoint does. Legacy objects are only deleted (with
+--delete-legacy) after the packed object has been written and read back.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import packed_format
+from storage import NotFound, get_storage
+from dataset import get_folder_names
+from metadata_schema import build_metadata, parse_legacy_metadata
+from renditions import render_all
+from street_headings import FAN_OFFSETS
+
+
+def folder_metadata(folder):
+    """
+    Metadata record from the folder name alone: the headings are the fan around its angle
+    """
+    angle = float(folder.split("_")[1])
+    headings = [angle if offset == 0 else (angle + offset) % 360 for offset in FAN_OFFSETS]
+    return build_metadata(folder, headings, 'N/A')
+
+
+def _read_legacy(store, path, folder):
+    try:
+        metadata = parse_legacy_metadata(store.get(f"{path}/metadata.txt").decode('latin-1'), folder)
+    except NotFound:
+        metadata = folder_metadata(folder)
+    images = [store.get(f"{path}/image_{i}.png") for i in range(5)]
+    return metadata, images, ['image/png'] * len(images)
+
+
+def _has_renditions(store, pack_key):
+    header, _, _ = packed_format.read_header(store, pack_key)
+    return any(entry.get('role') == 'thumb' for entry in header['images'])
+
+
+def migrate_folder(store, prefix, folder, delete_legacy):
+    path = f"{prefix}{folder}"
+    pack_key = f"{path}/{packed_format.PACK_NAME}"
+    keys = set(store.list_keys(f"{path}/"))
+    legacy_keys = sorted(key for key in keys if key != pack_key)
+
+    if pack_key not in keys:
+        metadata, images, content_types = _read_legacy(store, path, folder)
+        status = 'migrated'
+    elif not _has_renditions(store, pack_key):
+        # Packed before renditions existed: repack the raw images with them
+        metadata, images, header = packed_format.unpack_datapoint(store.get(pack_key))
+        images = [bytes(image) for image in images]
+        content_types = [entry['content_type'] for entry in header['images'] if entry.get('role', 'raw') == 'raw']
+        status = 'rendered'
+    else:
+        metadata = None
+        status = 'skipped'
+
+    if metadata is not None:
+        packed = packed_format.pack_datapoint(metadata, images, content_types=content_types,
+                                              renditions=render_all(images))
+        store.put(pack_key, packed)
+
+        # Read back before anything is deleted
+        _, stored_images = packed_format.read_datapoint(store, pack_key)
+        if [bytes(image) for image in stored_images] != images:
+            raise ValueError(f"Read-back mismatch for {pack_key}")
+
+    if delete_legacy and legacy_keys:
+        store.delete(legacy_keys)
+    return status
+
+
+def migrate(prefix, delete_legacy=False, workers=16):
+    store = get_storage()
+
+    counts = {'migrated': 0, 'rendered': 0, 'skipped': 0, 'failed': 0}
+
+    def task(folder):
+        try:
+            return migrate_folder(store, prefix, folder, delete_legacy)
+        except Exception as e:
+            print(f"{prefix}{folder}: {type(e).__name__}: {e}")
+            return 'failed'
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for status in executor.map(task, get_folder_names(prefix)):
+            counts[status] += 1
+    print(f"{prefix}: {counts['migrated']} migrated, {counts['rendered']} renditions added, "
+          f"{counts['skipped']} already packed, {counts['failed']} failed")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate legacy datapoint folders to the packed format")
+    parser.add_argument("prefixes", nargs="+", help="Dataset directories, e.g. DetroitImageDataset_v2/")
+    parser.add_argument("--delete-legacy", action="store_true", help="Delete image_*.png/metadata.txt once packed")
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+
+    for prefix in args.prefixes:
+        migrate(prefix, args.delete_legacy, args.workers)
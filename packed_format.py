@@ -0,0 +1,149 @@
+"""
+Packed datapoint format: one object per datapoint instead of 5 images + metadata.txt.
+
+Layout:
+
+    b'DPK1' | header length (uint32, little endian) | header (JSON, utf-8) | payloads
+
+The header holds the datapoint metadata and an offset table:
+
+    {"metadata": {...},
+     "images": [{"role": "raw", "index": 0, "offset": 0, "length": 51234,
+                 "content_type": "image/jpeg"}, ...]}
+
+Offsets are relative to the first payload byte (8 + header length), so a
+single image can be fetched with two ranged GETs (header, then payload),
+or one when it falls within the first HEADER_PREFETCH bytes.
+
+Besides the 'raw' images (stored as received), a pack may hold 'display'
+and 'thumb' renditions (see renditions.py). Payloads are grouped by role,
+so all 5 images of a role are one contiguous ranged read.
+"""
+
+import json
+import struct
+
+MAGIC = b'DPK1'
+PREAMBLE = struct.Struct('<4sI')
+PACK_NAME = 'datapoint.pack'
+# Bytes fetched by the first ranged GET; comfortably holds the header
+HEADER_PREFETCH = 16 * 1024
+
+
+def pack_datapoint(metadata, images, content_types=None, renditions=None):
+    """
+    Input: metadata (JSON-serialisable dict), images (list of encoded bytes),
+           renditions (optional list of {'display': bytes, 'thumb': bytes}, one per image)
+    Output: packed bytes
+    """
+    if content_types is None:
+        content_types = ['image/png'] * len(images)
+    blocks = [('raw', images, content_types)]
+    if renditions:
+        blocks.append(('display', [r['display'] for r in renditions], ['image/webp'] * len(renditions)))
+        blocks.append(('thumb', [r['thumb'] for r in renditions], ['image/jpeg'] * len(renditions)))
+
+    entries = []
+    payloads = []
+    offset = 0
+    for role, datas, types in blocks:
+        for index, (data, content_type) in enumerate(zip(datas, types)):
+            entries.append({'role': role, 'index': index, 'offset': offset, 'length': len(data),
+                            'content_type': content_type})
+            payloads.append(data)
+            offset += len(data)
+    header = json.dumps({'metadata': metadata, 'images': entries}, default=str).encode('utf-8')
+    return b''.join([PREAMBLE.pack(MAGIC, len(header)), header] + payloads)
+
+
+def _entries(header, role):
+    return sorted((entry for entry in header['images'] if entry.get('role', 'raw') == role),
+                  key=lambda entry: entry.get('index', 0))
+
+
+def parse_header(data):
+    """
+    Input: the first bytes of a packed object
+    Output: (header dict, payload start), or (None, needed length) if `data` is too short
+    """
+    if len(data) < PREAMBLE.size:
+        return None, PREAMBLE.size
+    magic, header_length = PREAMBLE.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a packed datapoint")
+    payload_start = PREAMBLE.size + header_length
+    if len(data) < payload_start:
+        return None, payload_start
+    return json.loads(bytes(data[PREAMBLE.size:payload_start]).decode('utf-8')), payload_start
+
+
+def unpack_datapoint(data, role='raw'):
+    """
+    Input: full packed bytes
+    Output: (metadata, list of image bytes of the given role, header)
+    """
+    header, payload_start = parse_header(data)
+    if header is None:
+        raise ValueError("Truncated packed datapoint")
+    images = [data[payload_start + entry['offset']:payload_start + entry['offset'] + entry['length']]
+              for entry in _entries(header, role)]
+    return header['metadata'], images, header
+
+
+def read_header(store, key):
+    """
+    Read only the header of a packed object (ranged GET)
+
+    Output: (header, payload start, prefix bytes already downloaded)
+    """
+    prefix = store.get_range(key, 0, HEADER_PREFETCH)
+    header, payload_start = parse_header(prefix)
+    if header is None:
+        prefix += store.get_range(key, len(prefix), payload_start)
+        header, payload_start = parse_header(prefix)
+    return header, payload_start, prefix
+
+
+def _read_span(store, key, payload_start, prefix, start, end):
+    start, end = payload_start + start, payload_start + end
+    if end <= len(prefix):
+        return prefix[start:end]
+    return store.get_range(key, start, end)
+
+
+def read_image(store, key, index, role='raw'):
+    """
+    Ranged read of a single image of a packed object
+
+    Output: (metadata, image bytes)
+    """
+    header, payload_start, prefix = read_header(store, key)
+    entry = _entries(header, role)[index]
+    data = _read_span(store, key, payload_start, prefix, entry['offset'], entry['offset'] + entry['length'])
+    return header['metadata'], data
+
+
+def read_role(store, key, role):
+    """
+    Ranged read of all images of one role (e.g. 'display'), in one contiguous request
+
+    Output: (metadata, list of image bytes), the list is empty if the pack has no such role
+    """
+    header, payload_start, prefix = read_header(store, key)
+    entries = _entries(header, role)
+    if not entries:
+        return header['metadata'], []
+    start = min(entry['offset'] for entry in entries)
+    end = max(entry['offset'] + entry['length'] for entry in entries)
+    block = _read_span(store, key, payload_start, prefix, start, end)
+    return header['metadata'], [block[entry['offset'] - start:entry['offset'] - start + entry['length']]
+                                for entry in entries]
+
+
+def read_datapoint(store, key, role='raw'):
+    """
+    Output: (metadata, list of image bytes) with a single GET.
+            On local storage the images are zero-copy memoryviews of the mapped file.
+    """
+    metadata, images, _ = unpack_datapoint(store.get_view(key), role=role)
+    return metadata, images
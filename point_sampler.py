@@ -0,0 +1,156 @@
+"""
+Sampling of unlabelled points without replacement in O(1).
+
+The remaining point positions sit in a flat list with a position -> slot map:
+a draw picks a random slot and removes it by swapping the last element into
+it, so both drawing and removing are O(1) however much of the table is
+already covered (the old rejection loop needed more and more draws as
+coverage grew).
+
+With `strata` (e.g. the street_id of each point), the sampler keeps one such
+list per stratum plus a list of the non-empty strata: a draw first picks a
+stratum uniformly, then a point in it, so coverage spreads over streets
+instead of following their point density.
+
+The sampler is rebuilt in O(n) from the points table and the dataset index,
+which is cheap enough to not need persisting.
+"""
+
+import random
+import threading
+
+
+class _SwapList:
+    """
+    Set of hashable items with O(1) add, remove and uniform random pick
+    """
+    __slots__ = ('items', 'slots')
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        self.slots = {item: slot for slot, item in enumerate(self.items)}
+
+    def add(self, item):
+        if item not in self.slots:
+            self.slots[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item):
+        slot = self.slots.pop(item, None)
+        if slot is None:
+            return False
+        last = self.items.pop()
+        if slot < len(self.items):
+            self.items[slot] = last
+            self.slots[last] = slot
+        return True
+
+    def pick(self, rng):
+        return self.items[rng.randrange(len(self.items))]
+
+    def __contains__(self, item):
+        return item in self.slots
+
+    def __len__(self):
+        return len(self.items)
+
+
+class PointSampler:
+
+    def __init__(self, positions, strata=None, exclude=(), seed=None):
+        """
+        Input: positions -- iterable of point positions (the `p` of folder names)
+               strata -- optional iterable, the stratum of each position (same order)
+               exclude -- positions already in the dataset
+        """
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        exclude = set(exclude)
+        positions = list(positions)
+        self._stratum_of = dict(zip(positions, strata)) if strata is not None else None
+        remaining = [position for position in positions if position not in exclude]
+
+        self._remaining = _SwapList(remaining)
+        self._strata = {}
+        self._open_strata = _SwapList()
+        if self._stratum_of is not None:
+            for position in remaining:
+                self._add_to_stratum(position)
+
+    @classmethod
+    def from_points(cls, points_df, exclude=(), stratify=True, seed=None):
+        """
+        Sampler over the row positions of the points table, stratified by street_id
+        """
+        strata = points_df['street_id'].tolist() if stratify and 'street_id' in points_df.columns else None
+        return cls(range(len(points_df)), strata=strata, exclude=exclude, seed=seed)
+
+    def _add_to_stratum(self, position):
+        stratum = self._stratum_of[position]
+        members = self._strata.get(stratum)
+        if members is None:
+            members = self._strata[stratum] = _SwapList()
+        members.add(position)
+        self._open_strata.add(stratum)
+
+    def _remove_unlocked(self, position):
+        if not self._remaining.remove(position):
+            return False
+        if self._stratum_of is not None:
+            stratum = self._stratum_of[position]
+            members = self._strata[stratum]
+            members.remove(position)
+            if not members:
+                self._open_strata.remove(stratum)
+        return True
+
+    def sample(self, accept_stratum=None, tries=8):
+        """
+        Draw (and remove) one position uniformly, or None when all are drawn.
+
+        accept_stratum -- optional predicate to prefer some strata (e.g. uncovered streets):
+                          up to `tries` strata are drawn until one is accepted
+        """
+        with self._lock:
+            if not self._remaining:
+                return None
+            if self._stratum_of is None:
+                position = self._remaining.pick(self._rng)
+            else:
+                stratum = self._open_strata.pick(self._rng)
+                if accept_stratum is not None:
+                    for _ in range(tries - 1):
+                        if accept_stratum(stratum):
+                            break
+                        stratum = self._open_strata.pick(self._rng)
+                position = self._strata[stratum].pick(self._rng)
+            self._remove_unlocked(position)
+            return position
+
+    def remove(self, position):
+        """
+        Mark a position as taken (e.g. saved by another session)
+        """
+        with self._lock:
+            return self._remove_unlocked(position)
+
+    def restore(self, position):
+        """
+        Put back a drawn position that was never labelled
+        """
+        with self._lock:
+            if position in self._remaining:
+                return
+            if self._stratum_of is not None and position not in self._stratum_of:
+                return
+            self._remaining.add(position)
+            if self._stratum_of is not None:
+                self._add_to_stratum(position)
+
+    def __contains__(self, position):
+        with self._lock:
+            return position in self._remaining
+
+    def __len__(self):
+        with self._lock:
+            return len(self._remaining)
@@ -0,0 +1,222 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds between retries of a failing producer
+RETRY_SECONDS = 5
+# Threads running the saves of all sessions of the process
+SAVE_WORKERS = 8
+
+_save_executor = None
+_save_executor_lock = threading.Lock()
+
+
+class _Failure:
+    """
+    Queued in place of an item when `produce()` raised, so `get` re-raises it
+    """
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+class DatapointPrefetcher:
+    """
+    Bounded background queue of ready-to-label datapoints for one session.
+
+    A worker thread calls `produce()` (e.g. generate_images / extract_images)
+    until `depth` items are waiting, and refills as `get` consumes them.
+    When `produce()` raises (e.g. queue exhausted, API errors), the exception
+    is queued and re-raised by `get`; the worker retries every RETRY_SECONDS.
+    Streamlit gives no hook for the end of a session, so the worker also shuts
+    itself down after `idle_timeout` seconds without a `get`. Items it drops
+    then (or when closed) go to `on_discard(item)`, e.g. to release leases.
+    """
+
+    def __init__(self, produce, depth=3, idle_timeout=900, name="prefetch", on_discard=None):
+        self._produce = produce
+        self._queue = queue.Queue(maxsize=depth)
+        self.idle_timeout = idle_timeout
+        self.on_discard = on_discard
+        self._last_get = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _idle(self):
+        return time.time() - self._last_get > self.idle_timeout
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._idle():
+                break
+            try:
+                item = self._produce()
+            except Exception as e:
+                print(f"Error prefetching datapoint: {e}")
+                try:
+                    self._queue.put_nowait(_Failure(e))
+                except queue.Full:
+                    pass
+                self._stop.wait(RETRY_SECONDS)
+                continue
+            # Producers return None when the sampled point had to be skipped
+            if item is None:
+                continue
+            while True:
+                if self._stop.is_set() or self._idle():
+                    # Never queued: nobody else can give it back
+                    self._discard(item)
+                    break
+                try:
+                    self._queue.put(item, timeout=1)
+                    break
+                except queue.Full:
+                    pass
+        self._stop.set()
+        # Idle shutdown: the session is gone, give back what is still queued
+        self._drain()
+
+    def _discard(self, item, on_discard=None):
+        on_discard = on_discard or self.on_discard
+        if on_discard is None or isinstance(item, _Failure):
+            return
+        try:
+            on_discard(item)
+        except Exception as e:
+            print(f"Error discarding prefetched datapoint: {e}")
+
+    def _drain(self, on_discard=None):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(item, on_discard)
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    @property
+    def depth(self):
+        return self._queue.maxsize
+
+    def set_depth(self, depth):
+        """
+        Change how many items are kept ready. Items already prefetched are kept,
+        even if there are more of them than the new depth.
+        """
+        with self._queue.mutex:
+            self._queue.maxsize = depth
+            # Wake a worker blocked on a full queue
+            self._queue.not_full.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Next prefetched item; blocks only if the queue is empty (e.g. first load).
+        Re-raises the exception of a failed `produce()`; raises TimeoutError after `timeout` seconds.
+        """
+        self._last_get = time.time()
+        try:
+            item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No datapoint ready after {timeout} seconds")
+        finally:
+            self._last_get = time.time()
+        if isinstance(item, _Failure):
+            raise item.error
+        return item
+
+    def close(self, on_discard=None):
+        """
+        Stop the worker and drop prefetched items so their images can be freed.
+        `on_discard(item)` (default: the constructor's) is called for each dropped item,
+        including the one the worker is holding when it stops.
+        """
+        if on_discard is not None:
+            self.on_discard = on_discard
+        self._stop.set()
+        self._drain()
+
+
+def get_save_executor():
+    """
+    Process-wide pool shared by the BackgroundSavers of all sessions
+    """
+    global _save_executor
+    with _save_executor_lock:
+        if _save_executor is None:
+            _save_executor = ThreadPoolExecutor(max_workers=SAVE_WORKERS, thread_name_prefix="label-save")
+    return _save_executor
+
+
+class BackgroundSaver:
+    """
+    Runs save calls off the click path, in submission order, for one session.
+    Errors are collected and reported on a later rerun.
+
+    The calls run on the shared save pool, at most one at a time per session,
+    so an abandoned session holds no thread.
+    """
+
+    def __init__(self, executor=None):
+        self._executor = executor or get_save_executor()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._tasks = deque()
+        self._draining = False
+        self._pending = 0
+        self._errors = []
+
+    def _run(self, fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self._errors.append(f"{fn.__name__}: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._tasks:
+                    self._draining = False
+                    return
+                fn, args, kwargs = self._tasks.popleft()
+            self._run(fn, args, kwargs)
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self._pending += 1
+            self._tasks.append((fn, args, kwargs))
+            if self._draining:
+                return
+            self._draining = True
+        self._executor.submit(self._drain)
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def pop_errors(self):
+        with self._lock:
+            errors, self._errors = self._errors, []
+        return errors
+
+    def close(self, wait=True):
+        """
+        Wait for the submitted saves (the shared pool itself keeps running)
+        """
+        if wait:
+            with self._idle:
+                self._idle.wait_for(lambda: self._pending == 0)
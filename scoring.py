@@ -0,0 +1,427 @@
+"""
+Local scoring stage keeping the active learning certainties fresh.
+
+The certainty column of the active learning table came from an offline model
+and went stale as labels arrived. The Scorer refreshes it in-process, on CPU:
+
+- each folder's features are computed once from its thumbnail renditions
+  (colour, brightness and edge statistics per heading, in numpy) and cached in
+  memory and in storage (Features/), so no image is decoded twice
+- a lightweight model (numpy logistic regression by default; anything with
+  fit/predict_proba can be plugged in) is refit, warm-started, on the labelled
+  folders after each batch of labels
+- only the unlabelled folders within NEIGHBOURHOOD_RADIUS metres of the newly
+  labelled ones are re-scored; their certainties go to the active learning
+  store as one update and to the uncertainty queue right away
+
+    python scoring.py --full       # score every unlabelled folder once (bootstrap)
+    python scoring.py --compact    # merge the feature shards into one snapshot
+
+Each scoring batch writes a feature shard; compact_logs.py folds them into the
+snapshot. The Scorer loads features and builds its state in its own thread, so
+starting it (on the first label save) does not wait on storage.
+
+Set DETROIT_SCORING=off to disable it, DETROIT_SCORING_MODEL to pick a model from MODELS.
+"""
+
+import argparse
+import io
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+from spatial_index import SpatialIndex
+
+FEATURES_PREFIX = 'Features/'
+FEATURES_SNAPSHOT_NAME = 'features.npz'
+
+# Active learning labels used as training targets (Bad Data and unlabelled are left out)
+TARGETS = {0: 0, 1: 1, 2: 0, 3: 1}
+UNLABELLED = 5
+
+# Unlabelled folders re-scored around each newly labelled one (metres), and at most per batch
+NEIGHBOURHOOD_RADIUS = 250.0
+MAX_RESCORE = 500
+
+IMAGES_PER_DATAPOINT = 5
+FEATURE_SIZE = (80, 60)
+HISTOGRAM_BINS = 8
+FEATURE_WORKERS = 8
+SCORER_SHARD = 'scorer'
+# Seconds between attempts to load the scorer's state
+PREPARE_RETRY_SECONDS = 30
+
+
+def image_features(images):
+    """
+    Input: the images of a datapoint (encoded bytes, memoryviews or PIL images)
+    Output: float32 vector with the same layout whatever the number of images
+    """
+    features = []
+    for image in list(images)[:IMAGES_PER_DATAPOINT]:
+        if not hasattr(image, 'convert'):
+            image = Image.open(io.BytesIO(bytes(image)))
+        image = image.convert('RGB')
+        if image.size != FEATURE_SIZE:
+            image = image.resize(FEATURE_SIZE)
+        pixels = np.asarray(image, dtype=np.float32) / 255.0
+        gray = pixels.mean(axis=2)
+        # The lower half is where the sidewalk and kerb are
+        lower = gray[gray.shape[0] // 2:]
+        histogram = np.histogram(gray, bins=HISTOGRAM_BINS, range=(0.0, 1.0))[0] / gray.size
+        features.append(np.concatenate([
+            pixels.mean(axis=(0, 1)), pixels.std(axis=(0, 1)), histogram,
+            [np.abs(np.diff(gray, axis=1)).mean(), np.abs(np.diff(gray, axis=0)).mean(),
+             lower.mean(), np.abs(np.diff(lower, axis=1)).mean()],
+        ]))
+    size = 6 + HISTOGRAM_BINS + 4
+    while len(features) < IMAGES_PER_DATAPOINT:
+        features.append(np.zeros(size))
+    return np.concatenate(features).astype(np.float32)
+
+
+class LogisticModel:
+    """
+    L2-regularised logistic regression trained by full-batch gradient descent.
+    Refits start from the previous weights, so a few iterations suffice after a batch of labels.
+    """
+
+    def __init__(self, l2=1e-2, learning_rate=0.5, iterations=300):
+        self.l2 = l2
+        self.learning_rate = learning_rate
+        self.iterations = iterations
+        self.weights = None
+        self.mean = None
+        self.scale = None
+
+    def _design(self, X):
+        Z = (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+        return np.hstack([Z, np.ones((len(Z), 1))])
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.mean = X.mean(axis=0)
+        self.scale = X.std(axis=0) + 1e-6
+        Z = self._design(X)
+        weights = self.weights if self.weights is not None and len(self.weights) == Z.shape[1] else np.zeros(Z.shape[1])
+        penalty = np.full(Z.shape[1], self.l2)
+        penalty[-1] = 0.0  # no penalty on the bias
+        for _ in range(self.iterations):
+            p = 1.0 / (1.0 + np.exp(-(Z @ weights)))
+            weights = weights - self.learning_rate * (Z.T @ (p - y) / len(y) + penalty * weights)
+        self.weights = weights
+        return self
+
+    def predict_proba(self, X):
+        """
+        Output: probability of the positive (feasible) class for each row
+        """
+        return 1.0 / (1.0 + np.exp(-(self._design(X) @ self.weights)))
+
+
+MODELS = {'logistic': LogisticModel}
+
+
+def create_model(name=None):
+    name = name or os.environ.get('DETROIT_SCORING_MODEL', 'logistic')
+    return MODELS[name]()
+
+
+def enabled():
+    return os.environ.get('DETROIT_SCORING', 'on').lower() not in ('off', '0', 'false')
+
+
+def certainty(probabilities):
+    """
+    Confidence of the predicted class: 0.5 is the most uncertain, 1 the most certain
+    """
+    return np.maximum(probabilities, 1.0 - probabilities)
+
+
+def _coordinates(folder_id):
+    # Folder names look like '{p}_{angle}_{latitude}_{longitude}'
+    _, _, lat, lon = folder_id.split('_')
+    return float(lat), float(lon)
+
+
+class FeatureCache:
+    """
+    folder_id -> feature vector, in memory and persisted as npz shards (one per scoring batch)
+    """
+
+    def __init__(self, store, prefix=FEATURES_PREFIX):
+        self._store = store
+        self.prefix = prefix
+        self.snapshot_key = f"{prefix}{FEATURES_SNAPSHOT_NAME}"
+        self._lock = threading.Lock()
+        self.features = {}
+        self._new = {}
+
+    def _read(self, key):
+        with np.load(io.BytesIO(self._store.get(key)), allow_pickle=False) as data:
+            return dict(zip(data['folder_ids'].tolist(), data['features']))
+
+    def _write(self, key, features):
+        buffer = io.BytesIO()
+        np.savez(buffer, folder_ids=np.array(list(features.keys()), dtype=str),
+                 features=np.stack(list(features.values())))
+        self._store.put(key, buffer.getvalue())
+
+    def _shard_keys(self):
+        return [key for key in self._store.list_keys(self.prefix)
+                if key.endswith('.npz') and key != self.snapshot_key]
+
+    def _read_or_empty(self, key):
+        try:
+            return self._read(key)
+        except KeyError:
+            # No snapshot yet, or a shard compacted away since the listing (NotFound is a KeyError)
+            return {}
+
+    def load(self):
+        """
+        Read the snapshot and every shard, concurrently
+        Output: list of the shard keys read
+        """
+        keys = self._shard_keys()
+        loaded = {}
+        with ThreadPoolExecutor(max_workers=FEATURE_WORKERS) as executor:
+            # map keeps the order: later shards override the snapshot
+            for features in executor.map(self._read_or_empty, [self.snapshot_key] + keys):
+                loaded.update(features)
+        with self._lock:
+            self.features.update(loaded)
+        return keys
+
+    def get(self, folder_id):
+        with self._lock:
+            return self.features.get(folder_id)
+
+    def put(self, folder_id, vector):
+        with self._lock:
+            self.features[folder_id] = vector
+            self._new[folder_id] = vector
+
+    def flush(self):
+        """
+        Persist the features computed since the last flush as one new shard
+        """
+        with self._lock:
+            new, self._new = self._new, {}
+        if new:
+            self._write(f"{self.prefix}{datetime.utcnow():%Y%m%dT%H%M%S%f}_{uuid.uuid4().hex}.npz", new)
+
+    def compact(self):
+        """
+        Fold all shards into the snapshot
+        """
+        keys = self.load()
+        with self._lock:
+            features = dict(self.features)
+        if features:
+            self._write(self.snapshot_key, features)
+        self._store.delete(keys)
+        return len(keys)
+
+    def __len__(self):
+        with self._lock:
+            return len(self.features)
+
+
+class Scorer:
+    """
+    Incremental re-scoring of the active learning table after each batch of labels.
+    Batches submitted while a re-scoring runs (or before `prepare` is done) are merged into the next one.
+    """
+
+    def __init__(self, al_store, al_queue, load_images, features, model=None,
+                 radius=NEIGHBOURHOOD_RADIUS, max_rescore=MAX_RESCORE):
+        """
+        Input: al_store -- ActiveLearningStore the certainties are written to
+               al_queue -- UncertaintyQueue (or coordinator) re-prioritised after scoring
+               load_images -- function folder_id -> images of the datapoint (thumbnails are enough)
+               features -- FeatureCache
+        """
+        self._al_store = al_store
+        self._al_queue = al_queue
+        self._load_images = load_images
+        self.features = features
+        self.model = model or create_model()
+        self.radius = radius
+        self.max_rescore = max_rescore
+        self.fitted = False
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self.ready = threading.Event()
+        self.labels = {}
+        self.unlabelled = set()
+        self.positions = SpatialIndex(cell_size=radius)
+
+    def prepare(self):
+        """
+        Load the cached features and index the active learning table
+        """
+        self.features.load()
+        frame = self._al_store.frame()
+        with self._lock:
+            self.labels = {folder_id: label for folder_id, label in zip(frame['folder_id'], frame['label'])
+                           if label != UNLABELLED}
+            self.unlabelled = set(frame['folder_id']) - set(self.labels)
+            self.positions = SpatialIndex(cell_size=self.radius)
+            folder_ids = frame['folder_id'].tolist()
+            coordinates = [_coordinates(folder_id) for folder_id in folder_ids]
+            self.positions.add_many([lat for lat, _ in coordinates], [lon for _, lon in coordinates], folder_ids)
+        self.ready.set()
+        return self
+
+    def start(self):
+        """
+        Prepare and run in a background thread (returns immediately)
+        """
+        threading.Thread(target=self._run, name="al-scorer", daemon=True).start()
+        return self
+
+    def submit(self, updates):
+        """
+        Queue a batch of labels for re-scoring (returns immediately)
+
+        Input: list of (folder_id, label)
+        """
+        self._pending.put(list(updates))
+
+    def _run(self):
+        while not self.ready.is_set():
+            try:
+                self.prepare()
+            except Exception as e:
+                # Submitted labels stay queued until it succeeds
+                print(f"Error preparing the active learning scorer: {e}")
+                time.sleep(PREPARE_RETRY_SECONDS)
+        while True:
+            updates = self._pending.get()
+            while True:
+                try:
+                    updates += self._pending.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self.rescore(updates)
+            except Exception as e:
+                print(f"Error re-scoring active learning certainties: {e}")
+
+    def _feature_matrix(self, folder_ids):
+        """
+        Output: (folder ids that have features, matrix), computing and caching missing features
+        """
+        missing = [folder_id for folder_id in folder_ids if self.features.get(folder_id) is None]
+
+        def compute(folder_id):
+            try:
+                self.features.put(folder_id, image_features(self._load_images(folder_id)))
+            except Exception as e:
+                print(f"Error computing features for {folder_id}: {e}")
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(FEATURE_WORKERS, len(missing))) as executor:
+                list(executor.map(compute, missing))
+        present = [(folder_id, self.features.get(folder_id)) for folder_id in folder_ids]
+        present = [(folder_id, vector) for folder_id, vector in present if vector is not None]
+        if not present:
+            return [], None
+        return [folder_id for folder_id, _ in present], np.stack([vector for _, vector in present])
+
+    def fit(self):
+        """
+        Refit the model on all labelled folders; False while both classes are not labelled yet
+        """
+        training = [(folder_id, TARGETS[label]) for folder_id, label in self.labels.items() if label in TARGETS]
+        if len({target for _, target in training}) < 2:
+            return False
+        targets = dict(training)
+        folder_ids, X = self._feature_matrix([folder_id for folder_id, _ in training])
+        y = [targets[folder_id] for folder_id in folder_ids]
+        if len(set(y)) < 2:
+            return False
+        self.model.fit(X, y)
+        self.fitted = True
+        return True
+
+    def neighbourhood(self, folder_ids):
+        """
+        Unlabelled folders within `radius` metres of the given ones, closest first
+        """
+        found = {}
+        for folder_id in folder_ids:
+            lat, lon = _coordinates(folder_id)
+            for neighbour, distance in self.positions.nearby(lat, lon, self.radius):
+                if neighbour in self.unlabelled and distance < found.get(neighbour, float('inf')):
+                    found[neighbour] = distance
+        return sorted(found, key=found.get)[:self.max_rescore]
+
+    def score(self, folder_ids):
+        """
+        Predict and write back the certainty of the given folders
+        Output: dict folder_id -> certainty
+        """
+        folder_ids, X = self._feature_matrix(folder_ids)
+        if not folder_ids:
+            return {}
+        certainties = dict(zip(folder_ids, certainty(self.model.predict_proba(X)).tolist()))
+        self._al_store.update_many([{'folder_id': folder_id, 'label': None, 'certainty': value}
+                                    for folder_id, value in certainties.items()], shard=SCORER_SHARD)
+        for folder_id, value in certainties.items():
+            self._al_queue.update_certainty(folder_id, value)
+        return certainties
+
+    def rescore(self, updates):
+        """
+        Record a batch of labels, refit, and re-score the unlabelled folders around them
+        """
+        with self._lock:
+            for folder_id, label in updates:
+                self.labels[folder_id] = label
+                self.unlabelled.discard(folder_id)
+            try:
+                if not self.fit():
+                    return {}
+                return self.score(self.neighbourhood([folder_id for folder_id, _ in updates]))
+            finally:
+                self.features.flush()
+
+    def rescore_all(self):
+        """
+        Score every unlabelled folder (bootstrap, or after changing the model)
+        """
+        with self._lock:
+            try:
+                if not self.fit():
+                    return {}
+                return self.score(sorted(self.unlabelled))
+            finally:
+                self.features.flush()
+
+
+if __name__ == "__main__":
+    import dataset
+    from al_queue import UncertaintyQueue
+    from storage import get_storage
+
+    parser = argparse.ArgumentParser(description="Active learning scoring stage")
+    parser.add_argument("--full", action="store_true", help="Score every unlabelled folder")
+    parser.add_argument("--compact", action="store_true", help="Merge the feature shards into one snapshot")
+    args = parser.parse_args()
+
+    if args.compact:
+        print(f"Compacted {FeatureCache(get_storage()).compact()} feature shard(s)")
+    if args.full:
+        scorer = dataset.new_scorer(dataset.get_al_store(), UncertaintyQueue()).prepare()
+        scored = scorer.rescore_all()
+        print(f"Scored {len(scored)} unlabelled folder(s)")
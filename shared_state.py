@@ -0,0 +1,289 @@
+"""
+Shared state tier for running several app.py worker processes.
+
+Without it each worker process builds its own points table, heading table,
+dataset index, active learning store and uncertainty queue. Leases only
+hold within one process and every worker keeps its own copy of everything.
+
+A single coordinator process owns that state instead:
+- the points table and its precomputed headings are published once in a
+  shared memory block; workers map it read-only (no copy, no S3 read)
+- dataset index, point sampler and street coverage, uncertainty queue and
+  leases, and label writes to the active learning store go through a small
+  coordination API, served by a multiprocessing manager
+
+    DETROIT_STATE_AUTHKEY=<secret> python shared_state.py --port 50000
+
+Workers use it when DETROIT_STATE_ADDRESS is set (e.g. 'localhost:50000',
+with the same DETROIT_STATE_AUTHKEY); otherwise everything stays in-process.
+The manager exchanges pickles, so whoever holds the key can run code in the
+coordinator: there is no default key, and the coordinator only listens on
+localhost unless --host says otherwise.
+Per-session memory is then limited to the images currently prefetched/shown.
+"""
+
+import argparse
+import os
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+import pandas as pd
+
+STATE_ADDRESS_ENV = "DETROIT_STATE_ADDRESS"
+AUTHKEY_ENV = "DETROIT_STATE_AUTHKEY"
+DEFAULT_HOST = "127.0.0.1"
+
+# Columns of the points table used on the request path (the WKT 'street' column is not needed
+# once the headings are precomputed)
+POINT_COLUMNS = ['point_id', 'street_id', 'latitude', 'longitude']
+# Columns of the shared block: the points table followed by its HeadingTable arrays
+HEADING_COLUMNS = ['bearing', 'baseline', 'headings']
+ALIGNMENT = 64
+
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def get_authkey():
+    """
+    Output: DETROIT_STATE_AUTHKEY as bytes; raises RuntimeError when it is not set
+    """
+    authkey = os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        raise RuntimeError(f"{AUTHKEY_ENV} must be set to serve or connect to the shared state coordinator")
+    return authkey.encode('utf-8')
+
+
+def publish_columns(columns):
+    """
+    Copy named arrays into one new shared memory block
+
+    Input: dict name -> numpy array
+    Output: (SharedMemory, layout) with layout a list of (name, dtype, shape, offset)
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in columns.items()}
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        layout.append((name, array.dtype.str, array.shape, offset))
+        offset += array.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for name, dtype, shape, offset in layout:
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = arrays[name]
+    return shm, layout
+
+
+def attach_columns(name, layout):
+    """
+    Map a block written by publish_columns
+
+    Output: (SharedMemory, dict name -> read-only array view); keep the SharedMemory alive
+            as long as the views are used
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    # The coordinator owns the block: stop this process's tracker from unlinking it on exit
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    columns = {}
+    for column, dtype, shape, offset in layout:
+        array = np.ndarray(tuple(shape), dtype=dtype, buffer=shm.buf, offset=offset)
+        array.flags.writeable = False
+        columns[column] = array
+    return shm, columns
+
+
+class Coordinator:
+    """
+    State shared by all workers, living in the coordinator process.
+    Every public method is callable from the workers through a manager proxy.
+    """
+
+    def __init__(self, sync_seconds=None):
+        # Imported here: dataset imports this module to find the coordinator
+        import dataset
+        import scoring
+        from al_queue import UncertaintyQueue
+        from point_sampler import PointSampler
+        from spatial_index import StreetCoverage
+        from street_headings import build_heading_table
+
+        # The coordinator itself always works on local state
+        os.environ.pop(STATE_ADDRESS_ENV, None)
+
+        points = dataset.read_location_sampling()
+        heading_table = build_heading_table(points)
+        columns = {column: points[column].to_numpy() for column in POINT_COLUMNS}
+        columns.update({column: getattr(heading_table, column) for column in HEADING_COLUMNS})
+        self._shm, self._layout = publish_columns(columns)
+
+        self._index = dataset.get_dataset_index()
+        self._sampler = PointSampler.from_points(points, exclude=self._index.get_point_ids())
+        self._coverage = StreetCoverage(points)
+        self._index.subscribe(self._coverage.add_datapoint)
+
+        self._store = dataset.get_al_store()
+        self._queue = UncertaintyQueue()
+        self._queue.sync(self._store.frame())
+        # Certainties around new labels are re-scored here, next to the store and queue
+        self._scorer = dataset.new_scorer(self._store, self._queue).start() if scoring.enabled() else None
+        self.sync_seconds = sync_seconds or dataset.AL_QUEUE_SYNC_SECONDS
+        self._stop = threading.Event()
+        threading.Thread(target=self._sync_loop, name="coordinator-sync", daemon=True).start()
+
+    def _sync_loop(self):
+        while not self._stop.wait(self.sync_seconds):
+            try:
+                # Picks up certainty updates and labels written outside the coordinator
+                self._store.refresh()
+                self._queue.sync(self._store.frame())
+            except Exception as e:
+                print(f"Error syncing the uncertainty queue: {e}")
+
+    # Points table
+    def points_table(self):
+        """
+        Output: (shared memory name, layout) to pass to attach_columns
+        """
+        return self._shm.name, self._layout
+
+    # Dataset index
+    def has_datapoint_near(self, coordinates, radius=None):
+        if radius is None:
+            return self._index.has_datapoint_near(coordinates)
+        return self._index.has_datapoint_near(coordinates, radius)
+
+    def contains_coordinates(self, coordinates):
+        return self._index.contains_coordinates(coordinates)
+
+    def get_point_ids(self):
+        return self._index.get_point_ids()
+
+    def add(self, folder_name):
+        self._index.add(folder_name)
+
+    # Point sampler
+    def sample_point(self, prefer_uncovered=True):
+        accept = (lambda street_id: not self._coverage.is_covered(street_id)) if prefer_uncovered else None
+        return self._sampler.sample(accept_stratum=accept)
+
+    def restore_point(self, position):
+        self._sampler.restore(position)
+
+    def coverage_ratio(self):
+        return self._coverage.coverage_ratio()
+
+    # Uncertainty queue and leases
+    def lease(self, session_id, k=1, ttl=None):
+        if ttl is None:
+            return self._queue.lease(session_id, k=k)
+        return self._queue.lease(session_id, k=k, ttl=ttl)
+
+    def release(self, folder_id):
+        self._queue.release(folder_id)
+
+    def complete(self, folder_id):
+        self._queue.complete(folder_id)
+
+    def update_certainty(self, folder_id, certainty):
+        self._queue.update_certainty(folder_id, certainty)
+
+    def queue_length(self):
+        return len(self._queue)
+
+    # Label writes
+    def record_label(self, folder_id, label=None, certainty=None, shard='anon'):
+        """
+        Write an active learning update through the single shared store
+        """
+        self._store.update(folder_id, label=label, certainty=certainty, shard=shard)
+        if self._scorer is not None and label is not None:
+            self._scorer.submit([(folder_id, label)])
+
+    def record_many(self, updates, shard='anon'):
+        self._store.update_many(updates, shard=shard)
+        labelled = [(update['folder_id'], update['label']) for update in updates if update.get('label') is not None]
+        if self._scorer is not None and labelled:
+            self._scorer.submit(labelled)
+
+    def close(self):
+        self._stop.set()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class RemoteSampler:
+    """
+    PointSampler interface over the coordinator (the coordinator decides which streets to prefer)
+    """
+
+    def __init__(self, coordinator):
+        self._coordinator = coordinator
+
+    def sample(self, accept_stratum=None, tries=8):
+        return self._coordinator.sample_point()
+
+    def restore(self, position):
+        self._coordinator.restore_point(position)
+
+
+class StateManager(BaseManager):
+    pass
+
+
+StateManager.register('get_coordinator')
+
+
+def get_coordinator():
+    """
+    Proxy to the coordinator process, or None when DETROIT_STATE_ADDRESS is not set
+    """
+    global _coordinator
+    address = os.environ.get(STATE_ADDRESS_ENV)
+    if not address:
+        return None
+    if _coordinator is None:
+        with _coordinator_lock:
+            if _coordinator is None:
+                host, port = address.rsplit(':', 1)
+                manager = StateManager(address=(host, int(port)), authkey=get_authkey())
+                manager.connect()
+                _coordinator = manager.get_coordinator()
+    return _coordinator
+
+
+def attach_points(coordinator):
+    """
+    Output: (SharedMemory, points DataFrame, HeadingTable), all backed by the shared block
+    """
+    from street_headings import HeadingTable
+
+    name, layout = coordinator.points_table()
+    shm, columns = attach_columns(name, layout)
+    points = pd.DataFrame({column: columns[column] for column in POINT_COLUMNS}, copy=False)
+    heading_table = HeadingTable(columns['point_id'], columns['bearing'], columns['baseline'], columns['headings'])
+    return shm, points, heading_table
+
+
+def serve(host=DEFAULT_HOST, port=50000):
+    # Checked before building the coordinator state
+    authkey = get_authkey()
+    coordinator = Coordinator()
+    StateManager.register('get_coordinator', callable=lambda: coordinator)
+    manager = StateManager(address=(host, port), authkey=authkey)
+    server = manager.get_server()
+    print(f"Coordinator serving on {host}:{port} "
+          f"({len(coordinator.get_point_ids())} points in dataset, {coordinator.queue_length()} queued)")
+    try:
+        server.serve_forever()
+    finally:
+        coordinator.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared state coordinator for several app workers")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Interface to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=50000)
+    args = parser.parse_args()
+    serve(args.host, args.port)
@@ -0,0 +1,139 @@
+"""
+Grid spatial index over (lat, lon) points.
+
+Points are bucketed into square cells of `cell_size` metres (equirectangular
+projection around Detroit's latitude, accurate to well under a metre at city
+scale). A radius query only scans the cells overlapping the search circle,
+so "is there a datapoint within 10 m?" touches a handful of points whatever
+the dataset size. Points can be added one at a time as they are saved.
+
+StreetCoverage builds on it to track which streets of the location sampling
+table already have a datapoint close to one of their sampled points.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+# Metres per degree of latitude; longitude is scaled by cos(REFERENCE_LATITUDE)
+METRES_PER_DEGREE = 111_320.0
+REFERENCE_LATITUDE = 42.33
+
+# Two datapoints closer than this are near-duplicates (same stretch of sidewalk)
+DUPLICATE_RADIUS = 10.0
+# A street is covered once a datapoint is this close to one of its sampled points
+COVERAGE_RADIUS = 25.0
+
+
+class SpatialIndex:
+
+    def __init__(self, cell_size=DUPLICATE_RADIUS * 2, reference_latitude=REFERENCE_LATITUDE):
+        self.cell_size = cell_size
+        self._lat_scale = METRES_PER_DEGREE
+        self._lon_scale = METRES_PER_DEGREE * math.cos(math.radians(reference_latitude))
+        self._lock = threading.Lock()
+        self._cells = {}  # (row, col) -> list of (y, x, key)
+        self._count = 0
+
+    def _project(self, lat, lon):
+        return float(lat) * self._lat_scale, float(lon) * self._lon_scale
+
+    def _cell(self, y, x):
+        return int(math.floor(y / self.cell_size)), int(math.floor(x / self.cell_size))
+
+    def add(self, lat, lon, key=None):
+        y, x = self._project(lat, lon)
+        with self._lock:
+            self._cells.setdefault(self._cell(y, x), []).append((y, x, key))
+            self._count += 1
+
+    def add_many(self, lats, lons, keys=None):
+        """
+        Bulk insert (vectorised projection and cell assignment)
+        """
+        ys = np.asarray(lats, dtype=np.float64) * self._lat_scale
+        xs = np.asarray(lons, dtype=np.float64) * self._lon_scale
+        rows = np.floor(ys / self.cell_size).astype(np.int64)
+        cols = np.floor(xs / self.cell_size).astype(np.int64)
+        if keys is None:
+            keys = [None] * len(ys)
+        with self._lock:
+            for y, x, row, col, key in zip(ys.tolist(), xs.tolist(), rows.tolist(), cols.tolist(), keys):
+                self._cells.setdefault((row, col), []).append((y, x, key))
+            self._count += len(ys)
+
+    def _candidates(self, y, x, radius):
+        row, col = self._cell(y, x)
+        reach = int(math.ceil(radius / self.cell_size))
+        for d_row in range(-reach, reach + 1):
+            for d_col in range(-reach, reach + 1):
+                yield from self._cells.get((row + d_row, col + d_col), ())
+
+    def nearby(self, lat, lon, radius):
+        """
+        Output: list of (key, distance in metres) of the points within `radius` metres, closest first
+        """
+        y, x = self._project(lat, lon)
+        radius_sq = radius * radius
+        found = []
+        with self._lock:
+            for point_y, point_x, key in self._candidates(y, x, radius):
+                distance_sq = (point_y - y) ** 2 + (point_x - x) ** 2
+                if distance_sq <= radius_sq:
+                    found.append((key, math.sqrt(distance_sq)))
+        return sorted(found, key=lambda item: item[1])
+
+    def any_within(self, lat, lon, radius):
+        """
+        True if at least one point is within `radius` metres (stops at the first match)
+        """
+        y, x = self._project(lat, lon)
+        radius_sq = radius * radius
+        with self._lock:
+            for point_y, point_x, _ in self._candidates(y, x, radius):
+                if (point_y - y) ** 2 + (point_x - x) ** 2 <= radius_sq:
+                    return True
+        return False
+
+    def __len__(self):
+        with self._lock:
+            return self._count
+
+
+class StreetCoverage:
+    """
+    Which streets (street_id of the location sampling table) have no datapoint yet.
+
+    The sampled points are indexed once; each stored datapoint marks the streets of
+    the sampled points within `radius` metres of it as covered.
+    """
+
+    def __init__(self, points_df, radius=COVERAGE_RADIUS):
+        self.radius = radius
+        self.candidates = SpatialIndex(cell_size=radius)
+        self.candidates.add_many(points_df['latitude'].to_numpy(), points_df['longitude'].to_numpy(),
+                                 points_df['street_id'].tolist())
+        self._lock = threading.Lock()
+        self.streets = set(points_df['street_id'].unique().tolist())
+        self.counts = {}  # street_id -> datapoints near it
+        self.uncovered = set(self.streets)
+
+    def add_datapoint(self, lat, lon):
+        streets = {street_id for street_id, _ in self.candidates.nearby(lat, lon, self.radius)}
+        with self._lock:
+            for street_id in streets:
+                self.counts[street_id] = self.counts.get(street_id, 0) + 1
+                self.uncovered.discard(street_id)
+
+    def is_covered(self, street_id):
+        with self._lock:
+            return street_id not in self.uncovered
+
+    def uncovered_streets(self):
+        with self._lock:
+            return set(self.uncovered)
+
+    def coverage_ratio(self):
+        with self._lock:
+            return 1 - len(self.uncovered) / len(self.streets) if self.streets else 1.0
@@ -0,0 +1,369 @@
+"""
+Storage layer: shared S3 client and pluggable storage backends.
+
+Every module used to build a new boto3 client (credentials lookup, endpoint
+resolution, fresh connection pool and TLS handshakes) on each call. The
+client returned here is built once per process and shared: boto3 clients are
+thread-safe, and its connection pool is sized for the app's worker threads.
+
+On top of it, all dataset code goes through a small key/value interface, so
+the app and the batch jobs can run against S3 or against a local directory:
+
+    get(key) / get_view(key)         whole object (get_view: zero-copy where possible)
+    get_with_etag(key, if_none_match)
+    get_range(key, start, end)       bytes [start, end)
+    put(key, data)
+    put_if_absent(key, data)         conditional put, False if the key exists
+    delete(keys)
+    list_keys(prefix, start_after)   sorted keys under a prefix
+    list_prefixes(prefix)            immediate 'sub-folder' names under a prefix
+
+Missing keys raise NotFound; a matching If-None-Match raises NotModified.
+The backend is chosen with DETROIT_STORAGE ('s3', 's3://bucket' or 'local:/path').
+"""
+
+import io
+import mmap
+import os
+import threading
+
+import boto3
+import streamlit as st
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import metrics
+
+S3_MAX_POOL_CONNECTIONS = 50
+S3_CONNECT_TIMEOUT = 3
+S3_READ_TIMEOUT = 20
+S3_MAX_ATTEMPTS = 5
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _secret(name):
+    try:
+        return st.secrets.get(name)
+    except FileNotFoundError:
+        # No secrets.toml (e.g. local S3 stand-in): use the default boto3 credential chain
+        return None
+
+
+def s3_client_config(max_pool_connections=S3_MAX_POOL_CONNECTIONS):
+    return Config(max_pool_connections=max_pool_connections,
+                  connect_timeout=S3_CONNECT_TIMEOUT,
+                  read_timeout=S3_READ_TIMEOUT,
+                  retries={'mode': 'adaptive', 'max_attempts': S3_MAX_ATTEMPTS},
+                  tcp_keepalive=True)
+
+
+def create_s3_client(endpoint_url=None, max_pool_connections=S3_MAX_POOL_CONNECTIONS):
+    """
+    Build a new client. `endpoint_url` (or S3_ENDPOINT_URL / secrets 's3_endpoint_url')
+    points it to a local S3 stand-in.
+    """
+    endpoint_url = endpoint_url or os.environ.get("S3_ENDPOINT_URL") or _secret("s3_endpoint_url")
+    session = boto3.session.Session(aws_access_key_id=_secret("aws_access_key_id"),
+                                    aws_secret_access_key=_secret("aws_secret_access_key"))
+    return session.client('s3', endpoint_url=endpoint_url,
+                          config=s3_client_config(max_pool_connections))
+
+
+def get_s3_client():
+    """
+    Process-wide shared client
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_s3_client()
+    return _client
+
+
+def set_s3_client(client):
+    """
+    Replace the shared client (e.g. with one pointing to a local stand-in)
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def _record(backend, op, read=0, written=0):
+    """
+    Request / byte counters per backend and operation (see metrics.py)
+    """
+    metrics.incr('storage_requests', backend=backend, op=op)
+    if read:
+        metrics.incr('storage_bytes', read, backend=backend, direction='read')
+    if written:
+        metrics.incr('storage_bytes', written, backend=backend, direction='write')
+
+
+class NotFound(KeyError):
+    pass
+
+
+class NotModified(Exception):
+    pass
+
+
+class S3Storage:
+
+    # Objects above this size are uploaded with multipart, concurrent transfers
+    MULTIPART_THRESHOLD = 8 * 1024 ** 2
+
+    def __init__(self, bucket_name, client=None):
+        self.bucket_name = bucket_name
+        self._client = client
+        self.name = f"s3://{bucket_name}"
+
+    @property
+    def client(self):
+        return self._client or get_s3_client()
+
+    def _is_missing(self, error):
+        return error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404', 'NotFound')
+
+    def get_with_etag(self, key, if_none_match=None):
+        kwargs = {'Bucket': self.bucket_name, 'Key': key}
+        if if_none_match:
+            kwargs['IfNoneMatch'] = if_none_match
+        _record('s3', 'get')
+        try:
+            obj = self.client.get_object(**kwargs)
+        except ClientError as e:
+            status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            if if_none_match and (status == 304 or e.response.get('Error', {}).get('Code') in ('304', 'NotModified')):
+                raise NotModified(key)
+            if self._is_missing(e):
+                raise NotFound(key)
+            raise
+        body = obj['Body'].read()
+        metrics.incr('storage_bytes', len(body), backend='s3', direction='read')
+        return body, obj.get('ETag')
+
+    def get(self, key):
+        return self.get_with_etag(key)[0]
+
+    def get_view(self, key):
+        return self.get(key)
+
+    def get_range(self, key, start, end):
+        _record('s3', 'get_range')
+        try:
+            obj = self.client.get_object(Bucket=self.bucket_name, Key=key, Range=f"bytes={start}-{end - 1}")
+        except ClientError as e:
+            if self._is_missing(e):
+                raise NotFound(key)
+            raise
+        body = obj['Body'].read()
+        metrics.incr('storage_bytes', len(body), backend='s3', direction='read')
+        return body
+
+    def put(self, key, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        _record('s3', 'put', written=len(data))
+        if len(data) > self.MULTIPART_THRESHOLD:
+            config = TransferConfig(multipart_threshold=self.MULTIPART_THRESHOLD, max_concurrency=4)
+            self.client.upload_fileobj(io.BytesIO(data), self.bucket_name, key, Config=config)
+        else:
+            self.client.put_object(Bucket=self.bucket_name, Key=key, Body=data)
+
+    def put_if_absent(self, key, data):
+        # The pinned boto3 has no If-None-Match on PUT: check-then-put, not atomic across writers
+        _record('s3', 'head')
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=key)
+            return False
+        except ClientError as e:
+            if not self._is_missing(e):
+                raise
+        self.put(key, data)
+        return True
+
+    def delete(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            _record('s3', 'delete')
+            self.client.delete_objects(Bucket=self.bucket_name,
+                                       Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True})
+
+    def list_keys(self, prefix, start_after=None):
+        kwargs = {'Bucket': self.bucket_name, 'Prefix': prefix}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        keys = []
+        for response in self.client.get_paginator('list_objects_v2').paginate(**kwargs):
+            _record('s3', 'list')
+            for obj in response.get('Contents', []):
+                keys.append(obj['Key'])
+        return sorted(keys)
+
+    def list_prefixes(self, prefix):
+        names = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for response in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter='/'):
+            _record('s3', 'list')
+            for common_prefix in response.get('CommonPrefixes') or []:
+                names.append(common_prefix['Prefix'][len(prefix):].strip('/'))
+        return names
+
+
+class LocalStorage:
+    """
+    Keys are files under `root`. Reads of whole objects and ranges are memory-mapped,
+    so `get_view` / `get_range` slices do not copy the blob into Python memory.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.name = f"file://{self.root}"
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Key outside of storage root: {key}")
+        return path
+
+    def _mmap(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return memoryview(b'')
+                return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (FileNotFoundError, IsADirectoryError):
+            raise NotFound(key)
+
+    def _etag(self, path):
+        stat = os.stat(path)
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def get_with_etag(self, key, if_none_match=None):
+        path = self._path(key)
+        try:
+            etag = self._etag(path)
+        except FileNotFoundError:
+            raise NotFound(key)
+        if if_none_match and if_none_match == etag:
+            _record('local', 'get')
+            raise NotModified(key)
+        return self.get(key), etag
+
+    def get(self, key):
+        data = bytes(self._mmap(key))
+        _record('local', 'get', read=len(data))
+        return data
+
+    def get_view(self, key):
+        view = self._mmap(key)
+        _record('local', 'get', read=len(view))
+        return view
+
+    def get_range(self, key, start, end):
+        data = bytes(self._mmap(key)[start:end])
+        _record('local', 'get_range', read=len(data))
+        return data
+
+    def put(self, key, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        _record('local', 'put', written=len(data))
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put_if_absent(self, key, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        _record('local', 'put_if_absent', written=len(data))
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            # link() fails if the target exists: atomic create-if-absent
+            os.link(tmp_path, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def delete(self, keys):
+        _record('local', 'delete')
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def list_keys(self, prefix, start_after=None):
+        _record('local', 'list')
+        base = os.path.dirname(self._path(prefix + 'x'))
+        keys = []
+        for root, _, files in os.walk(base):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                key = os.path.relpath(os.path.join(root, name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix) and (start_after is None or key > start_after):
+                    keys.append(key)
+        return sorted(keys)
+
+    def list_prefixes(self, prefix):
+        _record('local', 'list')
+        base = self._path(prefix) if prefix else self.root
+        try:
+            return sorted(name for name in os.listdir(base) if os.path.isdir(os.path.join(base, name)))
+        except FileNotFoundError:
+            return []
+
+
+BUCKET_NAME = os.environ.get("DETROIT_BUCKET", 'detroit-project-data-bucket')
+
+_storage = None
+
+
+def create_storage(spec=None):
+    """
+    Input: 's3' (default), 's3://bucket' or 'local:/path/to/dir'
+           (defaults to the DETROIT_STORAGE environment variable)
+    """
+    spec = spec or os.environ.get("DETROIT_STORAGE") or 's3'
+    if spec.startswith('local:'):
+        return LocalStorage(spec[len('local:'):])
+    if spec.startswith('s3://'):
+        return S3Storage(spec[len('s3://'):].strip('/'))
+    if spec == 's3':
+        return S3Storage(BUCKET_NAME)
+    raise ValueError(f"Unknown storage: {spec}")
+
+
+def get_storage():
+    """
+    Process-wide storage backend used by every dataset function
+    """
+    global _storage
+    if _storage is None:
+        with _client_lock:
+            if _storage is None:
+                _storage = create_storage()
+    return _storage
+
+
+def set_storage(storage):
+    global _storage
+    with _client_lock:
+        _storage = storage
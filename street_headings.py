@@ -0,0 +1,247 @@
+"""
+Precomputed per-point street orientation and Street View headings.
+
+For every point of the location sampling dataset, the `street` LINESTRING is
+parsed once and the bearing of the segment nearest to the point is taken as
+the local street direction (instead of the direction towards an arbitrary
+other point of the same street, which is wrong on curved streets).
+The bearing is binned to the same 8 API angles as `calculate_orientation`,
+and the 5 headings for each side of the street are derived once and stored
+in arrays, so `generate_images` gets them with an O(1) lookup by point_id.
+
+One-off preprocessing:
+
+    python street_headings.py downtown_to_be_extracted.csv headings.npz
+"""
+
+import math
+import sys
+
+import numpy as np
+import pandas as pd
+
+CARDINAL_DIRECTIONS = np.array(['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW'])
+ANGLE_GOOGLE_API = np.array([0, 45, 90, 135, 180, 225, 270, 315])
+# Street View Static API price (see get_street_view_images)
+COST_PER_1000_REQUESTS = 7
+# Offsets of the 5 headings around the straight (perpendicular to the street) one
+FAN_OFFSETS = (-60, -30, 0, 30, 60)
+# Straight heading of each side relative to the street baseline
+SIDE_OFFSETS = np.array([90, -90])
+
+
+def parse_linestring(wkt):
+    """
+    Input: 'LINESTRING (lon lat, lon lat, ...)'
+    Output: array (n, 2) of (lon, lat), or None if unparseable
+    """
+    if not isinstance(wkt, str) or '(' not in wkt:
+        return None
+    try:
+        body = wkt[wkt.index('(') + 1:wkt.rindex(')')]
+        coords = np.array([[float(v) for v in pair.split()] for pair in body.split(',')])
+    except ValueError:
+        return None
+    if coords.ndim != 2 or coords.shape[0] < 2 or coords.shape[1] != 2:
+        return None
+    return coords
+
+
+def nearest_segment_bearing(lat, lon, coords):
+    """
+    Bearing (degrees from North, clockwise, in [0, 360)) of the segment of `coords` nearest to the point.
+    Longitudes are scaled by cos(lat) so distances and angles are locally metric.
+    """
+    scale = math.cos(math.radians(lat))
+    xs = coords[:, 0] * scale
+    ys = coords[:, 1]
+    px, py = lon * scale, lat
+
+    x0, y0, x1, y1 = xs[:-1], ys[:-1], xs[1:], ys[1:]
+    dx, dy = x1 - x0, y1 - y0
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.clip(((px - x0) * dx + (py - y0) * dy) / length2, 0, 1)
+    t = np.where(length2 > 0, t, 0)
+    dist2 = (x0 + t * dx - px) ** 2 + (y0 + t * dy - py) ** 2
+    dist2 = np.where(length2 > 0, dist2, np.inf)
+    segment = int(np.argmin(dist2))
+    return (math.degrees(math.atan2(dx[segment], dy[segment])) + 360) % 360
+
+
+### Vectorised equivalents of the scalar helpers in images_handling
+# They follow the scalar arithmetic operation by operation, so results are identical.
+
+def normalize_angles(angles):
+    return np.mod(angles, 360)
+
+
+def calculate_orientation_batch(coords1, coords2):
+    """
+    Vectorised calculate_orientation
+
+    Input: coords1, coords2 -- arrays (n, 2) of (lat, lon)
+    Output: (bearing in [0, 360), cardinal direction, baseline API angle), each an array (n,)
+    """
+    coords1 = np.asarray(coords1, dtype=float)
+    coords2 = np.asarray(coords2, dtype=float)
+    Δλ = coords2[:, 1] - coords1[:, 1]
+    Δφ = coords2[:, 0] - coords1[:, 0]
+
+    θ = np.arctan2(Δλ, Δφ)
+    θ_deg = θ * (180.0 / math.pi)
+    # θ_deg + 360 is in [180, 540]: one subtraction is exactly % 360 (and much cheaper)
+    shifted = θ_deg + 360
+    normalized_angle = np.where(shifted >= 360, shifted - 360, shifted)
+
+    # Non-negative, so truncation is the same as int() and & 7 the same as % 8
+    index = ((normalized_angle + 22.5) / 45).astype(np.int64) & 7
+    return normalized_angle, CARDINAL_DIRECTIONS[index], ANGLE_GOOGLE_API[index]
+
+
+def heading_fans_batch(baseline):
+    """
+    Vectorised headings of both sides, as generate_images builds them
+
+    Input: baseline API angles in [0, 360), array (n,)
+    Output: array (n, 2, 5): [:, 0] side one (baseline + 90), [:, 1] side two (baseline - 90)
+    """
+    baseline = np.asarray(baseline)
+    if np.issubdtype(baseline.dtype, np.integer):
+        # Whole degrees: same values in int16, a quarter of the memory traffic
+        baseline = baseline.astype(np.int16)
+    dtype = baseline.dtype
+    straight = SIDE_OFFSETS.astype(dtype)
+    offsets = (straight[:, None] + np.asarray(FAN_OFFSETS, dtype=dtype)[None, :]).reshape(-1)
+    # One broadcast, (10, n): offsets on the first axis so every operation runs over long rows
+    fans = offsets[:, None] + baseline[None, :]
+    # Every heading is in (-360, 720), so one wrap each way is exactly % 360
+    fans -= (fans >= 360) * dtype.type(360)
+    fans += (fans < 0) * dtype.type(360)
+    # The straight heading is not normalised (generate_images uses baseline +/- 90 as is)
+    zero = FAN_OFFSETS.index(0)
+    fans[[zero, len(FAN_OFFSETS) + zero]] = baseline[None, :] + straight[:, None]
+    # (n, 2, 5) view of the same memory
+    return fans.T.reshape(len(baseline), len(straight), len(FAN_OFFSETS))
+
+
+def plan_orientations(coords1, coords2):
+    """
+    One vectorised pass over every point: bearings, cardinal bins and heading fans
+
+    Input: coords1 -- points (n, 2) of (lat, lon); coords2 -- a second point on the same street for each
+    Output: dict of arrays 'bearing', 'direction', 'baseline', 'headings' (n, 2, 5)
+    """
+    bearing, direction, baseline = calculate_orientation_batch(coords1, coords2)
+    return {'bearing': bearing, 'direction': direction, 'baseline': baseline,
+            'headings': heading_fans_batch(baseline)}
+
+
+def extraction_cost(coords, headings, cost_per_1000=COST_PER_1000_REQUESTS):
+    """
+    Cost estimate of an extraction run, with duplicate (location, heading) requests removed
+
+    Input: coords -- (n, 2) of (lat, lon); headings -- (n, 2, 5) as returned by heading_fans_batch
+    Output: dict with request counts, estimated $ cost and requests per heading (coverage)
+    """
+    coords = np.asarray(coords, dtype=float)
+    n = len(coords)
+    flat_headings = normalize_angles(np.asarray(headings).reshape(n, -1))
+    per_point = flat_headings.shape[1]
+    requests = np.column_stack([np.repeat(coords, per_point, axis=0), flat_headings.reshape(-1)])
+    unique_requests = np.unique(requests, axis=0)
+    coverage_headings, coverage_counts = np.unique(unique_requests[:, 2], return_counts=True)
+    return {
+        'points': n,
+        'requests': len(requests),
+        'unique_requests': len(unique_requests),
+        'estimated_cost': len(unique_requests) * cost_per_1000 / 1000,
+        'heading_coverage': dict(zip(coverage_headings.tolist(), coverage_counts.tolist()))
+    }
+
+
+class HeadingTable:
+    """
+    Array-backed table indexed by point_id:
+    bearing (exact local street bearing), baseline (binned API angle) and the
+    5 headings of each side (side one: baseline + 90, side two: baseline - 90).
+    """
+
+    def __init__(self, point_ids, bearing, baseline, headings):
+        self.point_ids = np.asarray(point_ids, dtype=np.int64)
+        self.bearing = np.asarray(bearing, dtype=np.float32)
+        self.baseline = np.asarray(baseline, dtype=np.int16)
+        self.headings = np.asarray(headings, dtype=np.int16)  # (n, 2, 5), always whole degrees
+        self._row = {int(point_id): row for row, point_id in enumerate(self.point_ids)}
+
+    def __len__(self):
+        return len(self.point_ids)
+
+    def __contains__(self, point_id):
+        return int(point_id) in self._row
+
+    def lookup(self, point_id):
+        """
+        Output: (baseline angle, headings of side one, headings of side two)
+        """
+        row = self._row[int(point_id)]
+        headings = self.headings[row]
+        return int(self.baseline[row]), headings[0].tolist(), headings[1].tolist()
+
+    def save(self, path):
+        np.savez_compressed(path, point_ids=self.point_ids, bearing=self.bearing,
+                            baseline=self.baseline, headings=self.headings)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['point_ids'], data['bearing'], data['baseline'], data['headings'])
+
+
+def _fallback_bearing(points_df, row):
+    """
+    Original method: direction towards another point of the same street
+    """
+    others = points_df[(points_df["street_id"] == points_df.iloc[row]["street_id"])
+                       & (points_df["point_id"] != points_df.iloc[row]["point_id"])]
+    if len(others) == 0:
+        return 0.0
+    Δλ = others.iloc[0]["longitude"] - points_df.iloc[row]["longitude"]
+    Δφ = others.iloc[0]["latitude"] - points_df.iloc[row]["latitude"]
+    return (math.degrees(math.atan2(Δλ, Δφ)) + 360) % 360
+
+
+def build_heading_table(points_df):
+    """
+    Input: location sampling DataFrame (point_id, street_id, street, latitude, longitude)
+    Output: HeadingTable
+    """
+    n = len(points_df)
+    bearing = np.zeros(n)
+    parsed_streets = {}
+
+    streets = points_df['street'].tolist()
+    lats = points_df['latitude'].to_numpy(dtype=float)
+    lons = points_df['longitude'].to_numpy(dtype=float)
+    for row in range(n):
+        wkt = streets[row]
+        if wkt not in parsed_streets:
+            parsed_streets[wkt] = parse_linestring(wkt)
+        coords = parsed_streets[wkt]
+        if coords is not None:
+            bearing[row] = nearest_segment_bearing(lats[row], lons[row], coords)
+        else:
+            bearing[row] = _fallback_bearing(points_df, row)
+
+    baseline = ANGLE_GOOGLE_API[((bearing + 22.5) / 45).astype(np.int64) % 8]
+    headings = heading_fans_batch(baseline)
+    return HeadingTable(points_df['point_id'].to_numpy(), bearing, baseline, headings)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python street_headings.py <points.csv> <output.npz>")
+        sys.exit(1)
+    table = build_heading_table(pd.read_csv(sys.argv[1]))
+    table.save(sys.argv[2])
+    print(f"Saved headings for {len(table)} points to {sys.argv[2]}")
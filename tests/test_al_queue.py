@@ -0,0 +1,65 @@
+import pandas as pd
+
+from al_queue import UncertaintyQueue
+
+
+def table(rows):
+    return pd.DataFrame(rows, columns=['folder_id', 'label', 'certainty'])
+
+
+def make_queue():
+    queue = UncertaintyQueue()
+    queue.sync(table([('a', 5, 0.9), ('b', 5, 0.6), ('c', 5, 0.7), ('d', 1, 0.5)]))
+    return queue
+
+
+def test_lease_hands_out_the_most_uncertain_folders_once():
+    queue = make_queue()
+    assert queue.lease('s1', k=2) == ['b', 'c']
+    assert queue.lease('s2', k=2) == ['a']
+    assert queue.lease('s3') == []
+    assert queue.leased() == 3
+
+
+def test_release_puts_the_folder_back():
+    queue = make_queue()
+    assert queue.lease('s1') == ['b']
+    queue.release('b')
+    assert queue.lease('s2') == ['b']
+
+
+def test_expired_leases_are_reclaimed():
+    queue = make_queue()
+    assert queue.lease('s1', ttl=-1) == ['b']
+    # The next lease reclaims the expired one first
+    assert queue.lease('s2') == ['b']
+    assert queue.leased() == 1
+
+
+def test_completed_folders_never_come_back():
+    queue = make_queue()
+    assert queue.lease('s1') == ['b']
+    queue.complete('b')
+    queue.release('b')
+    queue.update_certainty('b', 0.5)
+    queue.sync(table([('a', 5, 0.9), ('b', 5, 0.6), ('c', 5, 0.7)]))
+    assert queue.lease('s2', k=3) == ['c', 'a']
+
+
+def test_sync_keeps_live_leases():
+    queue = make_queue()
+    assert queue.lease('s1') == ['b']
+    queue.sync(table([('a', 5, 0.9), ('b', 5, 0.6), ('c', 5, 0.7)]))
+    assert queue.lease('s2', k=3) == ['c', 'a']
+
+
+def test_folders_that_left_the_table_are_not_requeued():
+    queue = make_queue()
+    assert queue.lease('s1', k=2) == ['b', 'c']
+    assert queue.lease('s2', ttl=-1) == ['a']
+    queue.sync(table([('x', 5, 0.1)]))
+
+    # Neither a release nor a reclaim of a folder that left the table raises
+    queue.release('b')
+    assert queue.lease('s3', k=3) == ['x']
+    assert len(queue) == 0
@@ -0,0 +1,106 @@
+import io
+import threading
+
+import boto3
+import pandas as pd
+import pytest
+from moto import mock_aws
+
+import dataset
+import storage
+from al_store import ActiveLearningStore
+from storage import S3Storage
+
+BUCKET = 'detroit-test-bucket'
+WRITERS = 20
+LABELS_PER_WRITER = 10
+
+
+@pytest.fixture
+def s3_store(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        store = S3Storage(BUCKET, client=client)
+        folders = [f"{i}_90_{42.3 + i * 1e-4}_{-83.1 - i * 1e-4}" for i in range(WRITERS * LABELS_PER_WRITER)]
+        buffer = io.StringIO()
+        pd.DataFrame({'folder_id': folders, 'label': 5, 'certainty': 0.5}).to_csv(buffer, index=False)
+        store.put(dataset.AL_TRACKING_PATH, buffer.getvalue())
+        previous = storage.get_storage() if storage._storage is not None else None
+        storage.set_storage(store)
+        try:
+            yield store, folders
+        finally:
+            storage.set_storage(previous)
+
+
+def new_store(store):
+    return ActiveLearningStore(store, dataset.AL_EVENTS_PREFIX, dataset.AL_TRACKING_PATH, parse_base=dataset._parse_csv)
+
+
+def labels_of(frame):
+    return frame.set_index('folder_id')['label'].to_dict()
+
+
+def test_parallel_writers_and_materialiser_lose_no_update(s3_store):
+    store, folders = s3_store
+    reader = new_store(store)
+    expected = {folder_id: i % 5 for i, folder_id in enumerate(folders)}
+    start = threading.Barrier(WRITERS + 1)
+    done = threading.Event()
+
+    def writer(w):
+        # One store per writer, as in separate app processes
+        al_store = new_store(store)
+        start.wait()
+        for folder_id in folders[w::WRITERS]:
+            al_store.update(folder_id, label=expected[folder_id], shard=f"writer-{w}")
+
+    def materialiser():
+        start.wait()
+        while not done.is_set():
+            dataset.materialise_al_tracking()
+            reader.refresh()
+
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(WRITERS)]
+    background = threading.Thread(target=materialiser)
+    for thread in threads + [background]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    background.join()
+
+    # A long-running store that refreshed while events were folded and deleted
+    reader.refresh()
+    assert labels_of(reader.frame()) == expected
+    assert labels_of(new_store(store).frame()) == expected
+
+    dataset.materialise_al_tracking()
+    assert labels_of(dataset._parse_csv(store.get(dataset.AL_TRACKING_PATH))) == expected
+    assert store.list_keys(f"{dataset.AL_EVENTS_PREFIX}events/") == []
+
+
+def test_refresh_reloads_a_rewritten_base(s3_store):
+    store, folders = s3_store
+    reader = new_store(store)
+    new_store(store).update_many([{'folder_id': folder_id, 'label': 1, 'certainty': None} for folder_id in folders])
+
+    # Folds and deletes events the reader has not read yet
+    dataset.materialise_al_tracking()
+    reader.refresh()
+
+    assert set(labels_of(reader.frame()).values()) == {1}
+
+
+def test_last_writer_wins_whatever_the_read_order(s3_store):
+    store, folders = s3_store
+    al_store = new_store(store)
+    al_store.update(folders[0], label=1)
+    al_store.update(folders[0], label=3)
+    al_store.update(folders[0], certainty=0.9)
+
+    frame = new_store(store).frame().set_index('folder_id')
+    assert frame.loc[folders[0], 'label'] == 3
+    assert frame.loc[folders[0], 'certainty'] == 0.9
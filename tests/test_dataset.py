@@ -0,0 +1,78 @@
+import threading
+
+import pandas as pd
+import pytest
+
+import dataset
+import packed_format
+import storage
+from load_test import make_jpeg, seed_storage
+from metadata_schema import build_metadata
+from storage import LocalStorage
+
+FOLDERS = 20
+
+
+@pytest.fixture
+def seeded(tmp_path, monkeypatch):
+    store = LocalStorage(str(tmp_path))
+    points = pd.DataFrame({'point_id': range(FOLDERS), 'street_id': range(FOLDERS),
+                           'latitude': [42.33 + i * 1e-3 for i in range(FOLDERS)], 'longitude': -83.05})
+    seed_storage(store, points, FOLDERS, make_jpeg(size=(64, 48)))
+    monkeypatch.setenv('DETROIT_SCORING', 'off')
+    monkeypatch.setattr(storage, '_storage', store)
+    for name in ('_dataset_index', '_frame_cache', '_al_store', '_synced_queue', '_scorer', '_manifest_seed'):
+        monkeypatch.setattr(dataset, name, None)
+    return store
+
+
+def test_singletons_are_shared_outside_streamlit(seeded):
+    assert dataset.get_al_store() is dataset.get_al_store()
+    assert dataset.get_frame_cache() is dataset.get_frame_cache()
+    assert dataset.get_al_queue() is dataset.get_al_queue()
+
+
+def test_concurrent_sessions_lease_distinct_folders(seeded):
+    leased = {}
+    barrier = threading.Barrier(FOLDERS // 2)
+
+    def session(i):
+        barrier.wait()
+        _, metadata = dataset.extract_images(session_id=f"session-{i}", k=2, role='thumb')
+        leased[i] = [dataset._folder_name(m) for m in metadata]
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(FOLDERS // 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    folder_ids = [folder_id for folders in leased.values() for folder_id in folders]
+    assert len(folder_ids) == FOLDERS
+    assert len(set(folder_ids)) == FOLDERS
+
+
+def test_single_label_save_goes_to_the_user_shard(seeded):
+    _, metadata = dataset.extract_images(session_id='alice-session', role='thumb')
+
+    dataset.save_label_activelearning(1, metadata[0], 'alice')
+
+    keys = seeded.list_keys(f"{dataset.AL_EVENTS_PREFIX}events/")
+    assert len(keys) == 1 and '_alice_' in keys[0]
+
+
+def test_manifest_before_the_first_compaction_covers_the_whole_dataset(seeded, monkeypatch):
+    image = make_jpeg(size=(64, 48))
+    for i in range(3):
+        datapoint_id = f"{i}_90_42.3{i}_-83.05"
+        metadata = build_metadata(datapoint_id, [30, 60, 90, 120, 150], 'N/A', label=1, labeller='alice')
+        seeded.put(f"{dataset.DATASET_PREFIX}{datapoint_id}/{packed_format.PACK_NAME}",
+                   packed_format.pack_datapoint(metadata, [image] * 5, content_types=['image/jpeg'] * 5))
+
+    # Saved after the manifest was deployed: only this one is in the appends
+    dataset.save_label([image] * 5, 2, {'p': 9, 'angle': 90, 'latitude': 42.39, 'longitude': -83.05,
+                                        'headings': [30, 60, 90, 120, 150], 'address': 'N/A'}, 'bob')
+
+    manifest = dataset.read_manifest()
+    assert len(manifest) == 4
+    assert sorted(manifest['labeller']) == ['alice', 'alice', 'alice', 'bob']
@@ -0,0 +1,81 @@
+import io
+
+import pandas as pd
+
+import event_log
+import metrics
+from frame_cache import FrameCache
+from storage import LocalStorage
+
+PREFIX = 'Log/'
+SNAPSHOT = 'Log/snapshot.parquet'
+COLUMNS = ['datapoint_id', 'label']
+
+
+def append(store, datapoint_id, label):
+    event_log.append_events(store, PREFIX, [{'datapoint_id': datapoint_id, 'label': label}])
+
+
+def test_cached_snapshot_is_revalidated_after_compaction(tmp_path):
+    store = LocalStorage(str(tmp_path))
+    cache = FrameCache(ttl=3600)
+    append(store, 'a', 1)
+    event_log.compact(store, PREFIX, SNAPSHOT, COLUMNS)
+    assert len(event_log.read_log(store, PREFIX, SNAPSHOT, COLUMNS, cache=cache)) == 1
+
+    # Folded into a new snapshot and deleted while the old snapshot is cached (within the TTL)
+    append(store, 'b', 2)
+    event_log.compact(store, PREFIX, SNAPSHOT, COLUMNS)
+
+    log = event_log.read_log(store, PREFIX, SNAPSHOT, COLUMNS, cache=cache)
+    assert sorted(log['datapoint_id']) == ['a', 'b']
+
+
+class CompactingStore(LocalStorage):
+    """
+    Runs a compaction right after the first listing of the events
+    """
+    compacted = False
+
+    def list_keys(self, prefix, start_after=None):
+        keys = super().list_keys(prefix, start_after)
+        if not self.compacted and prefix == f"{PREFIX}events/":
+            self.compacted = True
+            event_log.compact(self, PREFIX, SNAPSHOT, COLUMNS)
+        return keys
+
+
+def test_events_deleted_during_a_read_are_read_from_the_new_snapshot(tmp_path):
+    store = CompactingStore(str(tmp_path))
+    append(store, 'a', 1)
+    append(store, 'b', 2)
+
+    log = event_log.read_log(store, PREFIX, SNAPSHOT, COLUMNS, cache=FrameCache(ttl=3600))
+    assert sorted(log['datapoint_id']) == ['a', 'b']
+
+
+def test_seed_is_used_until_the_first_compaction(tmp_path):
+    store = LocalStorage(str(tmp_path))
+    append(store, 'b', 2)
+    log = event_log.read_log(store, PREFIX, SNAPSHOT, COLUMNS,
+                             seed=lambda: pd.DataFrame({'datapoint_id': ['a'], 'label': [1]}))
+    assert sorted(log['datapoint_id']) == ['a', 'b']
+
+
+def test_frame_cache_counts_go_to_the_metrics_registry(tmp_path):
+    store = LocalStorage(str(tmp_path))
+    store.put('table.csv', 'x\n1\n')
+    cache = FrameCache(ttl=3600)
+    metrics.REGISTRY.reset()
+
+    parse = lambda body: pd.read_csv(io.BytesIO(body))
+    cache.get(store, 'table.csv', parse)
+    cache.get(store, 'table.csv', parse)
+    cache.get(store, 'table.csv', parse, revalidate=True)
+
+    counters = metrics.snapshot()['counters']
+    assert counters['frame_cache_requests{result="miss"}'] == 1
+    assert counters['frame_cache_requests{result="hit"}'] == 1
+    assert counters['frame_cache_requests{result="revalidated"}'] == 1
+    assert cache.stats()['hits'] == 1
+
@@ -0,0 +1,41 @@
+import io
+
+from PIL import Image
+
+from image_cache import ImageCache, is_complete_image
+from load_test import make_jpeg
+
+
+def make_png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_markers():
+    jpeg, png = make_jpeg(size=(32, 24)), make_png()
+    assert is_complete_image(jpeg) and is_complete_image(png)
+    assert not is_complete_image(jpeg[:-10])
+    assert not is_complete_image(png[:-10])
+    assert not is_complete_image(b'not an image')
+
+
+def test_incomplete_bodies_are_not_stored(tmp_path):
+    cache = ImageCache(str(tmp_path))
+    assert not cache.put('k', make_jpeg(size=(32, 24))[:100])
+    assert cache.get('k') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_corrupt_entry_is_dropped(tmp_path):
+    cache = ImageCache(str(tmp_path))
+    data = make_jpeg(size=(32, 24))
+    assert cache.put('k', data)
+    assert cache.get('k') == data
+
+    with open(cache._path('k'), 'r+b') as f:
+        f.truncate(len(data) // 2)
+
+    assert cache.get('k') is None
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['size_bytes'] == 0
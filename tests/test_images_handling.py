@@ -0,0 +1,84 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import images_handling
+from image_cache import ImageCache, street_view_cache_key
+from load_test import FakeStreetView, make_jpeg
+
+LATENCY = 0.3
+HEADINGS = [0, 30, 60, 90, 120, 180, 210, 240, 270, 300]
+LOCATION = (42.33, -83.05)
+
+
+@pytest.fixture
+def street_view(monkeypatch, tmp_path):
+    fake = FakeStreetView(make_jpeg(), latency=LATENCY, jitter=0)
+    monkeypatch.setattr(images_handling, 'STREET_VIEW_URL', fake.start())
+    monkeypatch.setattr(images_handling, '_image_cache', ImageCache(str(tmp_path)))
+    yield fake
+    fake.stop()
+
+
+def test_headings_are_fetched_concurrently(street_view):
+    started = time.perf_counter()
+    results = images_handling.fetch_street_view_images('test', LOCATION, '640x480', HEADINGS)
+    elapsed = time.perf_counter() - started
+
+    assert [result['heading'] for result in results] == HEADINGS
+    assert all(result['error'] is None and result['image'] is not None for result in results)
+    assert street_view.requests == len(HEADINGS)
+    # About the slowest request, not the sum of the 10 latencies
+    assert LATENCY <= elapsed < LATENCY * len(HEADINGS) / 3
+
+
+def test_cached_headings_make_no_request(street_view):
+    images_handling.fetch_street_view_images('test', LOCATION, '640x480', HEADINGS)
+    results = images_handling.fetch_street_view_images('test', LOCATION, '640x480', HEADINGS)
+
+    assert all(result['cached'] for result in results)
+    assert street_view.requests == len(HEADINGS)
+
+
+def test_corrupt_cache_entry_is_fetched_again(street_view):
+    cache = images_handling.get_image_cache()
+    key = street_view_cache_key(LOCATION, '640x480', 90, 0, 90)
+    # Truncated on disk after it was stored
+    assert cache.put(key, make_jpeg())
+    with open(cache._path(key), 'r+b') as f:
+        f.truncate(1000)
+
+    result = images_handling._fetch_heading('test', LOCATION, '640x480', 90, 0, 90)
+
+    assert result['error'] is None and not result['cached']
+    assert result['image'] is not None
+    assert street_view.requests == 1
+    assert cache.get(street_view_cache_key(LOCATION, '640x480', 90, 0, 90)) == result['content']
+
+
+def test_failed_headings_are_reported(monkeypatch, tmp_path):
+    fake = FakeStreetView(make_jpeg(), latency=0, error_rate=1.0)
+    monkeypatch.setattr(images_handling, 'STREET_VIEW_URL', fake.start())
+    monkeypatch.setattr(images_handling, '_image_cache', ImageCache(str(tmp_path)))
+    try:
+        failures = []
+        images = images_handling.get_street_view_images('test', LOCATION, '640x480', [0, 90], failures=failures)
+    finally:
+        fake.stop()
+
+    assert images == []
+    assert [(failure['heading'], failure['status']) for failure in failures] == [(0, 500), (90, 500)]
+
+
+def test_batch_jobs_use_their_own_pool_and_cache(street_view, tmp_path_factory):
+    cache = ImageCache(str(tmp_path_factory.mktemp('extract-cache')))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = images_handling.fetch_street_view_images(
+            'test', LOCATION, '640x480', HEADINGS, executor=executor,
+            session=images_handling.create_http_session(pool_size=4), cache=cache)
+
+    assert all(result['error'] is None for result in results)
+    assert cache.stats()['entries'] == len(HEADINGS)
+    # The app's cache is left alone
+    assert images_handling.get_image_cache().stats()['entries'] == 0
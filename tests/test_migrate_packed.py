@@ -0,0 +1,56 @@
+import pytest
+
+import packed_format
+from benchmarks.stand_ins import legacy_metadata, street_photo
+from migrate_packed import migrate_folder
+from storage import LocalStorage
+
+FOLDER = '12_135_42.33_-83.05'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalStorage(str(tmp_path))
+
+
+def seed(store, prefix, with_metadata):
+    for i in range(5):
+        store.put(f"{prefix}{FOLDER}/image_{i}.png", street_photo(size=(64, 48), seed=i))
+    if with_metadata:
+        store.put(f"{prefix}{FOLDER}/metadata.txt", legacy_metadata(FOLDER, label=3, username='alice'))
+
+
+def test_migrates_with_metadata_txt_and_renditions(store):
+    seed(store, 'DetroitImageDataset_v2/', with_metadata=True)
+
+    assert migrate_folder(store, 'DetroitImageDataset_v2/', FOLDER, delete_legacy=True) == 'migrated'
+
+    key = f"DetroitImageDataset_v2/{FOLDER}/{packed_format.PACK_NAME}"
+    metadata, images = packed_format.read_datapoint(store, key)
+    assert (metadata['label'], metadata['labeller']) == (3, 'alice')
+    assert len(images) == 5
+    assert len(packed_format.read_role(store, key, 'thumb')[1]) == 5
+    assert len(packed_format.read_role(store, key, 'display')[1]) == 5
+    assert store.list_keys(f"DetroitImageDataset_v2/{FOLDER}/") == [key]
+
+
+def test_folders_without_metadata_use_the_folder_name(store):
+    seed(store, 'GoogleDetroitDatabase/', with_metadata=False)
+
+    assert migrate_folder(store, 'GoogleDetroitDatabase/', FOLDER, delete_legacy=False) == 'migrated'
+
+    metadata, _ = packed_format.read_datapoint(store, f"GoogleDetroitDatabase/{FOLDER}/{packed_format.PACK_NAME}")
+    assert (metadata['point_id'], metadata['angle'], metadata['latitude']) == (12, 135.0, 42.33)
+    assert metadata['headings'] == [75.0, 105.0, 135.0, 165.0, 195.0]
+    assert metadata['label'] is None
+
+
+def test_packs_without_renditions_get_them(store):
+    key = f"GoogleDetroitDatabase/{FOLDER}/{packed_format.PACK_NAME}"
+    images = [street_photo(size=(64, 48), seed=i) for i in range(5)]
+    store.put(key, packed_format.pack_datapoint({'datapoint_id': FOLDER}, images))
+
+    assert migrate_folder(store, 'GoogleDetroitDatabase/', FOLDER, delete_legacy=False) == 'rendered'
+    assert [bytes(image) for image in packed_format.read_datapoint(store, key)[1]] == images
+    assert len(packed_format.read_role(store, key, 'thumb')[1]) == 5
+    assert migrate_folder(store, 'GoogleDetroitDatabase/', FOLDER, delete_legacy=False) == 'skipped'
@@ -0,0 +1,47 @@
+import pandas as pd
+
+from point_sampler import PointSampler
+
+
+def test_draws_every_position_once_then_none():
+    sampler = PointSampler(range(50), exclude={3, 7}, seed=1)
+    drawn = [sampler.sample() for _ in range(48)]
+    assert sorted(drawn) == [p for p in range(50) if p not in (3, 7)]
+    assert sampler.sample() is None
+
+
+def test_restore_and_remove():
+    sampler = PointSampler(range(3), seed=1)
+    position = sampler.sample()
+    assert position not in sampler
+    sampler.restore(position)
+    assert position in sampler and len(sampler) == 3
+
+    assert sampler.remove(position)
+    assert not sampler.remove(position)
+    assert len(sampler) == 2
+
+
+def test_strata_are_drawn_uniformly():
+    # One street with 99 points, one with a single point
+    points = pd.DataFrame({'street_id': ['long'] * 99 + ['short']})
+    short = sum(PointSampler.from_points(points, seed=seed).sample() == 99 for seed in range(400))
+    assert 150 < short < 250
+
+
+def test_accept_stratum_prefers_accepted_streets():
+    points = pd.DataFrame({'street_id': ['covered'] * 10 + ['open'] * 10})
+    sampler = PointSampler.from_points(points, seed=1)
+    drawn = [sampler.sample(accept_stratum=lambda street: street == 'open', tries=16) for _ in range(10)]
+    assert all(position >= 10 for position in drawn)
+    # Only covered streets left: still drawn
+    assert sampler.sample(accept_stratum=lambda street: street == 'open') < 10
+
+
+def test_restore_keeps_strata():
+    points = pd.DataFrame({'street_id': ['a', 'b']})
+    sampler = PointSampler.from_points(points, seed=1)
+    first = sampler.sample()
+    sampler.sample()
+    sampler.restore(first)
+    assert sampler.sample() == first
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+import prefetch
+from prefetch import BackgroundSaver, DatapointPrefetcher
+
+
+def test_producer_errors_reach_get(monkeypatch):
+    monkeypatch.setattr(prefetch, 'RETRY_SECONDS', 0.1)
+
+    def produce():
+        raise LookupError("queue exhausted")
+
+    prefetcher = DatapointPrefetcher(produce)
+    try:
+        with pytest.raises(LookupError, match="queue exhausted"):
+            prefetcher.get(timeout=5)
+    finally:
+        prefetcher.close()
+
+
+def test_get_times_out():
+    prefetcher = DatapointPrefetcher(lambda: time.sleep(10))
+    try:
+        with pytest.raises(TimeoutError):
+            prefetcher.get(timeout=0.2)
+    finally:
+        prefetcher.close()
+
+
+def test_savers_share_the_pool_and_keep_order():
+    threads_before = threading.active_count()
+    savers = [BackgroundSaver() for _ in range(50)]
+    results = {i: [] for i in range(len(savers))}
+    for i, saver in enumerate(savers):
+        for n in range(5):
+            saver.submit(results[i].append, n)
+    for saver in savers:
+        saver.close()
+
+    assert all(values == list(range(5)) for values in results.values())
+    assert threading.active_count() - threads_before <= prefetch.SAVE_WORKERS
+
+
+def test_saver_collects_errors():
+    def save():
+        raise ValueError("S3 down")
+
+    saver = BackgroundSaver()
+    saver.submit(save)
+    saver.close()
+    assert saver.pop_errors() == ["save: S3 down"]
+    assert saver.pending() == 0
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_set_depth_keeps_prefetched_items():
+    counter = iter(range(100))
+    prefetcher = DatapointPrefetcher(lambda: next(counter), depth=1)
+    try:
+        _wait_for(lambda: prefetcher.qsize() == 1)
+        prefetcher.set_depth(3)
+        _wait_for(lambda: prefetcher.qsize() == 3)
+        prefetcher.set_depth(1)
+        # Shrinking drops nothing
+        assert [prefetcher.get(timeout=1) for _ in range(3)] == [0, 1, 2]
+    finally:
+        prefetcher.close()
+
+
+def test_idle_shutdown_returns_every_item():
+    counter = iter(range(100))
+    discarded = []
+    lock = threading.Lock()
+
+    def produce():
+        with lock:
+            return next(counter)
+
+    prefetcher = DatapointPrefetcher(produce, depth=2, idle_timeout=0.3, on_discard=discarded.append)
+    _wait_for(lambda: not prefetcher.alive)
+
+    # The queued items and the one held while the queue was full
+    with lock:
+        produced = next(counter)
+    assert sorted(discarded) == list(range(produced))
+    assert len(discarded) == 3
+
+
+def test_close_returns_the_item_in_hand():
+    discarded = []
+    prefetcher = DatapointPrefetcher(lambda: 'item', depth=1)
+    _wait_for(lambda: prefetcher.qsize() == 1)
+    prefetcher.close(on_discard=discarded.append)
+    _wait_for(lambda: not prefetcher.alive)
+    assert discarded == ['item', 'item']
@@ -0,0 +1,72 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image
+
+from scoring import FeatureCache, Scorer
+from storage import LocalStorage
+
+FOLDERS = ['1_90_42.3300_-83.0500', '2_90_42.3301_-83.0500', '3_90_42.3302_-83.0500', '4_90_42.3303_-83.0500']
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalStorage(str(tmp_path))
+
+
+def test_compact_folds_shards_into_the_snapshot(store):
+    cache = FeatureCache(store)
+    for i, folder_id in enumerate(FOLDERS):
+        cache.put(folder_id, np.full(3, i, dtype=np.float32))
+        cache.flush()
+    assert len(cache._shard_keys()) == len(FOLDERS)
+
+    assert FeatureCache(store).compact() == len(FOLDERS)
+
+    assert cache._shard_keys() == []
+    reloaded = FeatureCache(store)
+    reloaded.load()
+    assert [reloaded.get(folder_id)[0] for folder_id in FOLDERS] == [0, 1, 2, 3]
+
+
+class SlowStore:
+    """
+    Active learning store whose first read blocks until released
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.certainties = {}
+
+    def frame(self):
+        assert self.release.wait(5)
+        return pd.DataFrame({'folder_id': FOLDERS, 'label': [1, 0, 5, 5]})
+
+    def update_many(self, updates, shard='anon'):
+        self.certainties.update({update['folder_id']: update['certainty'] for update in updates})
+
+
+class RecordingQueue:
+    def __init__(self):
+        self.updated = threading.Event()
+
+    def update_certainty(self, folder_id, certainty):
+        self.updated.set()
+
+
+def test_start_does_not_wait_for_the_state(store):
+    al_store, al_queue = SlowStore(), RecordingQueue()
+    images = {folder_id: [Image.new('RGB', (80, 60), (40 * i,) * 3)] for i, folder_id in enumerate(FOLDERS)}
+    scorer = Scorer(al_store, al_queue, load_images=images.get, features=FeatureCache(store))
+
+    # Returns while the active learning table is still being read
+    scorer.start()
+    scorer.submit([(FOLDERS[2], 3)])
+    assert not scorer.ready.is_set()
+
+    al_store.release.set()
+    assert al_queue.updated.wait(10)
+    assert set(al_store.certainties) == {FOLDERS[3]}
+
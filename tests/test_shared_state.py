@@ -0,0 +1,25 @@
+import pytest
+
+import shared_state
+
+
+def test_connecting_without_an_authkey_is_refused(monkeypatch):
+    monkeypatch.setenv(shared_state.STATE_ADDRESS_ENV, 'localhost:50000')
+    monkeypatch.delenv(shared_state.AUTHKEY_ENV, raising=False)
+    monkeypatch.setattr(shared_state, '_coordinator', None)
+    with pytest.raises(RuntimeError):
+        shared_state.get_coordinator()
+
+
+def test_serving_without_an_authkey_is_refused(monkeypatch):
+    monkeypatch.delenv(shared_state.AUTHKEY_ENV, raising=False)
+    # Refused before any state is built
+    monkeypatch.setattr(shared_state, 'Coordinator', lambda: pytest.fail("Coordinator built"))
+    with pytest.raises(RuntimeError):
+        shared_state.serve()
+
+
+def test_no_coordinator_without_an_address(monkeypatch):
+    monkeypatch.delenv(shared_state.STATE_ADDRESS_ENV, raising=False)
+    monkeypatch.delenv(shared_state.AUTHKEY_ENV, raising=False)
+    assert shared_state.get_coordinator() is None